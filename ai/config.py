@@ -10,19 +10,37 @@ from pathlib import Path
 BASE_DIR = Path(__file__).parent.parent
 MODEL_DIR = BASE_DIR / "models"
 DATA_DIR = BASE_DIR / "data"
+LOGS_DIR = BASE_DIR / "logs"
 
-# Create necessary directories
-for directory in [MODEL_DIR, DATA_DIR]:
-    directory.mkdir(parents=True, exist_ok=True)
+def ensure_directories():
+    """
+    Create the model, data and logs directories.
+    
+    Called by the services at startup rather than on import, so importing
+    the configuration has no side effects.
+    """
+    for directory in (MODEL_DIR, DATA_DIR, LOGS_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
 
 # AI Model Configuration
 AI_CONFIG: Dict[str, Any] = {
     "input_shape": (224, 224, 1),
     "feature_dim": 512,
     "dropout_rate": 0.5,
-    "model_path": str(MODEL_DIR / "fingerprint_model.h5"),
+    "model_path": str(MODEL_DIR / "fingerprint_model.h5"),  # loaded by the keras backend when present
     "tflite_path": str(MODEL_DIR / "fingerprint_model.tflite"),
     "onnx_path": str(MODEL_DIR / "fingerprint_model.onnx"),
+    "int8_path": str(MODEL_DIR / "fingerprint_model_int8.tflite"),  # python -m ai.models.quantization
+    # "keras", or "tflite" / "onnx" / "int8" to run the exported model without TensorFlow
+    "inference_backend": os.getenv("INFERENCE_BACKEND", "keras"),
+    "inference_threads": None,  # defaults to the CPU count
+    "compiled_inference": True,  # traced keras inference instead of model.predict
+    # Group concurrent extract_features calls into one forward pass
+    "batching": {
+        "enabled": os.getenv("INFERENCE_BATCHING", "false").lower() == "true",
+        "max_batch_size": 16,
+        "max_wait_ms": 5.0,
+    },
 }
 
 # Fingerprint Processing Configuration
@@ -33,6 +51,7 @@ PROCESSING_CONFIG: Dict[str, Any] = {
     "threshold_c": 2,
     "minutiae_threshold": 0.3,
     "ridge_threshold": 0.5,
+    "enhance": False,  # Fourier domain ridge enhancement for poor captures
 }
 
 # Verification Configuration
@@ -41,8 +60,17 @@ VERIFICATION_CONFIG: Dict[str, Any] = {
     "use_minutiae": True,
     "minutiae_weight": 0.3,
     "ai_weight": 0.7,
+    # AI similarity bands decided without minutiae matching, narrowed to where
+    # minutiae matching could not change the decision (see cascade_limits).
+    # No accept band: with these weights the AI score alone never reaches the threshold
+    "cascade_reject_below": 0.75,
+    "cascade_accept_above": None,
+    "minutiae_matcher": "greedy",  # "hungarian", or "descriptor" for rotation invariant matching
+    "check_quality": True,
     "max_verification_attempts": 3,
     "verification_timeout": 30,  # seconds
+    "verification_workers": None,  # threads for CPU-bound verification, defaults to the CPU count / serve.py workers
+    "admission_max_queue": None,  # verifications waiting for a thread before 429s, defaults to twice the threads
 }
 
 # Blockchain Configuration
@@ -119,9 +147,5 @@ ENV_VARS: Dict[str, str] = {
     "ARWEAVE_KEY_FILE": os.getenv("ARWEAVE_KEY_FILE", ""),
 }
 
-# Create logs directory
-LOGS_DIR = BASE_DIR / "logs"
-LOGS_DIR.mkdir(parents=True, exist_ok=True)
-
 # Update logging config with absolute path
 LOGGING_CONFIG["file"] = str(LOGS_DIR / "app.log") 
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Dynamic micro-batching for fingerprint feature extraction.
+
+Concurrent callers submit single images; a worker thread groups whatever
+arrives within a few milliseconds into one batched forward pass and hands
+each caller its own row of the result.
+"""
+
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+from loguru import logger
+
+# Batchers of this process, reset in forked children (see MicroBatcher._after_fork)
+_batchers: "weakref.WeakSet" = weakref.WeakSet()
+
+def _reset_batchers_after_fork() -> None:
+    for batcher in list(_batchers):
+        batcher._after_fork()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_batchers_after_fork)
+
+class MicroBatcher:
+    def __init__(self,
+                 predict_batch: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0,
+                 max_queue_size: int = 1024):
+        """
+        Initialize the batcher.
+
+        The worker thread starts on the first submit, in the process that
+        submits: a batcher built before serve.py forks its workers would
+        otherwise hand each of them a queue that no thread ever reads.
+
+        Args:
+            predict_batch: Function mapping a stacked batch to one result row per input
+            max_batch_size: Largest batch sent to predict_batch
+            max_wait_ms: How long the first request of a batch waits for others
+            max_queue_size: Pending requests accepted before submit blocks
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'batches': 0,
+            'errors': 0,
+            'max_queue_depth': 0,
+            'total_wait_s': 0.0,
+            'total_batch_s': 0.0,
+        }
+        self._batch_sizes = np.zeros(max_batch_size + 1, dtype=np.int64)
+        self._start_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        _batchers.add(self)
+
+    def submit(self, item: np.ndarray) -> Future:
+        """
+        Queue one input.
+
+        Args:
+            item: Single input, without the batch dimension
+
+        Returns:
+            Future resolving to the input's result row
+        """
+        if self._stop.is_set():
+            raise RuntimeError("MicroBatcher is closed")
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._queue.qsize())
+        return future
+
+    def infer(self, item: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Run one input through the next batch and wait for its result.
+
+        Args:
+            item: Single input, without the batch dimension
+            timeout: Seconds to wait for the result
+
+        Returns:
+            The input's result row
+        """
+        return self.submit(item).result(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the batching metrics.
+
+        Returns:
+            Dictionary with request and batch counts, the current and
+            maximum queue depth, mean batch size, mean queueing delay and
+            mean batch latency, and the batch size histogram
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            histogram = self._batch_sizes.copy()
+        batches = max(stats['batches'], 1)
+        served = int(np.dot(np.arange(len(histogram)), histogram))
+        return {
+            'requests': stats['requests'],
+            'batches': stats['batches'],
+            'errors': stats['errors'],
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': stats['max_queue_depth'],
+            'mean_batch_size': served / batches,
+            'mean_wait_ms': 1000.0 * stats['total_wait_s'] / max(served, 1),
+            'mean_batch_ms': 1000.0 * stats['total_batch_s'] / batches,
+            'batch_size_histogram': {size: int(count) for size, count in enumerate(histogram) if count},
+        }
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """
+        Stop the worker; requests still queued fail.
+
+        Args:
+            timeout: Seconds to wait for the running batch to finish
+        """
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        while True:
+            try:
+                _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(RuntimeError("MicroBatcher is closed"))
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                worker = threading.Thread(target=self._run, name="fingerprint-batcher", daemon=True)
+                worker.start()
+                self._worker = worker
+
+    def _after_fork(self) -> None:
+        """Drop the parent's worker thread, queue and locks in a forked child"""
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._worker = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Collect more requests until the batch is full or the first one has waited long enough
+            batch = [first]
+            deadline = first[2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._process(batch)
+
+    def _process(self, batch) -> None:
+        futures = [future for _, future, _ in batch if future.set_running_or_notify_cancel()]
+        items = [item for item, future, _ in batch if future in futures]
+        if not futures:
+            return
+
+        start = time.monotonic()
+        try:
+            results = self.predict_batch(np.stack(items))
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error in batched inference: {str(e)}")
+            for future in futures:
+                future.set_exception(e)
+            with self._stats_lock:
+                self._stats['errors'] += 1
+        finished = time.monotonic()
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['total_batch_s'] += finished - start
+            self._stats['total_wait_s'] += sum(start - queued for _, _, queued in batch)
+            self._batch_sizes[len(items)] += 1
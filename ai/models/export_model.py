@@ -0,0 +1,75 @@
+"""
+Export the fingerprint model to TFLite and ONNX and check embedding parity.
+
+Usage:
+    python -m ai.models.export_model --formats tflite onnx
+    python -m ai.models.export_model --weights models/fingerprint_model.h5 --images data/fingerprints
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from ..config import AI_CONFIG
+from ..preprocessing.fingerprint_processor import FingerprintProcessor
+from .fingerprint_model import FingerprintModel
+from .inference_backends import check_parity, export_onnx, export_tflite, load_backend
+
+EXPORTERS = {"tflite": export_tflite, "onnx": export_onnx}
+
+def parity_batch(images_dir: str = None, count: int = 16) -> np.ndarray:
+    """
+    Build the preprocessed batch used for the parity check.
+
+    Args:
+        images_dir: Directory of fingerprint images, random images if None
+        count: Number of images
+
+    Returns:
+        float32 array of shape (count, height, width, 1)
+    """
+    processor = FingerprintProcessor()
+    if images_dir:
+        paths = sorted(path for path in Path(images_dir).iterdir()
+                       if path.suffix.lower() in {".jpg", ".jpeg", ".png", ".bmp", ".tif"})[:count]
+        images = [cv2.imread(str(path), cv2.IMREAD_GRAYSCALE) for path in paths]
+        images = [image for image in images if image is not None]
+    else:
+        rng = np.random.default_rng(0)
+        images = list((rng.random((count, 300, 300)) * 255).astype(np.uint8))
+    if not images:
+        raise ValueError(f"No fingerprint images found in {images_dir}")
+    return processor.preprocess_batch(images).astype(np.float32)[..., np.newaxis]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXPORTERS), default=sorted(EXPORTERS), help="Formats to export")
+    parser.add_argument("--weights", default=None, help="Saved Keras model to export, the freshly built model if omitted")
+    parser.add_argument("--images", default=None, help="Fingerprint images for the parity check, random images if omitted")
+    parser.add_argument("--min-cosine", type=float, default=0.999, help="Minimum embedding cosine similarity to pass")
+    args = parser.parse_args(argv)
+
+    model = FingerprintModel(
+        input_shape=AI_CONFIG["input_shape"],
+        feature_dim=AI_CONFIG["feature_dim"],
+        dropout_rate=AI_CONFIG["dropout_rate"]
+    )
+    if args.weights:
+        model.load_model(args.weights)
+
+    batch = parity_batch(args.images)
+    passed = True
+    for fmt in args.formats:
+        path = EXPORTERS[fmt](model.model, AI_CONFIG[f"{fmt}_path"])
+        report = check_parity(model.backend, load_backend(fmt, path=path), batch, args.min_cosine)
+        logger.info(f"{fmt} parity: min cosine {report['min_cosine']:.6f}, "
+                    f"max abs diff {report['max_abs_diff']:.2e} -> {'ok' if report['passed'] else 'FAILED'}")
+        passed &= report["passed"]
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,30 @@
 """
 Fingerprint feature extraction model using MobileNetV2.
+
+TensorFlow is only imported for the keras backend; the tflite and onnx
+backends run exported models without it.
 """
 
-import tensorflow as tf
-from tensorflow.keras import layers, Model
+import os
+import time
 from typing import Tuple, Optional
 import numpy as np
 from loguru import logger
 import cv2
 
+from .batching import MicroBatcher
+from .inference_backends import InferenceBackend, file_digest, load_backend
+
 class FingerprintModel:
     def __init__(self,
                  input_shape: Tuple[int, int, int] = (224, 224, 1),
                  feature_dim: int = 512,
-                 dropout_rate: float = 0.5):
+                 dropout_rate: float = 0.5,
+                 backend: str = "keras",
+                 backend_path: Optional[str] = None,
+                 num_threads: Optional[int] = None,
+                 compiled: bool = True,
+                 weights_path: Optional[str] = None):
         """
         Initialize the fingerprint model.
         
@@ -21,13 +32,132 @@ class FingerprintModel:
             input_shape: Input shape (height, width, channels)
             feature_dim: Dimension of the output feature vector
             dropout_rate: Dropout rate for regularization
+            backend: Inference backend, 'keras', 'tflite', 'onnx' or 'int8'
+            backend_path: Exported model file for the tflite and onnx backends
+            num_threads: Threads used by the tflite and onnx runtimes
+            compiled: Run the keras backend through a traced inference function
+            weights_path: Saved keras model to load instead of building a new one;
+                templates are then versioned on this file
         """
         self.input_shape = input_shape
         self.feature_dim = feature_dim
         self.dropout_rate = dropout_rate
-        self.model = self._build_model()
+        self._weights_digest = None
+        self._weights_file: Optional[str] = None
+        self._batcher: Optional[MicroBatcher] = None
+        
+        # Seconds spent building the backend and warming it up
+        self.startup_timings = {}
+        start = time.perf_counter()
+        if backend == "keras":
+            if weights_path is not None and os.path.exists(weights_path):
+                # Persisted weights keep embeddings, and so template versions,
+                # the same across restarts and forked workers
+                import tensorflow as tf
+                
+                self.model = tf.keras.models.load_model(weights_path)
+                self._weights_file = weights_path
+            else:
+                self.model = self._build_model()
+            self.backend: InferenceBackend = load_backend(backend, self.model, compiled=compiled)
+        else:
+            # Exported models carry their own weights, no Keras model is built
+            self.model = None
+            self.backend = load_backend(backend, path=backend_path, num_threads=num_threads)
+        self.compiled = compiled
+        self.startup_timings["build"] = time.perf_counter() - start
+        self.warmup()
+        
+    @classmethod
+    def from_config(cls, config: dict) -> "FingerprintModel":
+        """
+        Create a model with the backend selected in a config dictionary.
+        
+        Args:
+            config: AI_CONFIG style dictionary
+            
+        Returns:
+            FingerprintModel
+        """
+        backend = config.get("inference_backend", "keras")
+        model = cls(
+            input_shape=tuple(config["input_shape"]),
+            feature_dim=config["feature_dim"],
+            dropout_rate=config["dropout_rate"],
+            backend=backend,
+            backend_path=config.get(f"{backend}_path"),
+            num_threads=config.get("inference_threads"),
+            compiled=config.get("compiled_inference", True),
+            weights_path=config.get("model_path")
+        )
+        batching = config.get("batching", {})
+        if batching.get("enabled"):
+            model.enable_batching(batching.get("max_batch_size", 16), batching.get("max_wait_ms", 5.0))
+        return model
+        
+    @staticmethod
+    def config_weights_digest(config: dict) -> Optional[str]:
+        """
+        Weights digest of the model from_config would create, without creating it.
+        
+        Models loaded from a file, exported or a saved keras model, are
+        identified by that file, so the digest matches weights_digest() of the
+        loaded model. Without a saved file a keras model only has its weights
+        once it is built, so there is no digest for it here.
         
-    def _build_model(self) -> Model:
+        Args:
+            config: AI_CONFIG style dictionary
+            
+        Returns:
+            Hex digest, or None when the model has to be built to know it
+        """
+        backend = config.get("inference_backend", "keras")
+        path = config.get("model_path" if backend == "keras" else f"{backend}_path")
+        if path is None or not os.path.exists(path):
+            return None
+        return file_digest(path)
+        
+    def warmup(self):
+        """
+        Run one forward pass on a blank image so the first request does not
+        pay for tracing the graph or allocating runtime buffers.
+        """
+        start = time.perf_counter()
+        self.backend.warmup(self.input_shape)
+        self.startup_timings["warmup"] = time.perf_counter() - start
+        logger.info(f"{self.backend.name} backend warmed up in {self.startup_timings['warmup'] * 1000:.0f} ms")
+        
+    def enable_batching(self, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        """
+        Route extract_features through a micro-batching queue.
+        
+        Concurrent callers are grouped into one forward pass of up to
+        max_batch_size images; a lone caller waits at most max_wait_ms.
+        
+        Args:
+            max_batch_size: Largest batch per forward pass
+            max_wait_ms: How long a request waits for others to join its batch
+        """
+        self.disable_batching()
+        self._batcher = MicroBatcher(lambda batch: self.backend.predict(batch), max_batch_size, max_wait_ms)
+        logger.info(f"Micro-batching enabled (max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+        
+    def disable_batching(self):
+        """Stop the micro-batching queue, if any."""
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
+            
+    def batching_stats(self) -> Optional[dict]:
+        """
+        Get the micro-batching metrics.
+        
+        Returns:
+            MicroBatcher.stats() dictionary, or None when batching is off
+        """
+        return self._batcher.stats() if self._batcher is not None else None
+        
+    def _build_model(self):
         """
         Build the MobileNetV2-based model for fingerprint feature extraction.
         
@@ -35,6 +165,9 @@ class FingerprintModel:
             Compiled Keras model
         """
         try:
+            import tensorflow as tf
+            from tensorflow.keras import layers, Model
+            
             # Load pre-trained MobileNetV2
             base_model = tf.keras.applications.MobileNetV2(
                 input_shape=self.input_shape,
@@ -59,17 +192,21 @@ class FingerprintModel:
             # Global average pooling
             x = layers.GlobalAveragePooling2D()(x)
             
-            # Add dense layers for feature extraction
-            x = layers.Dense(1024, activation='relu')(x)
+            # Add dense layers for feature extraction; seeded, so every build
+            # of an untrained head has the same weights and template version
+            x = layers.Dense(1024, activation='relu',
+                             kernel_initializer=tf.keras.initializers.GlorotUniform(seed=1))(x)
             x = layers.BatchNormalization()(x)
             x = layers.Dropout(self.dropout_rate)(x)
             
-            x = layers.Dense(512, activation='relu')(x)
+            x = layers.Dense(512, activation='relu',
+                             kernel_initializer=tf.keras.initializers.GlorotUniform(seed=2))(x)
             x = layers.BatchNormalization()(x)
             x = layers.Dropout(self.dropout_rate)(x)
             
             # Output layer
-            outputs = layers.Dense(self.feature_dim, activation='linear')(x)
+            outputs = layers.Dense(self.feature_dim, activation='linear',
+                                   kernel_initializer=tf.keras.initializers.GlorotUniform(seed=3))(x)
             
             # Create and compile model
             model = Model(inputs=inputs, outputs=outputs)
@@ -103,11 +240,15 @@ class FingerprintModel:
                 image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
                 image = np.expand_dims(image, axis=-1)
                 
+            if self._batcher is not None:
+                features = self._batcher.infer(image.astype(np.float32))
+                return features / np.linalg.norm(features)
+                
             # Add batch dimension
-            image = np.expand_dims(image, axis=0)
+            image = np.expand_dims(image, axis=0).astype(np.float32)
             
             # Extract features
-            features = self.model.predict(image, verbose=0)
+            features = self.backend.predict(image)
             
             # Normalize features
             features = features / np.linalg.norm(features)
@@ -118,6 +259,28 @@ class FingerprintModel:
             logger.error(f"Error extracting features: {str(e)}")
             raise
             
+    def extract_features_batch(self, images: np.ndarray) -> np.ndarray:
+        """
+        Extract features from a stack of preprocessed fingerprint images.
+        
+        Args:
+            images: Preprocessed images of shape (N, height, width) or (N, height, width, 1)
+            
+        Returns:
+            Normalized feature vectors of shape (N, feature_dim)
+        """
+        try:
+            batch = np.asarray(images, dtype=np.float32)
+            if batch.ndim == 3:
+                batch = batch[..., np.newaxis]
+            
+            features = self.backend.predict(batch)
+            return features / np.linalg.norm(features, axis=1, keepdims=True)
+            
+        except Exception as e:
+            logger.error(f"Error extracting batch features: {str(e)}")
+            raise
+            
     def compute_similarity(self, 
                           features1: np.ndarray, 
                           features2: np.ndarray) -> float:
@@ -148,6 +311,25 @@ class FingerprintModel:
             logger.error(f"Error computing similarity: {str(e)}")
             raise
             
+    def weights_digest(self) -> str:
+        """
+        Compute a digest of the current model weights.
+        
+        Feature vectors are only comparable when produced by the same
+        weights, so the digest is used to version stored templates. A keras
+        model loaded from a file is identified by that file, like the
+        exported models.
+        
+        Returns:
+            Hex digest of the model weights
+        """
+        if self._weights_digest is None:
+            if self._weights_file is not None:
+                self._weights_digest = file_digest(self._weights_file)
+            else:
+                self._weights_digest = self.backend.weights_digest()
+        return self._weights_digest
+        
     def save_model(self, path: str):
         """
         Save the model to disk.
@@ -155,6 +337,8 @@ class FingerprintModel:
         Args:
             path: Path to save the model
         """
+        if self.model is None:
+            raise RuntimeError(f"The {self.backend.name} backend has no Keras model to save")
         try:
             self.model.save(path)
             logger.info(f"Model saved to {path}")
@@ -170,7 +354,13 @@ class FingerprintModel:
             path: Path to the saved model
         """
         try:
+            import tensorflow as tf
+            
             self.model = tf.keras.models.load_model(path)
+            self.backend = load_backend("keras", self.model, compiled=self.compiled)
+            self._weights_file = path
+            self._weights_digest = None
+            self.warmup()
             logger.info(f"Model loaded from {path}")
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
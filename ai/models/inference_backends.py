@@ -0,0 +1,307 @@
+"""
+Pluggable inference backends for the fingerprint feature extractor.
+
+The Keras backend needs TensorFlow. The TFLite backend prefers the
+standalone LiteRT / tflite-runtime interpreters and the ONNX backend only
+needs onnxruntime, so polling-station boxes can extract features without
+importing TensorFlow at all.
+"""
+
+import os
+import hashlib
+import threading
+import numpy as np
+from typing import Any, Dict, Optional
+from loguru import logger
+
+BACKENDS = ("keras", "tflite", "onnx", "int8")
+
+class InferenceBackend:
+    """Runs the feature extractor on a batch of preprocessed images"""
+
+    name = "base"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run a forward pass.
+
+        Args:
+            batch: float32 array of shape (N, height, width, 1)
+
+        Returns:
+            Raw (unnormalised) features of shape (N, feature_dim)
+        """
+        raise NotImplementedError
+
+    def weights_digest(self) -> str:
+        """
+        Digest identifying the weights the backend runs.
+
+        Returns:
+            Hex digest of the weights
+        """
+        raise NotImplementedError
+
+    def warmup(self, input_shape) -> None:
+        """
+        Run one throwaway forward pass so the first real request does not
+        pay for graph building or buffer allocation.
+
+        Args:
+            input_shape: Input shape (height, width, channels)
+        """
+        self.predict(np.zeros((1,) + tuple(input_shape), dtype=np.float32))
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def __init__(self, model, compiled: bool = True):
+        """
+        Args:
+            model: Keras model
+            compiled: Run a traced inference function instead of model.predict
+        """
+        self.model = model
+        self._infer = self._trace(model) if compiled else None
+
+    @staticmethod
+    def _trace(model):
+        """
+        Trace the model once for any batch size. model.predict builds a
+        data pipeline and callbacks on every call, which costs more than
+        the forward pass itself for a single image.
+        """
+        import tensorflow as tf
+
+        signature = tf.TensorSpec((None,) + tuple(model.inputs[0].shape[1:]), tf.float32)
+
+        @tf.function(input_signature=[signature])
+        def infer(batch):
+            # Dropout off and BatchNorm on its moving statistics
+            return model(batch, training=False)
+
+        return infer
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        if self._infer is None:
+            return self.model.predict(batch, verbose=0)
+        return self._infer(np.asarray(batch, dtype=np.float32)).numpy()
+
+    def weights_digest(self) -> str:
+        digest = hashlib.sha256()
+        for weights in self.model.get_weights():
+            digest.update(np.ascontiguousarray(weights).tobytes())
+        return digest.hexdigest()[:16]
+
+def file_digest(path: str) -> str:
+    """
+    Digest of an exported model file, the weights digest of the backend running it.
+
+    Args:
+        path: Model file
+
+    Returns:
+        Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+class _FileBackend(InferenceBackend):
+    """Backend running an exported model file"""
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Exported model not found: {path}")
+        self.path = path
+        self._digest = None
+
+    def weights_digest(self) -> str:
+        if self._digest is None:
+            self._digest = file_digest(self.path)
+        return self._digest
+
+def _tflite_interpreter_class():
+    """Lightest available TFLite interpreter"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+class TFLiteBackend(_FileBackend):
+    name = "tflite"
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        """
+        Args:
+            path: Path to the .tflite model
+            num_threads: Interpreter threads, defaults to the CPU count
+        """
+        super().__init__(path)
+        self.interpreter = _tflite_interpreter_class()(model_path=path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter is not thread-safe, and request threads share it
+        self._lock = threading.Lock()
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=self._input["dtype"])
+        with self._lock:
+            # Tensors are resized only when the batch size changes
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output["index"]).copy()
+
+class Int8Backend(TFLiteBackend):
+    """
+    Full-integer model written by ai.models.quantization. It keeps float32
+    input and output, so it runs exactly like the float TFLite model.
+    """
+
+    name = "int8"
+
+class OnnxBackend(_FileBackend):
+    name = "onnx"
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        """
+        Args:
+            path: Path to the .onnx model
+            num_threads: Intra-op threads, defaults to the CPU count
+        """
+        super().__init__(path)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self._input_name: batch})[0]
+
+def load_backend(name: str,
+                 model=None,
+                 path: Optional[str] = None,
+                 num_threads: Optional[int] = None,
+                 compiled: bool = True) -> InferenceBackend:
+    """
+    Create an inference backend.
+
+    Args:
+        name: 'keras', 'tflite', 'onnx' or 'int8'
+        model: Keras model, for the keras backend
+        path: Exported model file, for the tflite, onnx and int8 backends
+        num_threads: Threads used by the tflite, onnx and int8 runtimes
+        compiled: Run a traced inference function instead of model.predict,
+            for the keras backend
+
+    Returns:
+        Inference backend
+    """
+    if name == "keras":
+        if model is None:
+            raise ValueError("The keras backend needs a model")
+        return KerasBackend(model, compiled)
+    if name == "tflite":
+        return TFLiteBackend(path, num_threads)
+    if name == "onnx":
+        return OnnxBackend(path, num_threads)
+    if name == "int8":
+        return Int8Backend(path, num_threads)
+    raise ValueError(f"Unknown inference backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+def export_tflite(model, path: str) -> str:
+    """
+    Export a Keras model to TFLite.
+
+    Args:
+        model: Keras model
+        path: Output .tflite path
+
+    Returns:
+        The output path
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    flatbuffer = converter.convert()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(flatbuffer)
+    logger.info(f"TFLite model exported to {path}")
+    return path
+
+def export_onnx(model, path: str, opset: int = 17) -> str:
+    """
+    Export a Keras model to ONNX (requires tf2onnx).
+
+    Args:
+        model: Keras model
+        path: Output .onnx path
+        opset: ONNX opset version
+
+    Returns:
+        The output path
+    """
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("ONNX export requires tf2onnx: pip install tf2onnx")
+
+    input_shape = tuple(model.inputs[0].shape[1:])
+    signature = (tf.TensorSpec((None,) + input_shape, tf.float32, name="input"),)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=path)
+    logger.info(f"ONNX model exported to {path}")
+    return path
+
+def check_parity(reference: InferenceBackend,
+                 candidate: InferenceBackend,
+                 batch: np.ndarray,
+                 min_cosine: float = 0.999) -> Dict[str, Any]:
+    """
+    Compare the embeddings of two backends on the same inputs.
+
+    Args:
+        reference: Backend taken as ground truth, usually keras
+        candidate: Backend under test
+        batch: Preprocessed images of shape (N, height, width, 1)
+        min_cosine: Minimum cosine similarity required for every image
+
+    Returns:
+        Dictionary with the minimum and mean cosine similarity, the maximum
+        absolute difference of the normalised embeddings, and 'passed'
+    """
+    expected = reference.predict(batch)
+    actual = candidate.predict(batch)
+    expected = expected / np.linalg.norm(expected, axis=1, keepdims=True)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    cosine = np.sum(expected * actual, axis=1)
+    return {
+        "reference": reference.name,
+        "candidate": candidate.name,
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+        "passed": bool(cosine.min() >= min_cosine),
+    }
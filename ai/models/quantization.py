@@ -0,0 +1,251 @@
+"""
+Post-training INT8 quantisation of the fingerprint model.
+
+Calibrates on a representative fingerprint set, converts the model to a
+full-integer TFLite model and compares it against the float model: latency,
+memory, embedding drift and, most importantly, how many match decisions
+change at the verification threshold. The INT8 model is only written to its
+final path when the accuracy gates pass; INFERENCE_BACKEND=int8 serves it.
+
+Usage:
+    python -m ai.models.quantization
+    python -m ai.models.quantization --dataset dummy_dataset --max-flip-rate 0.005
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from ..config import AI_CONFIG, VERIFICATION_CONFIG
+from ..preprocessing.fingerprint_processor import FingerprintProcessor
+from .fingerprint_model import FingerprintModel
+from .inference_backends import InferenceBackend, Int8Backend
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".tif"}
+
+def synthetic_fingerprints(count: int, impressions: int = 2, size: int = 300, seed: int = 0) -> List[np.ndarray]:
+    """
+    Render synthetic fingerprints, several impressions per finger.
+
+    Each finger is an elliptic ridge pattern with its own centre, period and
+    aspect; impressions of the same finger differ by a small shift, rotation,
+    pressure (blur) and sensor noise.
+
+    Args:
+        count: Number of fingers
+        impressions: Impressions per finger
+        size: Image side length
+        seed: Random seed
+
+    Returns:
+        List of count * impressions uint8 images, impressions of a finger adjacent
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size].astype(np.float32)
+    images = []
+    for _ in range(count):
+        cy, cx = rng.uniform(0.35, 0.65, 2) * size
+        period = rng.uniform(7.0, 11.0)
+        aspect = rng.uniform(1.1, 1.5)
+        for _ in range(impressions):
+            dy, dx = rng.normal(0, 4, 2)
+            radius = np.hypot(yy - cy - dy, (xx - cx - dx) * aspect)
+            image = np.where(np.sin(2 * np.pi * radius / period) > 0, 60, 200).astype(np.float32)
+            rotation = cv2.getRotationMatrix2D((size / 2, size / 2), rng.normal(0, 5), 1.0)
+            image = cv2.warpAffine(image, rotation, (size, size), borderValue=200)
+            image = cv2.GaussianBlur(image, (5, 5), rng.uniform(0.5, 1.5)) + rng.normal(0, 15, image.shape)
+            images.append(np.clip(image, 0, 255).astype(np.uint8))
+    return images
+
+def load_fingerprint_images(dataset_dir: str, limit: Optional[int] = None) -> List[np.ndarray]:
+    """
+    Load fingerprint images from a directory, including the
+    <voter_id>/fingerprint.jpg layout of the dummy dataset.
+
+    Args:
+        dataset_dir: Directory to search recursively
+        limit: Maximum number of images
+
+    Returns:
+        List of grayscale uint8 images
+    """
+    paths = sorted(path for path in Path(dataset_dir).rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)
+    images = [cv2.imread(str(path), cv2.IMREAD_GRAYSCALE) for path in paths[:limit]]
+    images = [image for image in images if image is not None]
+    if not images:
+        raise ValueError(f"No fingerprint images found in {dataset_dir}")
+    return images
+
+def quantize_int8(model, calibration: np.ndarray, path: str) -> str:
+    """
+    Convert a Keras model to a full-integer TFLite model.
+
+    Weights and activations are INT8; the model keeps float32 input and
+    output so it is a drop-in replacement for the float TFLite model.
+
+    Args:
+        model: Keras model
+        calibration: Preprocessed images of shape (N, height, width, 1) used
+            to calibrate the activation ranges
+        path: Output .tflite path
+
+    Returns:
+        The output path
+    """
+    import tensorflow as tf
+
+    def representative_dataset():
+        for image in calibration:
+            yield [image[np.newaxis].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    flatbuffer = converter.convert()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(flatbuffer)
+    logger.info(f"INT8 model written to {path} ({len(flatbuffer) / 1e6:.1f} MB)")
+    return path
+
+def _normalize(features: np.ndarray) -> np.ndarray:
+    # Embeddings quantised to all zeros stay zero instead of turning into NaN
+    return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+def _match_decisions(features: np.ndarray, thresholds: List[float]) -> np.ndarray:
+    """Decision band of every pair of images, scored like compute_similarity"""
+    features = _normalize(features)
+    similarity = (features @ features.T + 1) / 2
+    upper = np.triu_indices(len(features), k=1)
+    return np.digitize(similarity[upper], sorted(thresholds))
+
+def _latency_ms(backend: InferenceBackend, batch: np.ndarray, repeats: int) -> Dict[str, float]:
+    latencies = []
+    for i in range(repeats):
+        image = batch[i % len(batch)][np.newaxis]
+        start = time.perf_counter()
+        backend.predict(image)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+def _rss_mb() -> Optional[float]:
+    """Current resident set size, Linux only"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return None
+
+def compare_models(reference: InferenceBackend,
+                   candidate: InferenceBackend,
+                   batch: np.ndarray,
+                   thresholds: List[float],
+                   repeats: int = 50) -> Dict[str, Any]:
+    """
+    Compare a quantised model against the float model.
+
+    Args:
+        reference: Float model backend
+        candidate: Quantised model backend
+        batch: Preprocessed evaluation images of shape (N, height, width, 1)
+        thresholds: Similarity thresholds match decisions are taken at
+        repeats: Single-image runs per model for the latency figures
+
+    Returns:
+        Dictionary with the embedding cosine drift, the number and rate of
+        image pairs that land on the other side of a threshold, and the
+        latency of both models
+    """
+    expected = reference.predict(batch)
+    actual = candidate.predict(batch)
+    cosine = np.sum(_normalize(expected) * _normalize(actual), axis=1)
+
+    reference_decisions = _match_decisions(expected, thresholds)
+    candidate_decisions = _match_decisions(actual, thresholds)
+    flips = int(np.sum(reference_decisions != candidate_decisions))
+
+    return {
+        "images": len(batch),
+        "pairs": len(reference_decisions),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "decision_flips": flips,
+        "flip_rate": flips / max(len(reference_decisions), 1),
+        "reference_latency": _latency_ms(reference, batch, repeats),
+        "candidate_latency": _latency_ms(candidate, batch, repeats),
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", default=None, help="Saved Keras model to quantise, the freshly built model if omitted")
+    parser.add_argument("--dataset", default=None, help="Fingerprint images, synthetic fingerprints if omitted")
+    parser.add_argument("--calibration-size", type=int, default=100, help="Images used for calibration")
+    parser.add_argument("--eval-size", type=int, default=64, help="Held-out images used for the accuracy gates")
+    parser.add_argument("--output", default=AI_CONFIG["int8_path"], help="Where to write the INT8 model")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Minimum embedding cosine similarity per image")
+    parser.add_argument("--max-flip-rate", type=float, default=0.01, help="Maximum share of match decisions allowed to change")
+    args = parser.parse_args(argv)
+
+    if args.dataset:
+        images = load_fingerprint_images(args.dataset, args.calibration_size + args.eval_size)
+        if len(images) <= args.eval_size:
+            raise ValueError(f"Need more than {args.eval_size} images in {args.dataset}")
+    else:
+        images = synthetic_fingerprints((args.calibration_size + args.eval_size) // 2)
+    # Impressions of a finger are adjacent, so a split keeps genuine pairs in the evaluation set
+    batch = FingerprintProcessor().preprocess_batch(images).astype(np.float32)[..., np.newaxis]
+    calibration, evaluation = batch[:-args.eval_size], batch[-args.eval_size:]
+
+    model = FingerprintModel(
+        input_shape=AI_CONFIG["input_shape"],
+        feature_dim=AI_CONFIG["feature_dim"],
+        dropout_rate=AI_CONFIG["dropout_rate"]
+    )
+    if args.weights:
+        model.load_model(args.weights)
+
+    candidate_path = args.output + ".candidate"
+    quantize_int8(model.model, calibration, candidate_path)
+    rss_before = _rss_mb()
+    candidate = Int8Backend(candidate_path)
+    candidate.warmup(AI_CONFIG["input_shape"])
+    rss_after = _rss_mb()
+
+    # The cascade bands decide on the AI score alone, the similarity threshold decides the rest
+    thresholds = [VERIFICATION_CONFIG[key] for key in ("cascade_reject_below", "similarity_threshold", "cascade_accept_above")
+                  if VERIFICATION_CONFIG[key] is not None]
+    report = compare_models(model.backend, candidate, evaluation, thresholds)
+    passed = report["min_cosine"] >= args.min_cosine and report["flip_rate"] <= args.max_flip_rate
+
+    keras_size = sum(weights.nbytes for weights in model.model.get_weights()) / 1e6
+    logger.info(f"Weights: {keras_size:.1f} MB float32 -> {os.path.getsize(candidate_path) / 1e6:.1f} MB INT8"
+                + (f", interpreter resident memory {rss_after - rss_before:.1f} MB" if rss_before else ""))
+    logger.info(f"Latency p50/p99: float {report['reference_latency']['p50_ms']:.1f}/"
+                f"{report['reference_latency']['p99_ms']:.1f} ms, INT8 {report['candidate_latency']['p50_ms']:.1f}/"
+                f"{report['candidate_latency']['p99_ms']:.1f} ms")
+    logger.info(f"Embedding cosine min {report['min_cosine']:.4f} mean {report['mean_cosine']:.4f}; "
+                f"{report['decision_flips']}/{report['pairs']} match decisions changed ({report['flip_rate']:.2%})")
+
+    if not passed:
+        os.remove(candidate_path)
+        logger.error(f"INT8 model rejected: needs min cosine >= {args.min_cosine} "
+                     f"and flip rate <= {args.max_flip_rate:.2%}")
+        return 1
+    os.replace(candidate_path, args.output)
+    logger.info(f"INT8 model accepted: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
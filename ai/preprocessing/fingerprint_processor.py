@@ -5,15 +5,55 @@ Handles image enhancement, normalization, and feature extraction.
 
 import cv2
 import numpy as np
-from typing import Tuple, Optional
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Optional, Dict, Any, Sequence, Union
 from loguru import logger
 
+from .enhancement import RidgeEnhancer
+from .quality import to_gray_uint8
+
+# Weights of the 8 neighbours, clockwise from north, for neighbourhood codes
+NEIGHBOR_WEIGHTS = np.array([[128, 1, 2],
+                             [64, 0, 4],
+                             [32, 16, 8]], dtype=np.float32)
+
+def _neighbor_bits(code: int) -> list:
+    """Neighbour values P2..P9 (clockwise from north) of a neighbourhood code"""
+    return [(code >> bit) & 1 for bit in range(8)]
+
+def _crossing_number(code: int) -> int:
+    bits = _neighbor_bits(code)
+    return sum(abs(bits[i] - bits[(i + 1) % 8]) for i in range(8)) // 2
+
+def _zhang_suen_deletable(code: int, step: int) -> bool:
+    p2, p3, p4, p5, p6, p7, p8, p9 = _neighbor_bits(code)
+    if not 2 <= p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9 <= 6 or _crossing_number(code) != 1:
+        return False
+    if step == 0:
+        return p2 * p4 * p6 == 0 and p4 * p6 * p8 == 0
+    return p2 * p4 * p8 == 0 and p2 * p6 * p8 == 0
+
+# Structuring element of the closing that fills small ridge gaps
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+
+# Lookup tables indexed by neighbourhood code
+CROSSING_NUMBER_LUT = np.array([_crossing_number(code) for code in range(256)], dtype=np.uint8)
+THINNING_LUTS = [np.array([_zhang_suen_deletable(code, step) for code in range(256)]) for step in (0, 1)]
+
 class FingerprintProcessor:
     def __init__(self, 
                  image_size: Tuple[int, int] = (224, 224),
                  gaussian_kernel_size: Tuple[int, int] = (5, 5),
                  threshold_block_size: int = 11,
-                 threshold_c: int = 2):
+                 threshold_c: int = 2,
+                 ridge_threshold: float = 0.5,
+                 minutiae_border: int = 10,
+                 min_minutiae_distance: int = 6,
+                 enhance: bool = False):
         """
         Initialize the fingerprint processor with configuration parameters.
         
@@ -22,74 +62,206 @@ class FingerprintProcessor:
             gaussian_kernel_size: Kernel size for Gaussian blur
             threshold_block_size: Block size for adaptive thresholding
             threshold_c: Constant subtracted from mean for thresholding
+            ridge_threshold: Value above which a preprocessed pixel is ridge
+            minutiae_border: Minutiae closer than this many pixels to the edge
+                of the fingerprint area are discarded
+            min_minutiae_distance: Minutiae closer than this many pixels to
+                another minutia are discarded as spurious
+            enhance: Whether to apply Fourier domain ridge enhancement instead
+                of the Gaussian blur before thresholding
         """
         self.image_size = image_size
         self.gaussian_kernel_size = gaussian_kernel_size
         self.threshold_block_size = threshold_block_size
         self.threshold_c = threshold_c
+        self.ridge_threshold = ridge_threshold
+        self.minutiae_border = minutiae_border
+        self.min_minutiae_distance = min_minutiae_distance
+        self.enhancer = RidgeEnhancer() if enhance else None
+        
+        # Batch preprocessing state
+        self._local = threading.local()
+        self._executor = None
+        self._executor_workers = 0
+        self._executor_lock = threading.Lock()
+        
+    def get_config(self) -> Dict[str, Any]:
+        """
+        Get the parameters that affect the processing output.
+        
+        Returns:
+            Dictionary of processing parameters
+        """
+        config = {
+            'image_size': list(self.image_size),
+            'gaussian_kernel_size': list(self.gaussian_kernel_size),
+            'threshold_block_size': self.threshold_block_size,
+            'threshold_c': self.threshold_c,
+            'ridge_threshold': self.ridge_threshold,
+            'minutiae_border': self.minutiae_border,
+            'min_minutiae_distance': self.min_minutiae_distance,
+        }
+        if self.enhancer is not None:
+            config['enhancement'] = self.enhancer.get_config()
+        return config
+        
+    def config_digest(self) -> str:
+        """
+        Compute a short digest of the processing configuration.
+        
+        Returns:
+            Hex digest identifying the processing configuration
+        """
+        config = json.dumps(self.get_config(), sort_keys=True)
+        return hashlib.sha256(config.encode()).hexdigest()[:16]
         
     def preprocess_image(self, image: np.ndarray) -> np.ndarray:
         """
         Preprocess the fingerprint image through multiple stages.
         
         Args:
-            image: Input fingerprint image (grayscale)
+            image: Input fingerprint image (grayscale, uint8 or float in [0, 1])
             
         Returns:
             Processed image ready for feature extraction
         """
         try:
-            # Resize image to standard size
-            image = cv2.resize(image, self.image_size)
+            output = np.empty(self._output_shape, dtype=np.uint8)
+            self._preprocess_into(image, output, self._scratch_buffers())
+            return output
             
-            # Apply Gaussian blur to reduce noise
-            blurred = cv2.GaussianBlur(image, self.gaussian_kernel_size, 0)
+        except Exception as e:
+            logger.error(f"Error in preprocessing: {str(e)}")
+            raise
             
-            # Apply adaptive thresholding
-            binary = cv2.adaptiveThreshold(
-                blurred,
-                255,
-                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY_INV,
-                self.threshold_block_size,
-                self.threshold_c
-            )
+    def preprocess_batch(self,
+                         images: Union[np.ndarray, Sequence[np.ndarray]],
+                         out: Optional[np.ndarray] = None,
+                         workers: Optional[int] = None) -> np.ndarray:
+        """
+        Preprocess a stack of fingerprint images.
+        
+        Every stage writes into preallocated buffers, and the images are
+        split across a thread pool (OpenCV releases the GIL).
+        
+        Args:
+            images: Stack of images, or a list of images of any size
+            out: Optional (N, height, width) uint8 array to write the results to
+            workers: Number of threads, defaults to the CPU count
             
-            # Apply morphological operations
-            kernel = np.ones((3,3), np.uint8)
-            morph = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        Returns:
+            Stack of processed images, same values as preprocess_image
+        """
+        try:
+            count = len(images)
+            if out is None:
+                out = np.empty((count,) + self._output_shape, dtype=np.uint8)
+            elif out.shape != (count,) + self._output_shape or out.dtype != np.uint8:
+                raise ValueError(f"Output buffer must be uint8 of shape {(count,) + self._output_shape}")
             
-            # Normalize the image
-            normalized = cv2.normalize(morph, None, 0, 1, cv2.NORM_MINMAX)
+            workers = min(workers or os.cpu_count() or 1, count)
+            if workers <= 1:
+                self._preprocess_range(images, out, 0, count)
+                return out
             
-            return normalized
+            # One contiguous chunk per thread keeps scheduling overhead negligible
+            bounds = np.linspace(0, count, workers + 1).astype(int)
+            executor = self._get_executor(workers)
+            futures = [executor.submit(self._preprocess_range, images, out, start, stop)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+            return out
             
         except Exception as e:
-            logger.error(f"Error in preprocessing: {str(e)}")
+            logger.error(f"Error in batch preprocessing: {str(e)}")
             raise
             
+    @property
+    def _output_shape(self) -> Tuple[int, int]:
+        # cv2.resize takes image_size as (width, height)
+        return (self.image_size[1], self.image_size[0])
+        
+    def _preprocess_range(self, images, out: np.ndarray, start: int, stop: int) -> None:
+        scratch = self._scratch_buffers()
+        for i in range(start, stop):
+            self._preprocess_into(images[i], out[i], scratch)
+            
+    def _preprocess_into(self, image: np.ndarray, output: np.ndarray, scratch: Dict[str, np.ndarray]) -> None:
+        """Run all preprocessing stages, writing each into a preallocated buffer"""
+        # Resize image to standard size
+        cv2.resize(to_gray_uint8(image), self.image_size, dst=scratch['resized'])
+        
+        if self.enhancer is not None:
+            # Band-pass the ridges along their local orientation and frequency
+            self.enhancer.enhance(scratch['resized'], out=scratch['blurred'])
+        else:
+            # Apply Gaussian blur to reduce noise
+            cv2.GaussianBlur(scratch['resized'], self.gaussian_kernel_size, 0, dst=scratch['blurred'])
+        
+        # Apply adaptive thresholding
+        cv2.adaptiveThreshold(
+            scratch['blurred'],
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV,
+            self.threshold_block_size,
+            self.threshold_c,
+            dst=scratch['binary']
+        )
+        
+        # Apply morphological operations
+        cv2.morphologyEx(scratch['binary'], cv2.MORPH_CLOSE, MORPH_KERNEL, dst=scratch['morph'])
+        
+        # Normalize the image
+        cv2.normalize(scratch['morph'], output, 0, 1, cv2.NORM_MINMAX)
+        
+    def _scratch_buffers(self) -> Dict[str, np.ndarray]:
+        """Per-thread intermediate buffers, allocated once per thread and size"""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or buffers['resized'].shape != self._output_shape:
+            buffers = {name: np.empty(self._output_shape, dtype=np.uint8)
+                       for name in ('resized', 'blurred', 'binary', 'morph')}
+            self._local.buffers = buffers
+        return buffers
+        
+    def _get_executor(self, workers: int) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None or self._executor_workers < workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fingerprint-preprocess')
+                self._executor_workers = workers
+            return self._executor
+        
     def extract_minutiae(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
         Extract minutiae points from the preprocessed fingerprint image.
         
+        Thins the ridges to a one pixel skeleton, then finds ridge endings
+        and bifurcations from the crossing number of every skeleton pixel.
+        
         Args:
             image: Preprocessed fingerprint image
             
         Returns:
-            Tuple of (minutiae points, minutiae types)
+            Tuple of (minutiae points as (x, y), minutiae types)
         """
         try:
-            # Convert to uint8 for OpenCV operations
-            image_uint8 = (image * 255).astype(np.uint8)
+            ridges = (np.asarray(image, dtype=np.float32) > self.ridge_threshold).astype(np.uint8)
+            skeleton = self._thin(ridges)
             
-            # Detect ridges
-            ridges = cv2.ximgproc.ridgeFilter(image_uint8, 0, 0, 3, 1, 0, 0)
+            # Crossing number of every skeleton pixel: 1 at endings, 3 at bifurcations
+            crossings = CROSSING_NUMBER_LUT[self._neighbor_codes(skeleton)]
+            candidates = (skeleton == 1) & ((crossings == 1) | (crossings == 3))
+            candidates &= self._foreground_mask(ridges)
+            candidates = self._remove_clustered(candidates)
             
-            # Detect minutiae points
-            minutiae = cv2.ximgproc.ridgeDetector(image_uint8, 0, 0, 3, 1, 0, 0)
+            ys, xs = np.nonzero(candidates)
+            minutiae = np.stack([xs, ys], axis=1).astype(np.float64)
             
             # Classify minutiae types (bifurcations and endings)
-            minutiae_types = self._classify_minutiae(minutiae, ridges)
+            minutiae_types = self._classify_minutiae(minutiae, skeleton)
             
             return minutiae, minutiae_types
             
@@ -104,28 +276,65 @@ class FingerprintProcessor:
         Classify minutiae points into bifurcations and endings.
         
         Args:
-            minutiae: Detected minutiae points
-            ridges: Ridge image
+            minutiae: Detected minutiae points as (x, y)
+            ridges: Ridge skeleton image
             
         Returns:
             Array of minutiae types (0 for ending, 1 for bifurcation)
         """
-        # Implementation of minutiae classification
-        # This is a simplified version - in production, you'd want a more robust method
-        types = np.zeros(len(minutiae))
-        
-        for i, point in enumerate(minutiae):
-            x, y = point.astype(int)
-            # Count ridge crossings in 3x3 neighborhood
-            neighborhood = ridges[y-1:y+2, x-1:x+2]
-            crossings = np.sum(neighborhood > 0)
-            
-            if crossings >= 3:
-                types[i] = 1  # Bifurcation
-            else:
-                types[i] = 0  # Ending
-                
-        return types
+        if not len(minutiae):
+            return np.zeros(0)
+        
+        # Crossing number at every point at once
+        xs, ys = minutiae[:, 0].astype(int), minutiae[:, 1].astype(int)
+        crossings = CROSSING_NUMBER_LUT[self._neighbor_codes((ridges > 0).astype(np.uint8))[ys, xs]]
+        return (crossings >= 3).astype(np.float64)
+        
+    def _neighbor_codes(self, binary: np.ndarray) -> np.ndarray:
+        """8-bit code of the 8-neighbourhood of every pixel, zero outside the image"""
+        codes = cv2.filter2D(binary.astype(np.float32), -1, NEIGHBOR_WEIGHTS,
+                             borderType=cv2.BORDER_CONSTANT)
+        return np.rint(codes).astype(np.uint8)
+        
+    def _thin(self, binary: np.ndarray) -> np.ndarray:
+        """Zhang-Suen thinning, each sub-iteration applied to the whole image at once"""
+        skeleton = binary.copy()
+        while True:
+            changed = False
+            for lut in THINNING_LUTS:
+                deletable = (skeleton == 1) & lut[self._neighbor_codes(skeleton)]
+                if deletable.any():
+                    skeleton[deletable] = 0
+                    changed = True
+            if not changed:
+                return skeleton
+            
+    def _foreground_mask(self, ridges: np.ndarray) -> np.ndarray:
+        """Fingerprint area shrunk by the border margin"""
+        border = self.minutiae_border
+        if border <= 0:
+            return np.ones(ridges.shape, dtype=bool)
+        
+        # Area with ridges nearby, closed to fill the valleys
+        size = 2 * border + 1
+        density = cv2.boxFilter(ridges.astype(np.float32), -1, (size, size), borderType=cv2.BORDER_CONSTANT)
+        mask = (density > 0.1).astype(np.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((size, size), np.uint8))
+        
+        # Drop everything within the margin of the area edge and the image edge
+        mask = cv2.erode(mask, np.ones((size, size), np.uint8), borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        return mask.astype(bool)
+        
+    def _remove_clustered(self, candidates: np.ndarray) -> np.ndarray:
+        """Drop minutiae with another minutia nearby (spurs, breaks and noise)"""
+        distance = self.min_minutiae_distance
+        if distance <= 0:
+            return candidates
+        
+        size = 2 * distance + 1
+        counts = cv2.boxFilter(candidates.astype(np.float32), -1, (size, size),
+                               normalize=False, borderType=cv2.BORDER_CONSTANT)
+        return candidates & (counts < 1.5)
         
     def create_feature_vector(self, 
                             minutiae: np.ndarray, 
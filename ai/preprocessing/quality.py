@@ -0,0 +1,280 @@
+"""
+Capture quality checks for fingerprint and face images.
+Rejects unusable captures before the expensive preprocessing and model passes.
+"""
+
+import cv2
+import numpy as np
+from typing import Dict, Any, Optional
+
+# Rejection reasons, in the order the checks run
+REJECTION_MESSAGES: Dict[str, str] = {
+    'empty': "No image data captured",
+    'too_dark': "Image is too dark, press the finger firmly on the scanner",
+    'too_bright': "Image is overexposed, lift and place the finger again",
+    'no_ridges': "Not enough fingerprint area, place the whole fingertip on the scanner",
+    'low_contrast': "Ridges are too faint, clean the scanner and try again",
+    'too_blurry': "Image is blurry, hold the finger still",
+}
+
+FACE_REJECTION_MESSAGES: Dict[str, str] = {
+    'empty': "No image captured",
+    'too_dark': "Image is too dark, face the light",
+    'too_bright': "Image is overexposed, move away from the light",
+    'too_blurry': "Image is blurry, hold still and look at the camera",
+}
+
+def to_gray_uint8(image: np.ndarray) -> np.ndarray:
+    """
+    Convert an image to single channel uint8.
+
+    Args:
+        image: Grayscale or BGR image, uint8 or float in [0, 1]
+
+    Returns:
+        Grayscale uint8 image
+    """
+    if image.ndim == 3:
+        if image.shape[-1] == 1:
+            image = image[..., 0]
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if image.dtype != np.uint8:
+        image = np.asarray(image, dtype=np.float32)
+        if image.size and image.max() <= 1.0:
+            image = image * 255.0
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    return image
+
+class CaptureQualityGate:
+    """
+    Exposure checks and result format shared by the capture quality gates.
+
+    Subclasses compute their own scores, add their checks after the exposure
+    ones and provide the messages shown at the kiosk.
+    """
+
+    messages: Dict[str, str] = {}
+
+    def __init__(self, min_mean: float, max_mean: float, max_clipped_fraction: float):
+        """
+        Args:
+            min_mean: Minimum mean intensity (too dark below)
+            max_mean: Maximum mean intensity (too bright above)
+            max_clipped_fraction: Maximum fraction of pixels at either end of the histogram
+        """
+        self.min_mean = min_mean
+        self.max_mean = max_mean
+        self.max_clipped_fraction = max_clipped_fraction
+
+    @staticmethod
+    def exposure_scores(gray: np.ndarray) -> Dict[str, float]:
+        """
+        Compute the exposure scores of a grayscale uint8 image.
+
+        Args:
+            gray: Grayscale uint8 image
+
+        Returns:
+            Dictionary with the mean intensity and the fractions of clipped
+            dark and bright pixels
+        """
+        histogram = np.bincount(gray.ravel(), minlength=256)
+        total = max(int(histogram.sum()), 1)
+        return {
+            'mean_intensity': float(np.dot(np.arange(256), histogram) / total),
+            'dark_fraction': float(histogram[:16].sum() / total),
+            'bright_fraction': float(histogram[240:].sum() / total),
+        }
+
+    def compute_scores(self, image: np.ndarray) -> Dict[str, float]:
+        """
+        Compute the quality scores of a capture.
+
+        Args:
+            image: Captured image
+
+        Returns:
+            Dictionary of quality scores, including the exposure scores
+        """
+        raise NotImplementedError
+
+    def reject_reason(self, scores: Dict[str, float]) -> Optional[str]:
+        """
+        Pick the first failed check.
+
+        Args:
+            scores: Scores from compute_scores
+
+        Returns:
+            Rejection reason, or None if the capture is usable
+        """
+        if scores['mean_intensity'] < self.min_mean or scores['dark_fraction'] > self.max_clipped_fraction:
+            return 'too_dark'
+        if scores['mean_intensity'] > self.max_mean or scores['bright_fraction'] > self.max_clipped_fraction:
+            return 'too_bright'
+        return None
+
+    def check(self, image: Optional[np.ndarray]) -> Dict[str, Any]:
+        """
+        Decide whether a capture is good enough to process.
+
+        Args:
+            image: Captured image
+
+        Returns:
+            Dictionary with 'accepted', and for rejections a 'reason' code and
+            a 'message' to show at the kiosk, plus the computed 'scores'
+        """
+        if image is None or image.size == 0:
+            return self._result('empty', {})
+
+        scores = self.compute_scores(image)
+        return self._result(self.reject_reason(scores), scores)
+
+    def _result(self, reason: Optional[str], scores: Dict[str, float]) -> Dict[str, Any]:
+        result = {
+            'accepted': reason is None,
+            'scores': scores,
+        }
+        if reason is not None:
+            result['reason'] = reason
+            result['message'] = self.messages[reason]
+        return result
+
+class FingerprintQualityGate(CaptureQualityGate):
+    messages = REJECTION_MESSAGES
+
+    def __init__(self,
+                 block_size: int = 16,
+                 min_mean: float = 30.0,
+                 max_mean: float = 230.0,
+                 max_clipped_fraction: float = 0.6,
+                 min_block_std: float = 10.0,
+                 min_coverage: float = 0.25,
+                 min_ridge_contrast: float = 0.08,
+                 min_sharpness: float = 15.0):
+        """
+        Initialize the quality gate with its thresholds.
+
+        Args:
+            block_size: Block size used for the ridge contrast and coverage scores
+            min_mean: Minimum mean intensity (too dark below)
+            max_mean: Maximum mean intensity (too bright above)
+            max_clipped_fraction: Maximum fraction of pixels at either end of the histogram
+            min_block_std: Standard deviation for a block to count as ridge area
+            min_coverage: Minimum fraction of blocks with ridge texture
+            min_ridge_contrast: Minimum median ridge block contrast in [0, 1]
+            min_sharpness: Minimum variance of the Laplacian over the ridge area
+        """
+        super().__init__(min_mean, max_mean, max_clipped_fraction)
+        self.block_size = block_size
+        self.min_block_std = min_block_std
+        self.min_coverage = min_coverage
+        self.min_ridge_contrast = min_ridge_contrast
+        self.min_sharpness = min_sharpness
+
+    def compute_scores(self, image: np.ndarray) -> Dict[str, float]:
+        """
+        Compute the quality scores of a fingerprint capture.
+
+        Args:
+            image: Fingerprint image
+
+        Returns:
+            Dictionary with exposure, coverage, ridge contrast and sharpness scores
+        """
+        gray = to_gray_uint8(image)
+
+        # Per-block standard deviation, all blocks at once
+        b = self.block_size
+        height, width = (gray.shape[0] // b) * b, (gray.shape[1] // b) * b
+        if height == 0 or width == 0:
+            block_std = np.zeros(0, dtype=np.float32)
+            ridge_blocks = np.zeros(0, dtype=bool)
+        else:
+            blocks = gray[:height, :width].reshape(height // b, b, width // b, b).astype(np.float32)
+            block_std = blocks.std(axis=(1, 3)).ravel()
+            ridge_blocks = block_std >= self.min_block_std
+        coverage = float(ridge_blocks.mean()) if block_std.size else 0.0
+        ridge_contrast = float(np.median(block_std[ridge_blocks]) / 127.5) if ridge_blocks.any() else 0.0
+
+        # Sharpness: Laplacian variance, restricted to the ridge area
+        laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+        if ridge_blocks.any():
+            mask = np.repeat(np.repeat(ridge_blocks.reshape(height // b, width // b), b, axis=0), b, axis=1)
+            sharpness = float(laplacian[:height, :width][mask].var())
+        else:
+            sharpness = float(laplacian.var())
+
+        return {
+            **self.exposure_scores(gray),
+            'coverage': coverage,
+            'ridge_contrast': ridge_contrast,
+            'sharpness': sharpness,
+        }
+
+    def reject_reason(self, scores: Dict[str, float]) -> Optional[str]:
+        reason = super().reject_reason(scores)
+        if reason is not None:
+            return reason
+        if scores['coverage'] < self.min_coverage:
+            return 'no_ridges'
+        if scores['ridge_contrast'] < self.min_ridge_contrast:
+            return 'low_contrast'
+        if scores['sharpness'] < self.min_sharpness:
+            return 'too_blurry'
+        return None
+
+class FaceQualityGate(CaptureQualityGate):
+    """Cheap capture checks that run before face detection and encoding"""
+
+    messages = FACE_REJECTION_MESSAGES
+
+    def __init__(self,
+                 analysis_max_side: int = 320,
+                 min_mean: float = 40.0,
+                 max_mean: float = 220.0,
+                 max_clipped_fraction: float = 0.5,
+                 min_sharpness: float = 30.0):
+        """
+        Args:
+            analysis_max_side: Longest side of the thumbnail the scores are computed on,
+                which also keeps the sharpness score independent of camera resolution
+            min_mean: Minimum mean intensity (too dark below)
+            max_mean: Maximum mean intensity (too bright above)
+            max_clipped_fraction: Maximum fraction of pixels at either end of the histogram
+            min_sharpness: Minimum variance of the Laplacian
+        """
+        super().__init__(min_mean, max_mean, max_clipped_fraction)
+        self.analysis_max_side = analysis_max_side
+        self.min_sharpness = min_sharpness
+
+    def compute_scores(self, image: np.ndarray) -> Dict[str, float]:
+        """
+        Compute exposure and sharpness scores of a captured frame.
+
+        Args:
+            image: BGR or grayscale image
+
+        Returns:
+            Dictionary of quality scores
+        """
+        gray = to_gray_uint8(image)
+        longest = max(gray.shape[:2])
+        if longest > self.analysis_max_side:
+            scale = self.analysis_max_side / float(longest)
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        return {
+            **self.exposure_scores(gray),
+            'sharpness': float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+        }
+
+    def reject_reason(self, scores: Dict[str, float]) -> Optional[str]:
+        reason = super().reject_reason(scores)
+        if reason is not None:
+            return reason
+        if scores['sharpness'] < self.min_sharpness:
+            return 'too_blurry'
+        return None
@@ -0,0 +1,110 @@
+"""
+Per-request deadlines for the verification pipeline.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from typing import Optional
+
+class DeadlineExceeded(Exception):
+    """Raised between pipeline stages once a request has run out of time."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+class Deadline:
+    """
+    Point in time by which a request must be answered.
+
+    Created where the request arrives and passed down through every stage,
+    which checks it before starting expensive work. A caller that stops
+    waiting, e.g. because its own timeout fired, cancels the deadline so
+    the stages still running on its behalf stop at the next check.
+    """
+
+    def __init__(self, expires_at: Optional[float] = None):
+        """
+        Args:
+            expires_at: time.monotonic() value the request must finish by,
+                None for no limit
+        """
+        self.expires_at = expires_at
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> "Deadline":
+        """
+        Create a deadline a number of seconds from now.
+
+        Args:
+            seconds: Time budget, None for no limit
+
+        Returns:
+            The deadline
+        """
+        return cls(None if seconds is None else time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        """Seconds left, 0 once expired or cancelled and infinity without a limit."""
+        if self._cancelled.is_set():
+            return 0.0
+        if self.expires_at is None:
+            return math.inf
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        """Whether the request has run out of time or was cancelled."""
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """Whether a stage expected to take this many seconds still fits."""
+        return self.remaining() >= seconds
+
+    def check(self, stage: str, needed: float = 0.0) -> None:
+        """
+        Stop the request if it has run out of time.
+
+        Args:
+            stage: Name of the stage about to start, for the error
+            needed: Seconds the stage is expected to take; a stage that
+                cannot finish in time is not started
+
+        Raises:
+            DeadlineExceeded: When the deadline has passed, was cancelled
+                or leaves less than needed
+        """
+        if self.expired or not self.allows(needed):
+            raise DeadlineExceeded(stage)
+
+    def cancel(self) -> None:
+        """Expire the deadline now, e.g. when the client has given up."""
+        self._cancelled.set()
+
+    async def wait(self, future: asyncio.Future, poll_interval: float = 0.05):
+        """
+        Wait for a future until the deadline.
+
+        The deadline is read again on every pass, so pushing expires_at back
+        while waiting (e.g. when another caller joins a shared call) gives
+        the wait more time. The future is left running when the wait ends.
+
+        Args:
+            future: Future or task to wait for
+            poll_interval: Longest single wait between deadline checks
+
+        Returns:
+            The future's result
+
+        Raises:
+            asyncio.TimeoutError: When the deadline passes or is cancelled first
+        """
+        while not future.done():
+            remaining = self.remaining()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            await asyncio.wait({future}, timeout=min(remaining, poll_interval))
+        return future.result()
@@ -0,0 +1,288 @@
+"""
+Rotation and translation invariant minutiae descriptors.
+
+Each minutia is described by the distances, relative angles and types of
+its nearest neighbours, quantised into a cylinder-code style bit grid and
+stored packed. Descriptors are compared with popcount, and a MinHash
+bucket index over the set bits makes 1:N search feasible.
+"""
+
+import numpy as np
+from collections import Counter, defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .minutiae_matching import greedy_assignment, pairwise_distances
+
+# Bits set in each byte, for numpy versions without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def popcount(packed: np.ndarray) -> np.ndarray:
+    """
+    Count the set bits of packed descriptors.
+
+    Args:
+        packed: uint8 array of packed bits, descriptors along the last axis
+
+    Returns:
+        Number of set bits per descriptor
+    """
+    if hasattr(np, 'bitwise_count'):
+        counts = np.bitwise_count(packed)
+    else:
+        counts = _POPCOUNT_TABLE[packed]
+    return counts.sum(axis=-1, dtype=np.int32)
+
+class MinutiaeDescriptorExtractor:
+    def __init__(self,
+                 num_neighbors: int = 8,
+                 radius: float = 0.3,
+                 radial_bins: int = 6,
+                 angular_bins: int = 8,
+                 num_types: int = 2,
+                 tolerance: float = 0.35,
+                 min_pairs: int = 4,
+                 max_pairs: int = 12):
+        """
+        Initialize the descriptor extractor.
+
+        Args:
+            num_neighbors: Neighbours encoded in each descriptor
+            radius: Neighbourhood radius, in normalised image coordinates
+            radial_bins: Number of distance bins
+            angular_bins: Number of relative angle bins
+            num_types: Number of minutia types (ending, bifurcation)
+            tolerance: Fraction of a bin a value may move and still set the same bit
+            min_pairs: Minimum number of descriptor pairs averaged into a match score
+            max_pairs: Maximum number of descriptor pairs averaged into a match score
+        """
+        self.num_neighbors = num_neighbors
+        self.radius = radius
+        self.radial_bins = radial_bins
+        self.angular_bins = angular_bins
+        self.num_types = num_types
+        self.tolerance = tolerance
+        self.min_pairs = min_pairs
+        self.max_pairs = max_pairs
+
+    @property
+    def num_bits(self) -> int:
+        return self.num_types * self.radial_bins * self.angular_bins
+
+    def compute(self, minutiae: np.ndarray, types: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Compute the descriptors of a set of minutiae.
+
+        The reference direction of each minutia is the direction to its
+        nearest neighbour, so the descriptors do not change when the finger
+        is shifted or rotated on the scanner.
+
+        Args:
+            minutiae: Minutiae coordinates in normalised image units, shape (n, 2)
+            types: Minutiae types (0 for ending, 1 for bifurcation)
+
+        Returns:
+            Dictionary with the 'points', 'types' and packed descriptor 'bits'
+        """
+        points = np.asarray(minutiae, dtype=np.float64).reshape(-1, 2)
+        types = np.asarray(types).astype(np.intp).ravel()
+        n = len(points)
+        bits = np.zeros((n, self.num_bits), dtype=bool)
+
+        k = min(self.num_neighbors, n - 1)
+        if k > 0:
+            distances = pairwise_distances(points, points)
+            np.fill_diagonal(distances, np.inf)
+            neighbors = np.argsort(distances, axis=1)[:, :k]
+            neighbor_distances = np.take_along_axis(distances, neighbors, axis=1)
+
+            offsets = points[neighbors] - points[:, None, :]
+            angles = np.arctan2(offsets[..., 1], offsets[..., 0])
+            relative = np.mod(angles - angles[:, :1], 2 * np.pi)
+
+            radial = neighbor_distances / self.radius * self.radial_bins
+            angular = relative / (2 * np.pi) * self.angular_bins
+            neighbor_types = np.clip(types[neighbors], 0, self.num_types - 1)
+            valid = neighbor_distances <= self.radius
+
+            # Set the bit of each neighbour's cell, and of the adjacent cell
+            # when the value lies within tolerance of the boundary
+            rows = np.broadcast_to(np.arange(n)[:, None], valid.shape)
+            for radial_shift in (-self.tolerance, self.tolerance):
+                for angular_shift in (-self.tolerance, self.tolerance):
+                    r = np.clip(np.floor(radial + radial_shift), 0, self.radial_bins - 1).astype(np.intp)
+                    a = np.mod(np.floor(angular + angular_shift), self.angular_bins).astype(np.intp)
+                    cells = (neighbor_types * self.radial_bins + r) * self.angular_bins + a
+                    bits[rows[valid], cells[valid]] = True
+
+        return {
+            'points': points,
+            'types': types,
+            'bits': np.packbits(bits, axis=1),
+        }
+
+    def from_feature_vector(self, features: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Compute descriptors from a FingerprintProcessor.create_feature_vector output.
+
+        Args:
+            features: Flattened normalised coordinates followed by the types
+
+        Returns:
+            Descriptors, see compute
+        """
+        features = np.asarray(features, dtype=np.float64).ravel()
+        if len(features) % 3:
+            raise ValueError("Feature vector length must be a multiple of 3")
+        n = len(features) // 3
+        return self.compute(features[:2 * n].reshape(n, 2), features[2 * n:])
+
+    def similarity_matrix(self, descriptors1: Dict[str, np.ndarray], descriptors2: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Compare every descriptor of one set with every descriptor of another.
+
+        Args:
+            descriptors1: First set of descriptors
+            descriptors2: Second set of descriptors
+
+        Returns:
+            Similarity matrix in [0, 1], zero for minutiae of different types
+        """
+        bits1, bits2 = descriptors1['bits'], descriptors2['bits']
+        different = popcount(bits1[:, None, :] ^ bits2[None, :, :])
+        total = popcount(bits1)[:, None] + popcount(bits2)[None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.where(total > 0, 1.0 - different / total, 0.0)
+        same_type = descriptors1['types'][:, None] == descriptors2['types'][None, :]
+        return np.where(same_type, similarity, 0.0)
+
+    def match(self, descriptors1: Dict[str, np.ndarray], descriptors2: Dict[str, np.ndarray]) -> float:
+        """
+        Compute the similarity of two fingerprints from their descriptors.
+
+        Pairs descriptors one to one, most similar first, and averages the
+        best pairs. Fingerprints with few minutiae are penalised by always
+        averaging over at least min_pairs.
+
+        Args:
+            descriptors1: First set of descriptors
+            descriptors2: Second set of descriptors
+
+        Returns:
+            Similarity score between 0 and 1
+        """
+        if not len(descriptors1['bits']) or not len(descriptors2['bits']):
+            return 0.0
+        similarity = self.similarity_matrix(descriptors1, descriptors2)
+        rows, cols = greedy_assignment(1.0 - similarity, similarity > 0)
+        num_pairs = int(np.clip(min(similarity.shape), self.min_pairs, self.max_pairs))
+        best = np.sort(similarity[rows, cols])[::-1][:num_pairs]
+        return float(best.sum() / num_pairs)
+
+class MinutiaeIndex:
+    """
+    1:N search over minutiae descriptors.
+
+    Every descriptor is hashed into several MinHash buckets; a probe votes
+    for the templates sharing its buckets, and only the best voted
+    templates are matched in full.
+    """
+
+    def __init__(self,
+                 extractor: Optional[MinutiaeDescriptorExtractor] = None,
+                 num_tables: int = 8,
+                 hashes_per_table: int = 2,
+                 seed: int = 0):
+        """
+        Args:
+            extractor: Extractor the stored descriptors were computed with
+            num_tables: Number of bucket tables
+            hashes_per_table: MinHash values combined into one bucket key
+            seed: Seed of the hash permutations
+        """
+        self.extractor = extractor or MinutiaeDescriptorExtractor()
+        self.num_tables = num_tables
+        self.hashes_per_table = hashes_per_table
+        rng = np.random.default_rng(seed)
+        num_bits = self.extractor.num_bits
+        self._ranks = np.stack([rng.permutation(num_bits) for _ in range(num_tables * hashes_per_table)])
+        self._tables: List[Dict[Tuple, set]] = [defaultdict(set) for _ in range(num_tables)]
+        self._templates: Dict[Hashable, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def add(self, template_id: Hashable, descriptors: Dict[str, np.ndarray]) -> None:
+        """
+        Add (or replace) a template.
+
+        Args:
+            template_id: Template identifier, e.g. the voter ID
+            descriptors: Descriptors from MinutiaeDescriptorExtractor.compute
+        """
+        self.remove(template_id)
+        keys = self._bucket_keys(descriptors)
+        for table, table_keys in zip(self._tables, keys):
+            for key in table_keys:
+                table[key].add(template_id)
+        self._templates[template_id] = {'descriptors': descriptors, 'keys': keys}
+
+    def remove(self, template_id: Hashable) -> None:
+        """
+        Remove a template if present.
+
+        Args:
+            template_id: Template identifier
+        """
+        entry = self._templates.pop(template_id, None)
+        if entry is None:
+            return
+        for table, table_keys in zip(self._tables, entry['keys']):
+            for key in table_keys:
+                bucket = table.get(key)
+                if bucket is not None:
+                    bucket.discard(template_id)
+                    if not bucket:
+                        del table[key]
+
+    def search(self,
+               descriptors: Dict[str, np.ndarray],
+               top_k: int = 5,
+               shortlist: int = 50) -> List[Tuple[Hashable, float]]:
+        """
+        Find the templates most similar to a probe.
+
+        Args:
+            descriptors: Probe descriptors
+            top_k: Number of results
+            shortlist: Number of best voted templates matched in full
+
+        Returns:
+            List of (template ID, similarity), best first
+        """
+        # Crowded buckets say little about identity, so votes are weighted by 1 / bucket size
+        votes = Counter()
+        for table, table_keys in zip(self._tables, self._bucket_keys(descriptors)):
+            for key in table_keys:
+                bucket = table.get(key)
+                if bucket:
+                    weight = 1.0 / len(bucket)
+                    for template_id in bucket:
+                        votes[template_id] += weight
+
+        candidates = [template_id for template_id, _ in votes.most_common(shortlist)]
+        results = [(template_id, self.extractor.match(descriptors, self._templates[template_id]['descriptors']))
+                   for template_id in candidates]
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:top_k]
+
+    def _bucket_keys(self, descriptors: Dict[str, np.ndarray]) -> List[set]:
+        """MinHash bucket keys of every non-empty descriptor, per table"""
+        bits = np.unpackbits(descriptors['bits'], axis=1, count=self.extractor.num_bits).astype(bool)
+        bits = bits[bits.any(axis=1)]
+        if not len(bits):
+            return [set() for _ in range(self.num_tables)]
+
+        # Smallest permuted position of a set bit, for every hash function
+        masked = np.where(bits[:, None, :], self._ranks[None, :, :], self.extractor.num_bits)
+        minhash = masked.min(axis=2).reshape(len(bits), self.num_tables, self.hashes_per_table)
+        return [set(map(tuple, minhash[:, table].tolist())) for table in range(self.num_tables)]
@@ -0,0 +1,122 @@
+"""
+Vectorised minutiae pairing for fingerprint verification.
+"""
+
+import numpy as np
+from typing import Tuple
+
+def pairwise_distances(points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+    """
+    Compute the Euclidean distance between every pair of points.
+
+    Args:
+        points1: First set of points, shape (n, 2)
+        points2: Second set of points, shape (m, 2)
+
+    Returns:
+        Distance matrix of shape (n, m)
+    """
+    diff = points1[:, None, :] - points2[None, :, :]
+    return np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+def greedy_assignment(distances: np.ndarray, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pair rows and columns greedily, closest allowed pair first.
+
+    Works in rounds: every pair whose row and column are each other's
+    nearest remaining neighbour is one the closest-pair-first scan would
+    take, so all of them are accepted at once before the rest is rescanned.
+
+    Args:
+        distances: Distance matrix of shape (n, m)
+        allowed: Boolean mask of the pairs that may be matched
+
+    Returns:
+        Tuple of (row indices, column indices) of the matched pairs
+    """
+    masked = np.where(allowed, distances, np.inf)
+    row_ids = np.flatnonzero(np.isfinite(masked).any(axis=1))
+    col_ids = np.flatnonzero(np.isfinite(masked).any(axis=0))
+    rows, cols = [], []
+
+    while len(row_ids) and len(col_ids):
+        sub = masked[np.ix_(row_ids, col_ids)]
+        nearest_col = sub.argmin(axis=1)
+        nearest_row = sub.argmin(axis=0)
+        mutual = nearest_row[nearest_col] == np.arange(len(row_ids))
+        mutual &= np.isfinite(sub[np.arange(len(row_ids)), nearest_col])
+        if not mutual.any():
+            break
+
+        picked_rows = np.flatnonzero(mutual)
+        picked_cols = nearest_col[picked_rows]
+        rows.append(row_ids[picked_rows])
+        cols.append(col_ids[picked_cols])
+
+        # Keep only rows and columns that are unused and still have an allowed partner
+        keep_cols = np.ones(len(col_ids), dtype=bool)
+        keep_cols[picked_cols] = False
+        col_ids = col_ids[keep_cols]
+        row_ids = row_ids[~mutual]
+        if len(row_ids) and len(col_ids):
+            finite = np.isfinite(masked[np.ix_(row_ids, col_ids)])
+            row_ids = row_ids[finite.any(axis=1)]
+            col_ids = col_ids[finite.any(axis=0)]
+
+    if not rows:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    return np.concatenate(rows), np.concatenate(cols)
+
+def optimal_assignment(distances: np.ndarray, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pair rows and columns minimising the total distance (Hungarian algorithm).
+
+    Args:
+        distances: Distance matrix of shape (n, m)
+        allowed: Boolean mask of the pairs that may be matched
+
+    Returns:
+        Tuple of (row indices, column indices) of the matched pairs
+    """
+    # scipy.optimize takes longer to import than everything else here
+    from scipy.optimize import linear_sum_assignment
+
+    # Forbidden pairs get a cost no real pairing can reach, then are dropped
+    forbidden = distances.max(initial=0.0) * distances.size + 1.0
+    rows, cols = linear_sum_assignment(np.where(allowed, distances, forbidden))
+    keep = allowed[rows, cols]
+    return rows[keep], cols[keep]
+
+def match_minutiae(points1: np.ndarray,
+                   types1: np.ndarray,
+                   points2: np.ndarray,
+                   types2: np.ndarray,
+                   method: str = 'greedy') -> np.ndarray:
+    """
+    Pair minutiae of the same type and return the distances of the pairs.
+
+    Args:
+        points1: First set of minutiae coordinates, shape (n, 2)
+        types1: Types of the first set
+        points2: Second set of minutiae coordinates, shape (m, 2)
+        types2: Types of the second set
+        method: 'greedy' (closest pair first) or 'hungarian' (minimum total distance)
+
+    Returns:
+        Distances of the matched pairs
+    """
+    points1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+    points2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+    if len(points1) == 0 or len(points2) == 0:
+        return np.zeros(0)
+
+    distances = pairwise_distances(points1, points2)
+    allowed = np.asarray(types1)[:, None] == np.asarray(types2)[None, :]
+
+    if method == 'greedy':
+        rows, cols = greedy_assignment(distances, allowed)
+    elif method == 'hungarian':
+        rows, cols = optimal_assignment(distances, allowed)
+    else:
+        raise ValueError(f"Unknown minutiae matching method: {method}")
+    return distances[rows, cols]
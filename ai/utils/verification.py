@@ -3,36 +3,222 @@ Utility module for fingerprint verification combining preprocessing and AI model
 """
 
 import numpy as np
-from typing import Tuple, Optional, Dict
+from typing import Tuple, Optional, Dict, Any, Callable
 from loguru import logger
 import hashlib
+import threading
+import time
 from datetime import datetime
 
 from ..preprocessing.fingerprint_processor import FingerprintProcessor
+from ..preprocessing.quality import FingerprintQualityGate
 from ..models.fingerprint_model import FingerprintModel
+from .deadline import Deadline, DeadlineExceeded
+from .minutiae_descriptors import MinutiaeDescriptorExtractor
+from .minutiae_matching import match_minutiae
+
+# Bump when the layout of stored templates changes
+TEMPLATE_FORMAT_VERSION = 1
+
+def cascade_limits(similarity_threshold: float,
+                   ai_weight: float,
+                   minutiae_weight: float) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Widest AI similarity bands that decide a pair the way the hybrid score would.
+    
+    Minutiae similarity lies in [0, 1], so a pair is rejected whatever it
+    scores when even a perfect minutiae match leaves the hybrid score below
+    the threshold, and accepted whatever it scores when the AI share alone
+    reaches the threshold.
+    
+    Args:
+        similarity_threshold: Threshold on the hybrid score
+        ai_weight: Weight of the AI similarity in the hybrid score
+        minutiae_weight: Weight of the minutiae similarity in the hybrid score
+        
+    Returns:
+        Tuple of (reject_below, accept_above); accept_above is None when no
+        AI similarity in [0, 1] is enough on its own
+    """
+    if ai_weight <= 0:
+        return None, None
+    reject_below = (similarity_threshold - minutiae_weight) / ai_weight
+    accept_above = similarity_threshold / ai_weight
+    return reject_below, accept_above if accept_above <= 1 else None
 
 class FingerprintVerifier:
     def __init__(self,
                  similarity_threshold: float = 0.85,
-                 use_minutiae: bool = True):
+                 use_minutiae: bool = True,
+                 check_quality: bool = True,
+                 ai_weight: float = 0.7,
+                 minutiae_weight: float = 0.3,
+                 cascade_reject_below: Optional[float] = 0.75,
+                 cascade_accept_above: Optional[float] = None,
+                 minutiae_matcher: str = 'greedy',
+                 enhance_ridges: bool = False,
+                 model: Optional[FingerprintModel] = None,
+                 model_factory: Optional[Callable[[], FingerprintModel]] = None,
+                 weights_digest: Optional[str] = None):
         """
         Initialize the fingerprint verifier.
         
         Args:
             similarity_threshold: Threshold for considering fingerprints as matching
             use_minutiae: Whether to use minutiae-based verification in addition to AI
+            check_quality: Whether to reject unusable captures before processing
+            ai_weight: Weight of the AI similarity in the hybrid score
+            minutiae_weight: Weight of the minutiae similarity in the hybrid score
+            cascade_reject_below: AI similarity below which a pair is rejected
+                without minutiae matching (None to always run it); narrowed
+                to cascade_limits so it never changes a decision
+            cascade_accept_above: AI similarity from which a pair is accepted
+                without minutiae matching (None to always run it); narrowed
+                to cascade_limits so it never changes a decision
+            minutiae_matcher: 'greedy' or 'hungarian' pairing of raw coordinates,
+                or 'descriptor' for rotation invariant local descriptors
+            enhance_ridges: Whether to apply Fourier domain ridge enhancement
+                during preprocessing
+            model: Feature extractor to use, e.g. FingerprintModel.from_config(AI_CONFIG)
+                for a tflite or onnx backend; a keras model is built by default
+            model_factory: Builds the feature extractor when model is None; it
+                is called on first use or by warmup(), not here
+            weights_digest: Weights digest of the model the factory builds,
+                e.g. FingerprintModel.config_weights_digest(AI_CONFIG), so
+                template_version does not have to build the model
         """
         self.similarity_threshold = similarity_threshold
         self.use_minutiae = use_minutiae
+        self.ai_weight = ai_weight
+        self.minutiae_weight = minutiae_weight
+        # The bands are a shortcut, not a policy: the AI score alone only
+        # decides where minutiae matching could not change the outcome
+        reject_limit, accept_limit = cascade_limits(similarity_threshold, ai_weight, minutiae_weight)
+        if cascade_reject_below is not None and (reject_limit is None or cascade_reject_below > reject_limit):
+            logger.warning(f"cascade_reject_below={cascade_reject_below} would reject pairs the hybrid score "
+                           f"accepts, using {reject_limit}")
+            cascade_reject_below = reject_limit
+        if cascade_accept_above is not None and (accept_limit is None or cascade_accept_above < accept_limit):
+            logger.warning(f"cascade_accept_above={cascade_accept_above} would accept pairs the hybrid score "
+                           f"rejects, using {accept_limit}")
+            cascade_accept_above = accept_limit
+        self.cascade_reject_below = cascade_reject_below
+        self.cascade_accept_above = cascade_accept_above
+        self.minutiae_matcher = minutiae_matcher
+        self.descriptor_extractor = MinutiaeDescriptorExtractor()
+        
+        # How often each verification stage is reached
+        self._stage_counts = dict.fromkeys(
+            ('verifications', 'quality_rejected', 'ai', 'ai_accepted', 'ai_rejected', 'minutiae',
+             'minutiae_skipped', 'deadline_exceeded'), 0)
+        self._stats_lock = threading.Lock()
+        # Smoothed stage durations, to tell whether a stage fits the time left
+        self._stage_seconds = {'ai': 0.0, 'minutiae': 0.0}
+        
+        # Initialize components; the model is the slow one, so it is built lazily
+        self.startup_timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        self.processor = FingerprintProcessor(enhance=enhance_ridges)
+        self.quality_gate = FingerprintQualityGate() if check_quality else None
+        self.startup_timings['processing'] = time.perf_counter() - start
+        self._model = model
+        self._model_factory = model_factory or FingerprintModel
+        self._model_lock = threading.Lock()
+        self._weights_digest = weights_digest
+        
+    @property
+    def model(self) -> FingerprintModel:
+        """Feature extractor, built on first use unless warmup() ran."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    model = self._model_factory()
+                    self.startup_timings['model'] = time.perf_counter() - start
+                    self.startup_timings.update(
+                        {f'model_{name}': seconds for name, seconds in model.startup_timings.items()})
+                    self._model = model
+        return self._model
+        
+    @property
+    def model_loaded(self) -> bool:
+        """Whether the feature extractor has been built."""
+        return self._model is not None
+        
+    def warmup(self) -> Dict[str, float]:
+        """
+        Build the model and run one template creation on a synthetic image,
+        so the first real request pays no startup cost.
+        
+        Returns:
+            Seconds spent per startup component
+        """
+        self.model  # built first so its time is reported on its own
+        start = time.perf_counter()
+        image = (np.random.default_rng(0).random((300, 300)) * 255).astype(np.uint8)
+        self.create_template(image)
+        self.startup_timings['warmup'] = time.perf_counter() - start
+        logger.info("Fingerprint verifier ready: " + ", ".join(
+            f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_timings.items()))
+        return dict(self.startup_timings)
+        
+    @property
+    def template_version(self) -> str:
+        """
+        Version string for templates produced by this verifier.
+        
+        Combines the template format, the processing configuration and the
+        model weights, so a change to any of them invalidates stored templates.
+        The model is only built for this when no weights digest was given.
+        """
+        if self.model_loaded or self._weights_digest is None:
+            weights_digest = self.model.weights_digest()
+        else:
+            weights_digest = self._weights_digest
+        return (f"{TEMPLATE_FORMAT_VERSION}-"
+                f"{self.processor.config_digest()}-"
+                f"{weights_digest}")
         
-        # Initialize components
-        self.processor = FingerprintProcessor()
-        self.model = FingerprintModel()
+    def create_template(self, image: np.ndarray) -> Dict[str, Any]:
+        """
+        Create an enrollment template from a fingerprint image.
+        
+        The template holds everything verification needs from the stored
+        fingerprint, so it only has to be computed once at registration.
+        
+        Args:
+            image: Fingerprint image (grayscale)
+            
+        Returns:
+            Dictionary with the template version, processed image,
+            feature vector, minutiae points and minutiae types
+        """
+        try:
+            processed_image = self.processor.preprocess_image(image)
+            features = self.model.extract_features(processed_image)
+            
+            if self.use_minutiae:
+                minutiae, types = self.processor.extract_minutiae(processed_image)
+            else:
+                minutiae, types = np.zeros((0, 2)), np.zeros(0)
+            
+            return {
+                'version': self.template_version,
+                'processed_image': processed_image,
+                'features': features,
+                'minutiae': np.asarray(minutiae),
+                'minutiae_types': np.asarray(types),
+            }
+            
+        except Exception as e:
+            logger.error(f"Error creating fingerprint template: {str(e)}")
+            raise
         
     def verify_fingerprint(self,
                           input_image: np.ndarray,
                           stored_features: np.ndarray,
-                          stored_minutiae: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[bool, float, Dict]:
+                          stored_minutiae: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                          deadline: Optional[Deadline] = None) -> Tuple[bool, float, Dict]:
         """
         Verify a fingerprint against stored features.
         
@@ -40,19 +226,50 @@ class FingerprintVerifier:
             input_image: Input fingerprint image
             stored_features: Stored feature vector
             stored_minutiae: Optional stored minutiae points and types
+            deadline: Time limit of the request; checked before every stage,
+                and minutiae matching is skipped when it would not fit
             
         Returns:
             Tuple of (verification result, confidence score, metadata)
+            
+        Raises:
+            DeadlineExceeded: When the deadline passes or is cancelled
+                before a stage starts
         """
+        deadline = deadline or Deadline()
         try:
-            # Preprocess input image
+            self._count('verifications')
+            
+            # Reject unusable captures before any expensive work
+            deadline.check('quality check')
+            if self.quality_gate is not None:
+                quality = self.quality_gate.check(input_image)
+                if not quality['accepted']:
+                    self._count('quality_rejected')
+                    return False, 0.0, {
+                        'timestamp': datetime.utcnow().isoformat(),
+                        'ai_similarity': 0.0,
+                        'confidence_score': 0.0,
+                        'verification_result': False,
+                        'verification_method': 'quality_rejected',
+                        'rejection_reason': quality['reason'],
+                        'rejection_message': quality['message'],
+                        'quality_scores': quality['scores']
+                    }
+            
+            # Preprocess input image; no point starting if the AI stage can't finish
+            deadline.check('preprocessing', self._stage_seconds['ai'])
+            started = time.perf_counter()
             processed_image = self.processor.preprocess_image(input_image)
             
             # Extract AI features
+            deadline.check('feature extraction')
             input_features = self.model.extract_features(processed_image)
             
             # Compute AI-based similarity
             ai_similarity = self.model.compute_similarity(input_features, stored_features)
+            self._count('ai')
+            self._record_time('ai', time.perf_counter() - started)
             
             # Initialize verification result
             verification_result = False
@@ -63,7 +280,21 @@ class FingerprintVerifier:
                 'verification_method': 'ai_only'
             }
             
-            if self.use_minutiae and stored_minutiae is not None:
+            stage = self._cascade_stage(ai_similarity)
+            if stage is not None and self.use_minutiae and stored_minutiae is not None:
+                # Clear accept or reject, minutiae matching cannot change the outcome enough
+                self._count(stage)
+                confidence_score = ai_similarity
+                metadata['verification_method'] = 'ai_cascade'
+            elif self.use_minutiae and stored_minutiae is not None and not deadline.allows(self._stage_seconds['minutiae']):
+                # Gray zone but too little time left: an answer on the AI score beats a timeout
+                self._count('minutiae_skipped')
+                confidence_score = ai_similarity
+                metadata['verification_method'] = 'ai_deadline'
+            elif self.use_minutiae and stored_minutiae is not None:
+                self._count('minutiae')
+                started = time.perf_counter()
+                
                 # Extract minutiae from input image
                 input_minutiae, input_types = self.processor.extract_minutiae(processed_image)
                 
@@ -74,7 +305,8 @@ class FingerprintVerifier:
                 )
                 
                 # Combine similarities (weighted average)
-                confidence_score = 0.7 * ai_similarity + 0.3 * minutiae_similarity
+                confidence_score = self.ai_weight * ai_similarity + self.minutiae_weight * minutiae_similarity
+                self._record_time('minutiae', time.perf_counter() - started)
                 metadata['minutiae_similarity'] = float(minutiae_similarity)
                 metadata['verification_method'] = 'hybrid'
             else:
@@ -88,10 +320,45 @@ class FingerprintVerifier:
             
             return verification_result, confidence_score, metadata
             
+        except DeadlineExceeded as e:
+            self._count('deadline_exceeded')
+            logger.warning(f"Fingerprint verification abandoned: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"Error in fingerprint verification: {str(e)}")
             raise
             
+    def get_stage_stats(self) -> Dict[str, Any]:
+        """
+        Get how often each verification stage was reached.
+        
+        Returns:
+            Dictionary with the stage counters and the fraction of
+            verifications that needed minutiae matching
+        """
+        with self._stats_lock:
+            stats = dict(self._stage_counts)
+        stats['minutiae_rate'] = stats['minutiae'] / stats['ai'] if stats['ai'] else 0.0
+        return stats
+        
+    def _cascade_stage(self, ai_similarity: float) -> Optional[str]:
+        """Return 'ai_accepted' or 'ai_rejected' when the AI score alone decides, None in the gray zone"""
+        if self.cascade_accept_above is not None and ai_similarity >= self.cascade_accept_above:
+            return 'ai_accepted'
+        if self.cascade_reject_below is not None and ai_similarity < self.cascade_reject_below:
+            return 'ai_rejected'
+        return None
+        
+    def _count(self, stage: str) -> None:
+        with self._stats_lock:
+            self._stage_counts[stage] += 1
+            
+    def _record_time(self, stage: str, seconds: float) -> None:
+        with self._stats_lock:
+            if self._stage_seconds[stage]:
+                seconds = 0.8 * self._stage_seconds[stage] + 0.2 * seconds
+            self._stage_seconds[stage] = seconds
+            
     def _compute_minutiae_similarity(self,
                                    minutiae1: np.ndarray,
                                    types1: np.ndarray,
@@ -111,52 +378,24 @@ class FingerprintVerifier:
         """
         try:
             # Normalize coordinates
-            minutiae1_norm = minutiae1 / self.processor.image_size
-            minutiae2_norm = minutiae2 / self.processor.image_size
-            
-            # Compute pairwise distances
-            distances = np.zeros((len(minutiae1), len(minutiae2)))
-            for i, m1 in enumerate(minutiae1_norm):
-                for j, m2 in enumerate(minutiae2_norm):
-                    distances[i, j] = np.linalg.norm(m1 - m2)
-            
-            # Find matching pairs
-            matches = []
-            used1 = set()
-            used2 = set()
-            
-            while True:
-                # Find closest unmatched pair
-                min_dist = float('inf')
-                min_i, min_j = -1, -1
-                
-                for i in range(len(minutiae1)):
-                    if i in used1:
-                        continue
-                    for j in range(len(minutiae2)):
-                        if j in used2:
-                            continue
-                        if distances[i, j] < min_dist:
-                            min_dist = distances[i, j]
-                            min_i, min_j = i, j
-                
-                if min_i == -1 or min_j == -1:
-                    break
-                    
-                # Check if types match
-                if types1[min_i] == types2[min_j]:
-                    matches.append(min_dist)
-                    used1.add(min_i)
-                    used2.add(min_j)
-                else:
-                    break
+            minutiae1_norm = np.asarray(minutiae1) / self.processor.image_size
+            minutiae2_norm = np.asarray(minutiae2) / self.processor.image_size
+            
+            if self.minutiae_matcher == 'descriptor':
+                return self.descriptor_extractor.match(
+                    self.descriptor_extractor.compute(minutiae1_norm, types1),
+                    self.descriptor_extractor.compute(minutiae2_norm, types2)
+                )
+            
+            # Pair minutiae of the same type
+            matches = match_minutiae(minutiae1_norm, types1, minutiae2_norm, types2, self.minutiae_matcher)
             
             # Compute similarity score
-            if not matches:
+            if not len(matches):
                 return 0.0
                 
             # Convert distances to similarities (closer = more similar)
-            similarities = 1 - np.array(matches)
+            similarities = 1 - matches
             return float(np.mean(similarities))
             
         except Exception as e:
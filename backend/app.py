@@ -1,17 +1,28 @@
 import os
+import sys
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 from flask_cors import CORS
+
+# The capture quality gates live in the ai package at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from services.auth_service import AuthService
 from services.biometric_service import BiometricService
+from services.face_encoding_pool import FaceEncodingPool
+from services.face_stream_service import FaceStreamService
 from services.blockchain_service import BlockchainService
 from services.face_service import FaceService
 from services.fingerprint_service import FingerprintService
+from utils.admission import AdmissionController, Overloaded
+from utils.image_io import PayloadTooLarge, read_stream
 from functools import wraps
 import jwt
 import time
 import base64
+import threading
+import uuid
 
 # Configure logging
 logging.basicConfig(
@@ -38,8 +49,14 @@ CORS(app, resources={
 })
 
 # Initialize services
+# FACE_POOL_WORKERS > 0 moves face encoding out of the request threads
+face_pool_workers = int(os.environ.get('FACE_POOL_WORKERS', 0))
+face_encoding_pool = FaceEncodingPool(workers=face_pool_workers).start() if face_pool_workers > 0 else None
+
 auth_service = AuthService()
-biometric_service = BiometricService()
+biometric_service = BiometricService(encoding_pool=face_encoding_pool)
+# Stream sessions are files so any serve.py worker can take the next frame
+face_stream_service = FaceStreamService(biometric_service, session_dir=os.environ.get('FACE_SESSION_DIR', 'data/face_sessions'))
 blockchain_service = BlockchainService()
 face_service = FaceService()
 fingerprint_service = FingerprintService()
@@ -54,6 +71,57 @@ os.makedirs('data/faces', exist_ok=True)
 os.makedirs('data/fingerprints', exist_ok=True)
 os.makedirs('data/vectors', exist_ok=True)
 
+# Largest face image accepted by the binary upload endpoint
+FACE_UPLOAD_MAX_BYTES = int(os.environ.get('FACE_UPLOAD_MAX_BYTES', 8 * 1024 * 1024))
+# Largest request body on any other route, sized for bulk enrollment archives
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', 1024 * 1024 * 1024))
+
+class UploadLimitedRequest(Request):
+    """Applies the face upload limit while werkzeug reads the body, chunked or not"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'verify_face_binary':
+            return FACE_UPLOAD_MAX_BYTES
+        return super().max_content_length
+
+app.request_class = UploadLimitedRequest
+
+@app.errorhandler(413)
+def payload_too_large(e):
+    return jsonify({'message': 'Payload too large', 'maxBytes': request.max_content_length}), 413
+
+# Bulk enrollment sources given by path must live under this directory
+ENROLLMENT_IMPORT_DIR = os.path.abspath(os.environ.get('ENROLLMENT_IMPORT_DIR', 'data/imports'))
+ENROLLMENT_STATE_DIR = 'data/enrollment'
+
+# Bounded queue in front of the CPU-heavy biometric endpoints: requests past
+# the running slots and the queue get a 429 instead of piling up. Without
+# BIOMETRIC_CONCURRENCY each serve.py worker runs its share of the cores
+biometric_admission = AdmissionController(
+    concurrency=int(os.environ.get('BIOMETRIC_CONCURRENCY', 0)) or None,
+    max_queue=int(os.environ['BIOMETRIC_MAX_QUEUE']) if 'BIOMETRIC_MAX_QUEUE' in os.environ else None,
+    max_wait=float(os.environ.get('BIOMETRIC_MAX_WAIT', 10))
+)
+
+# The enrollment service loads the fingerprint model, so build it on first use
+enrollment_service = None
+enrollment_jobs = {}
+enrollment_lock = threading.Lock()
+
+def get_enrollment_service():
+    global enrollment_service
+    with enrollment_lock:
+        if enrollment_service is None:
+            from services.enrollment_service import BulkEnrollmentService
+            from services.verification_service import VerificationService
+            enrollment_service = BulkEnrollmentService(
+                VerificationService(),
+                biometric_service,
+                state_dir=ENROLLMENT_STATE_DIR
+            )
+        return enrollment_service
+
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -74,6 +142,23 @@ def require_auth(f):
             return jsonify({'message': 'Invalid token'}), 401
     return decorated
 
+def admission_controlled(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        try:
+            with biometric_admission.slot():
+                return f(*args, **kwargs)
+        except Overloaded as e:
+            logger.warning(f"Rejected {request.path}: {e.reason}")
+            response = jsonify({
+                'message': 'Server busy, please retry',
+                'reason': e.reason,
+                'retryAfter': e.retry_after
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+    return decorated
+
 @app.route('/login', methods=['POST'])
 def login():
     try:
@@ -146,6 +231,7 @@ def connect_scanner():
 
 @app.route('/verify/face', methods=['POST'])
 @require_auth
+@admission_controlled
 def verify_face():
     data = request.get_json()
     voter_id = data.get('voterId')
@@ -154,14 +240,123 @@ def verify_face():
     if not voter_id or not face_data:
         return jsonify({'message': 'Missing voter ID or face data'}), 400
     
+    # Quality gate, detection and encoding; unusable captures are re-captured straight away
+    result = biometric_service.analyze_face_image(face_data)
+    if not result['success']:
+        if result.get('recapture'):
+            return jsonify({
+                'message': result['message'],
+                'reason': result['reason'],
+                'quality': result.get('quality'),
+                'recapture': True
+            }), 422
+        return jsonify({'message': result['message']}), 400
+    
+    # For demo purposes, always return success
+    return jsonify({
+        'message': 'Face verification successful (Demo Mode)',
+        'vector_path': f'data/vectors/{voter_id}_face.npy'
+    })
+
+@app.route('/verify/face/binary', methods=['POST'])
+@require_auth
+@admission_controlled
+def verify_face_binary():
+    """Verify a face sent as raw image bytes instead of base64 JSON
+
+    Accepts either a multipart form with a 'face' file or an
+    application/octet-stream / image/* body. The voter ID comes from the
+    'voterId' query or form field, or the X-Voter-Id header. '?reduce=2|4|8'
+    decodes JPEGs at reduced resolution.
+    """
+    voter_id = request.args.get('voterId') or request.headers.get('X-Voter-Id')
+    try:
+        reduce_factor = int(request.args.get('reduce', 1))
+    except ValueError:
+        return jsonify({'message': 'Invalid reduce factor'}), 400
+    if reduce_factor not in (1, 2, 4, 8):
+        return jsonify({'message': 'Invalid reduce factor'}), 400
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            # Oversized forms, chunked ones included, are refused with a 413
+            # while werkzeug parses them (see UploadLimitedRequest)
+            upload = request.files.get('face')
+            voter_id = voter_id or request.form.get('voterId')
+            if upload is None:
+                return jsonify({'message': 'Missing face image'}), 400
+            image_data = read_stream(upload.stream, FACE_UPLOAD_MAX_BYTES)
+        elif request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/'):
+            image_data = read_stream(request.stream, FACE_UPLOAD_MAX_BYTES, request.content_length)
+        else:
+            return jsonify({'message': 'Unsupported content type'}), 415
+    except PayloadTooLarge as e:
+        return jsonify({'message': str(e), 'maxBytes': e.max_bytes}), 413
+    
+    if not voter_id or not len(image_data):
+        return jsonify({'message': 'Missing voter ID or face data'}), 400
+    
+    result = biometric_service.analyze_face_bytes(image_data, reduce_factor)
+    if not result['success']:
+        if result.get('recapture'):
+            return jsonify({
+                'message': result['message'],
+                'reason': result['reason'],
+                'quality': result.get('quality'),
+                'recapture': True
+            }), 422
+        return jsonify({'message': result['message']}), 400
+    
     # For demo purposes, always return success
     return jsonify({
         'message': 'Face verification successful (Demo Mode)',
         'vector_path': f'data/vectors/{voter_id}_face.npy'
     })
 
+@app.route('/verify/face/stream', methods=['POST'])
+@require_auth
+def start_face_stream():
+    """Open a multi-frame face verification session"""
+    data = request.get_json() or {}
+    voter_id = data.get('voterId')
+    
+    if not voter_id:
+        return jsonify({'message': 'Missing voter ID'}), 400
+    
+    session = face_stream_service.start_session(voter_id)
+    if session is None:
+        return jsonify({'message': 'No enrolled face for this voter'}), 404
+    
+    return jsonify({
+        'sessionId': session.session_id,
+        'maxFrames': session.max_frames,
+        'frameUrl': f'/verify/face/stream/{session.session_id}'
+    }), 201
+
+@app.route('/verify/face/stream/<session_id>', methods=['POST'])
+@require_auth
+@admission_controlled
+def add_face_stream_frames(session_id):
+    """Submit one ('faceData') or several ('frames') frames to a session
+
+    Frames are scored in order until the fused confidence reaches a decision;
+    the returned state is 'pending' until then.
+    """
+    data = request.get_json() or {}
+    frames = data.get('frames') or ([data['faceData']] if data.get('faceData') else [])
+    
+    if not frames:
+        return jsonify({'message': 'Missing face data'}), 400
+    
+    status = face_stream_service.add_frames(session_id, frames)
+    if status is None:
+        return jsonify({'message': 'Unknown or expired session'}), 404
+    
+    return jsonify(status)
+
 @app.route('/verify/fingerprint', methods=['POST'])
 @require_auth
+@admission_controlled
 def verify_fingerprint():
     data = request.get_json()
     voter_id = data.get('voterId')
@@ -190,6 +385,78 @@ def verify_voter_id():
         'verified': True
     })
 
+@app.route('/enroll/bulk', methods=['POST'])
+@require_auth
+def bulk_enroll():
+    """Start or resume a bulk enrollment job
+
+    Accepts either a multipart upload with an 'archive' file (and optional
+    'manifest' file), or JSON naming a 'source' directory or archive under
+    ENROLLMENT_IMPORT_DIR. Passing the 'jobId' of an earlier job resumes it.
+    """
+    data = request.get_json(silent=True) or request.form
+    job_id = data.get('jobId') or uuid.uuid4().hex
+    retry_failed = str(data.get('retryFailed', '')).lower() in ('1', 'true', 'yes')
+    if not isinstance(job_id, str) or not job_id.replace('-', '').replace('_', '').isalnum():
+        return jsonify({'message': 'Invalid job ID'}), 400
+
+    service = get_enrollment_service()
+    job_dir = os.path.join(ENROLLMENT_STATE_DIR, job_id)
+    manifest = None
+
+    if 'archive' in request.files:
+        archive = request.files['archive']
+        os.makedirs(job_dir, exist_ok=True)
+        source = os.path.join(job_dir, 'source' + os.path.splitext(archive.filename or '')[1])
+        archive.save(source)
+        if 'manifest' in request.files:
+            manifest = os.path.join(job_dir, 'manifest.csv')
+            request.files['manifest'].save(manifest)
+    elif data.get('source'):
+        source = os.path.abspath(os.path.join(ENROLLMENT_IMPORT_DIR, data['source']))
+        manifest = data.get('manifest')
+        if manifest:
+            manifest = os.path.abspath(os.path.join(ENROLLMENT_IMPORT_DIR, manifest))
+        for path in filter(None, [source, manifest]):
+            if os.path.commonpath([path, ENROLLMENT_IMPORT_DIR]) != ENROLLMENT_IMPORT_DIR:
+                return jsonify({'message': 'Source must be inside the import directory'}), 400
+    else:
+        # Resuming: reuse the source of the earlier run
+        status = service.get_status(job_id)
+        if status is None:
+            return jsonify({'message': 'Missing archive or source'}), 400
+        source = status['source']
+        uploaded_manifest = os.path.join(job_dir, 'manifest.csv')
+        if os.path.exists(uploaded_manifest):
+            manifest = uploaded_manifest
+
+    with enrollment_lock:
+        running = enrollment_jobs.get(job_id)
+        if running is not None and running.is_alive():
+            return jsonify({'message': 'Job is already running', 'jobId': job_id}), 409
+        thread = threading.Thread(
+            target=service.run,
+            kwargs={'source_path': source, 'manifest_path': manifest, 'job_id': job_id, 'retry_failed': retry_failed},
+            daemon=True
+        )
+        enrollment_jobs[job_id] = thread
+        thread.start()
+
+    logger.info(f"Started bulk enrollment job {job_id} from {source}")
+    return jsonify({
+        'message': 'Bulk enrollment started',
+        'jobId': job_id,
+        'statusUrl': f'/enroll/bulk/{job_id}'
+    }), 202
+
+@app.route('/enroll/bulk/<job_id>', methods=['GET'])
+@require_auth
+def bulk_enroll_status(job_id):
+    status = get_enrollment_service().get_status(job_id)
+    if status is None:
+        return jsonify({'message': 'Unknown job'}), 404
+    return jsonify(status)
+
 @app.route('/vote', methods=['POST'])
 @require_auth
 def cast_vote():
@@ -219,6 +486,12 @@ def cast_vote():
     except Exception as e:
         return jsonify({'message': f'Failed to record vote: {str(e)}'}), 500
 
+@app.route('/stats/admission', methods=['GET'])
+@require_auth
+def admission_stats():
+    """Queue depth, wait times and rejections of the biometric endpoints"""
+    return jsonify(biometric_admission.stats())
+
 @app.route('/blockchain', methods=['GET'])
 @require_auth
 def get_blockchain():
@@ -0,0 +1,71 @@
+"""
+Bulk voter enrollment from a directory or archive of images.
+
+The manifest is a CSV file with voter_id, face and fingerprint columns,
+where face and fingerprint are image paths relative to the source. Any
+other columns are stored as fingerprint metadata. Re-running with the same
+--job-id resumes an interrupted job.
+
+Usage:
+    python enroll.py district.zip --job-id district-42 --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from services.biometric_service import BiometricService
+from services.enrollment_service import BulkEnrollmentService
+from services.face_encoding_pool import FaceEncodingPool
+from services.verification_service import VerificationService
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory, .zip or .tar[.gz] archive with the images")
+    parser.add_argument("--manifest", help="CSV manifest (default: manifest.csv inside the source)")
+    parser.add_argument("--job-id", help="Job ID to resume")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Items processed in parallel")
+    parser.add_argument("--face-pool-workers", type=int, default=0,
+                        help="Processes used for face encoding (0 encodes in the worker threads)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Items written to the store at once")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry items that failed in an earlier run")
+    parser.add_argument("--report", help="Write the final report as JSON to this file")
+    args = parser.parse_args()
+
+    face_pool = FaceEncodingPool(workers=args.face_pool_workers).start() if args.face_pool_workers > 0 else None
+    service = BulkEnrollmentService(
+        VerificationService(),
+        BiometricService(encoding_pool=face_pool),
+        workers=args.workers,
+        batch_size=args.batch_size
+    )
+
+    def show_progress(status):
+        print(f"\r{status['enrolled']} enrolled, {status['failed']} failed, "
+              f"{status['skipped']} skipped", end="", flush=True)
+
+    try:
+        report = service.run(
+            args.source,
+            manifest_path=args.manifest,
+            job_id=args.job_id,
+            retry_failed=args.retry_failed,
+            progress_callback=show_progress
+        )
+    finally:
+        if face_pool is not None:
+            face_pool.close()
+
+    print()
+    print(f"Job {report['job_id']} {report['state']} in {report['elapsed']:.1f}s")
+    for failure in report['failures']:
+        print(f"  {failure['voter_id'] or '<missing id>'}: {failure['error']}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(0 if report['state'] == 'completed' and not report['failures'] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -7,19 +7,32 @@ from fastapi.security import APIKeyHeader, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Tuple
 import numpy as np
 import cv2
 from datetime import datetime
+import asyncio
 import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from loguru import logger
 
+from utils.admission import AdmissionController, Overloaded, cores_per_worker
+from utils.single_flight import SingleFlight
+from ai.utils.deadline import Deadline, DeadlineExceeded
 from ai.utils.verification import FingerprintVerifier
+from ai.models.fingerprint_model import FingerprintModel
 from ai.config import (
+    AI_CONFIG,
     API_CONFIG,
     SECURITY_CONFIG,
+    PROCESSING_CONFIG,
     VERIFICATION_CONFIG,
-    LOGGING_CONFIG
+    LOGGING_CONFIG,
+    ensure_directories
 )
 
 # Initialize FastAPI app
@@ -45,9 +58,48 @@ security = HTTPBearer()
 # Initialize verifier
 verifier = FingerprintVerifier(
     similarity_threshold=VERIFICATION_CONFIG["similarity_threshold"],
-    use_minutiae=VERIFICATION_CONFIG["use_minutiae"]
+    use_minutiae=VERIFICATION_CONFIG["use_minutiae"],
+    check_quality=VERIFICATION_CONFIG["check_quality"],
+    ai_weight=VERIFICATION_CONFIG["ai_weight"],
+    minutiae_weight=VERIFICATION_CONFIG["minutiae_weight"],
+    cascade_reject_below=VERIFICATION_CONFIG["cascade_reject_below"],
+    cascade_accept_above=VERIFICATION_CONFIG["cascade_accept_above"],
+    minutiae_matcher=VERIFICATION_CONFIG["minutiae_matcher"],
+    enhance_ridges=PROCESSING_CONFIG["enhance"],
+    model_factory=lambda: FingerprintModel.from_config(AI_CONFIG),
+    weights_digest=FingerprintModel.config_weights_digest(AI_CONFIG)
 )
 
+# CPU-bound work runs here so the event loop keeps answering other requests.
+# Threads, not processes: OpenCV and the inference runtimes release the GIL,
+# and the workers share the one loaded model. Under serve.py each process gets
+# its share of the cores, so the box as a whole runs one verification per core
+verification_workers = VERIFICATION_CONFIG["verification_workers"] or cores_per_worker()
+verification_executor = ThreadPoolExecutor(max_workers=verification_workers, thread_name_prefix="verify")
+
+# Requests beyond the executor threads wait in a bounded queue, the rest get a 429
+admission = AdmissionController(
+    concurrency=verification_workers,
+    max_queue=VERIFICATION_CONFIG["admission_max_queue"],
+    max_wait=VERIFICATION_CONFIG["verification_timeout"]
+)
+
+# Double submits and kiosk retries of the same upload share one verification
+verification_flight = SingleFlight()
+
+@app.on_event("startup")
+async def startup():
+    """Create the data directories and load the model in the background."""
+    ensure_directories()
+    # Health and config endpoints answer while the model loads; the first
+    # verification waits for it
+    threading.Thread(target=verifier.warmup, name="model-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the verification threads."""
+    verification_executor.shutdown(wait=False, cancel_futures=True)
+
 # Request/Response models
 class VerificationRequest(BaseModel):
     voter_id: str
@@ -75,12 +127,101 @@ async def verify_api_key(api_key: str = Security(api_key_header)):
         )
     return api_key
 
-async def process_image(file: UploadFile) -> np.ndarray:
+# Admission record of the request being served: when it entered the queue
+# and when its first executor call started
+_admission_request: ContextVar[Optional[Dict[str, Any]]] = ContextVar("admission_request", default=None)
+_admission_lock = threading.Lock()
+
+@asynccontextmanager
+async def admitted():
+    """
+    Hold a place in the verification queue for the duration of the block.
+    
+    The request is counted as started once, when its first run_cpu_bound
+    call reaches an executor thread, however many calls it makes.
+    """
+    try:
+        entered = admission.enter()
+    except Overloaded as e:
+        logger.warning(f"Verification rejected: {e.reason}")
+        raise HTTPException(
+            status_code=429,
+            detail="Server busy, please retry",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    record = {"entered": entered, "started": None, "done": False}
+    token = _admission_request.set(record)
+    try:
+        yield
+    finally:
+        _admission_request.reset(token)
+        with _admission_lock:
+            # A call still queued in the executor must not start the request any more
+            record["done"] = True
+        if record["started"] is not None:
+            admission.finish(record["started"])
+        admission.leave()
+
+async def run_cpu_bound(func: Callable, *args, deadline: Optional[Deadline] = None):
+    """
+    Run a CPU-bound function on the verification executor.
+    
+    Args:
+        func: Function to call
+        *args: Its arguments
+        deadline: Deadline by which it must finish, None for no limit
+        
+    Returns:
+        The function's result
+        
+    Raises:
+        HTTPException: 504 when the deadline passes, whether the call is still
+            queued (it is then skipped) or running (the deadline is cancelled
+            so deadline-aware functions stop at their next stage)
+    """
+    deadline = deadline or Deadline()
+    record = _admission_request.get()
+    
+    def call():
+        # Queued past the deadline: nobody is waiting for the result any more
+        deadline.check(getattr(func, '__name__', 'call'))
+        if record is not None:
+            with _admission_lock:
+                if not record["done"] and record["started"] is None:
+                    # The executor threads already cap concurrency, this only records the wait
+                    admission.start(record["entered"], wait=False)
+                    record["started"] = time.monotonic()
+        return func(*args)
+    
+    loop = asyncio.get_running_loop()
+    future = None
+    try:
+        deadline.check(getattr(func, '__name__', 'call'))
+        future = loop.run_in_executor(verification_executor, call)
+        # The deadline is read on every pass: a coalesced call gets more time
+        # when a caller with a later deadline joins it
+        return await deadline.wait(future)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        if future is not None:
+            future.cancel()
+        deadline.cancel()
+        logger.warning(f"{getattr(func, '__name__', 'Call')} exceeded the verification timeout")
+        raise HTTPException(status_code=504, detail="Verification timed out")
+    except asyncio.CancelledError:
+        # The request was abandoned, stop the work it left behind
+        if future is not None:
+            future.cancel()
+        deadline.cancel()
+        raise
+
+def decode_image(contents: bytes) -> Optional[np.ndarray]:
+    """Decode an encoded image to grayscale, None if it is not an image."""
+    return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+async def process_image(contents: bytes, deadline: Optional[Deadline] = None) -> np.ndarray:
     """Process uploaded image file."""
     try:
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+        image = await run_cpu_bound(decode_image, contents, deadline=deadline)
         
         if image is None:
             raise HTTPException(
@@ -90,6 +231,8 @@ async def process_image(file: UploadFile) -> np.ndarray:
             
         return image
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         raise HTTPException(
@@ -97,10 +240,30 @@ async def process_image(file: UploadFile) -> np.ndarray:
             detail="Error processing image"
         )
 
+async def verify_upload(contents: bytes, deadline: Deadline) -> Tuple[bool, float, Dict]:
+    """Decode an uploaded fingerprint and verify it, on the verification executor."""
+    async with admitted():
+        image = await process_image(contents, deadline)
+        
+        # TODO: Fetch stored features from blockchain
+        # This is a placeholder - implement actual blockchain integration
+        stored_features = np.random.rand(512)  # Placeholder
+        stored_minutiae = (np.random.rand(10, 2), np.random.randint(0, 2, 10))  # Placeholder
+        
+        return await run_cpu_bound(
+            verifier.verify_fingerprint,
+            image,
+            stored_features,
+            stored_minutiae,
+            deadline,
+            deadline=deadline
+        )
+
 # API endpoints
 @app.post("/verify",
           response_model=VerificationResponse,
-          responses={400: {"model": ErrorResponse}, 401: {"model": ErrorResponse}},
+          responses={400: {"model": ErrorResponse}, 401: {"model": ErrorResponse}, 422: {"model": ErrorResponse},
+                     429: {"model": ErrorResponse}, 504: {"model": ErrorResponse}},
           dependencies=[Depends(verify_api_key)])
 async def verify_fingerprint(
     fingerprint: UploadFile = File(...),
@@ -119,20 +282,32 @@ async def verify_fingerprint(
         Verification result with confidence score and metadata
     """
     try:
-        # Process uploaded image
-        image = await process_image(fingerprint)
+        # One deadline covers decoding, queueing and every verification stage
+        deadline = Deadline.after(VERIFICATION_CONFIG["verification_timeout"])
         
-        # TODO: Fetch stored features from blockchain
-        # This is a placeholder - implement actual blockchain integration
-        stored_features = np.random.rand(512)  # Placeholder
-        stored_minutiae = (np.random.rand(10, 2), np.random.randint(0, 2, 10))  # Placeholder
+        # Verify fingerprint; an identical upload already in flight is waited for
+        # instead, without taking a place in the admission queue, but only until
+        # this request's own deadline
+        contents = await fingerprint.read()
+        try:
+            (result, confidence, metadata), _ = await verification_flight.do_async(
+                SingleFlight.key(voter_id, contents), verify_upload, contents, deadline=deadline)
+        except asyncio.TimeoutError:
+            logger.warning("Verification exceeded the verification timeout")
+            raise HTTPException(status_code=504, detail="Verification timed out")
         
-        # Verify fingerprint
-        result, confidence, metadata = verifier.verify_fingerprint(
-            image,
-            stored_features,
-            stored_minutiae
-        )
+        # Unusable capture: tell the kiosk to re-capture
+        if metadata['verification_method'] == 'quality_rejected':
+            return JSONResponse(
+                status_code=422,
+                content={
+                    "error": "Capture rejected",
+                    "reason": metadata['rejection_reason'],
+                    "details": metadata['rejection_message'],
+                    "recapture": True,
+                    "quality_scores": metadata['quality_scores']
+                }
+            )
         
         # TODO: Record verification on blockchain
         # This is a placeholder - implement actual blockchain integration
@@ -145,6 +320,8 @@ async def verify_fingerprint(
             transaction_hash=transaction_hash
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in verification: {str(e)}")
         raise HTTPException(
@@ -155,7 +332,12 @@ async def verify_fingerprint(
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return {
+        "status": "healthy",
+        "model_ready": "warmup" in verifier.startup_timings,
+        "startup_timings": verifier.startup_timings,
+        "timestamp": datetime.utcnow().isoformat()
+    }
 
 @app.get("/config")
 async def get_config():
@@ -169,12 +351,23 @@ async def get_config():
         }
     }
 
+@app.get("/stats")
+async def get_stats():
+    """Get verification stage counts, batching, admission queue and coalescing metrics."""
+    return {
+        "stages": verifier.get_stage_stats(),
+        "batching": verifier.model.batching_stats() if verifier.model_loaded else None,
+        "admission": admission.stats(),
+        "coalescing": verification_flight.stats()
+    }
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"error": exc.detail}
+        content={"error": exc.detail},
+        headers=exc.headers
     )
 
 @app.exception_handler(Exception)
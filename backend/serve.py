@@ -0,0 +1,306 @@
+"""
+Preload-and-fork launcher for the Flask (app.py) and FastAPI (main.py) apps.
+
+The master process imports the app, which loads the dlib face models and
+the fingerprint model, then forks the HTTP workers. The workers share the
+model pages copy-on-write instead of each loading its own copy, so more of
+them fit on a box and a restarted worker is serving in milliseconds. Each
+worker's startup time and RSS / PSS are logged when it comes up; PSS
+splits shared pages between the processes using them, so the sum over the
+workers is what the box actually pays.
+
+TensorFlow does not survive a fork once it has run a model, so a keras
+fingerprint model is loaded in each worker instead; export it and use the
+tflite or onnx backend to share it.
+
+Usage:
+    python serve.py flask --workers 4 --port 5000
+    python serve.py fastapi --workers 4 --port 8000
+    python serve.py flask --workers 4 --no-preload   # every worker loads its own models
+
+Signals: SIGHUP replaces the workers one at a time, SIGTERM / SIGINT stop them.
+"""
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(Path(__file__).resolve().parent), str(ROOT)]
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("serve")
+
+APP_MODULES = {"flask": "app", "fastapi": "main"}
+
+def memory_usage(pid: int) -> Dict[str, float]:
+    """
+    Memory used by a process, in MB
+    Args:
+        pid: Process ID
+    Returns:
+        Dictionary with rss, pss and shared (pages also mapped by other
+        processes); pss and shared are missing where smaps_rollup is not available
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                    usage[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return usage
+    return {
+        "rss": usage.get("Rss", 0.0),
+        "pss": usage.get("Pss", 0.0),
+        "shared": usage.get("Shared_Clean", 0.0) + usage.get("Shared_Dirty", 0.0),
+    }
+
+def load_app(kind: str, warm: bool = True):
+    """
+    Import an app module and warm up its models
+    Args:
+        kind: 'flask' or 'fastapi'
+        warm: Whether to load the fingerprint model too
+    Returns:
+        The WSGI / ASGI app
+    """
+    module = importlib.import_module(APP_MODULES[kind])
+    # Importing app.py already loaded the dlib models through face_recognition
+    if kind == "fastapi" and warm:
+        from ai.config import AI_CONFIG
+        if AI_CONFIG["inference_backend"] == "keras":
+            logger.warning("TensorFlow is not fork-safe, the keras model is loaded in each worker; "
+                           "use the tflite or onnx backend to share it")
+        else:
+            module.verifier.warmup()
+    return module.app
+
+def serve_worker(kind: str, app, sock: socket.socket) -> None:
+    """Serve requests on the inherited listening socket until terminated"""
+    if kind == "flask":
+        from werkzeug.serving import make_server
+        host, port = sock.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+    else:
+        import uvicorn
+        uvicorn.Server(uvicorn.Config(app, lifespan="on")).run(sockets=[sock])
+
+class Launcher:
+    def __init__(self, kind: str, sock: socket.socket, workers: int, preload: bool = True):
+        """
+        Args:
+            kind: 'flask' or 'fastapi'
+            sock: Bound listening socket shared by the workers
+            workers: Number of worker processes
+            preload: Load the app in the master and fork it, instead of in every worker
+        """
+        self.kind = kind
+        self.sock = sock
+        self.workers = workers
+        self.preload = preload
+        self.app = None
+        self.children: Dict[int, int] = {}  # pid -> worker index
+        self.forked_at: Dict[int, float] = {}
+        self.ready: Set[int] = set()
+        # Old workers a rolling restart is replacing: not respawned when they exit
+        self.retiring: Set[int] = set()
+        self._ready_read, self._ready_write = os.pipe()
+        self._ready_buffer = b""
+        self._stopping = False
+        self._restart = False
+
+    def run(self) -> None:
+        if self.preload:
+            start = time.perf_counter()
+            self.app = load_app(self.kind)
+            logger.info(f"Preloaded {self.kind} app in {time.perf_counter() - start:.2f}s, "
+                        f"master RSS {memory_usage(os.getpid()).get('rss', 0):.0f} MB")
+            # Keep the preloaded heap out of the collector so workers don't
+            # dirty the shared pages when it runs
+            gc.collect()
+            gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+
+        for index in range(self.workers):
+            self._spawn(index)
+        while not self._stopping:
+            if self._restart:
+                self._restart = False
+                self._rolling_restart()
+            self._wait_for_events(timeout=1.0)
+        self._shutdown()
+
+    def _spawn(self, index: int) -> int:
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            self.forked_at[pid] = forked_at
+            return pid
+
+        # Worker
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        os.close(self._ready_read)
+        try:
+            app = self.app if self.app is not None else load_app(self.kind)
+            os.write(self._ready_write, f"{os.getpid()}\n".encode())
+            serve_worker(self.kind, app, self.sock)
+        except Exception:
+            logger.exception(f"Worker {index} failed")
+            os._exit(1)
+        os._exit(0)
+
+    def _wait_for_events(self, timeout: float) -> None:
+        self._read_ready(timeout)
+
+        # Replace workers that died on their own
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            index = self.children.pop(pid, None)
+            forked_at = self.forked_at.pop(pid, None)
+            self.ready.discard(pid)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if index is not None and not self._stopping:
+                logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting it")
+                # Don't spin on a worker that crashes during startup
+                if time.perf_counter() - forked_at < 1.0:
+                    time.sleep(1.0)
+                self._spawn(index)
+
+    def _read_ready(self, timeout: float) -> None:
+        """Wait up to timeout for workers to report ready, and record every one that did"""
+        try:
+            readable, _, _ = select.select([self._ready_read], [], [], timeout)
+        except InterruptedError:
+            readable = []
+        if not readable:
+            return
+        # A read can end mid-line, keep the rest for the next one
+        lines = (self._ready_buffer + os.read(self._ready_read, 4096)).split(b"\n")
+        self._ready_buffer = lines.pop()
+        for line in lines:
+            if line:
+                self._report_ready(int(line))
+
+    def _report_ready(self, pid: int) -> None:
+        if pid not in self.children:
+            return
+        startup = time.perf_counter() - self.forked_at[pid]
+        usage = memory_usage(pid)
+        logger.info(f"Worker {self.children[pid]} (pid {pid}) ready in {startup:.2f}s: "
+                    f"RSS {usage.get('rss', 0):.0f} MB, PSS {usage.get('pss', 0):.0f} MB, "
+                    f"shared {usage.get('shared', 0):.0f} MB")
+        self.ready = (self.ready | {pid}) & set(self.children)
+        # Not while a rolling restart briefly runs an extra worker
+        if len(self.children) == self.workers and self.ready == set(self.children):
+            self._report_total()
+
+    def _report_total(self) -> None:
+        total = sum(memory_usage(child).get("pss", 0) for child in self.children)
+        logger.info(f"Total worker PSS {total:.0f} MB for {len(self.children)} workers")
+
+    def _rolling_restart(self) -> None:
+        logger.info("Replacing workers one at a time")
+        for pid, index in list(self.children.items()):
+            if pid not in self.children:
+                # Died, and was replaced, while an earlier worker was being replaced
+                continue
+            self.retiring.add(pid)
+            self._spawn(index)
+            # Wait for the replacement before stopping the old worker, meanwhile
+            # record other workers' ready reports and replace workers that die
+            deadline = time.monotonic() + 60
+            while not self._replaced(pid, index) and time.monotonic() < deadline and not self._stopping:
+                self._wait_for_events(timeout=0.1)
+            # Unless it already exited and was reaped, its pid may belong to another process now
+            if pid in self.children:
+                self._terminate(pid)
+                del self.children[pid]
+                self.forked_at.pop(pid, None)
+                self.ready.discard(pid)
+            self.retiring.discard(pid)
+        self._report_total()
+
+    def _replaced(self, pid: int, index: int) -> bool:
+        # The replacement, or its own replacement if it crashed, is serving
+        return any(child != pid and child in self.ready
+                   for child, child_index in self.children.items() if child_index == index)
+
+    def _terminate(self, pid: int, timeout: float = 10.0) -> None:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return
+            time.sleep(0.05)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def _shutdown(self) -> None:
+        logger.info("Stopping workers")
+        for pid in list(self.children):
+            self._terminate(pid)
+        self.children.clear()
+
+    def _on_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _on_restart(self, signum, frame) -> None:
+        self._restart = True
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", choices=sorted(APP_MODULES), help="App to serve")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to bind")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)), help="Port to bind")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Load the app in every worker instead of sharing it")
+    args = parser.parse_args(argv)
+
+    if args.preload and int(os.environ.get("FACE_POOL_WORKERS", 0)) > 0:
+        # The pool's collector thread would not exist in the forked workers
+        logger.warning("FACE_POOL_WORKERS is ignored with preloading, the HTTP workers encode faces themselves")
+        os.environ["FACE_POOL_WORKERS"] = "0"
+
+    # Apps size their thread pools and admission queues to their share of the cores
+    os.environ["SERVER_WORKERS"] = str(args.workers)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    logger.info(f"Listening on {args.host}:{args.port} with {args.workers} {args.app} workers"
+                f"{'' if args.preload else ' (no preload)'}")
+
+    Launcher(args.app, sock, args.workers, args.preload).run()
+
+if __name__ == "__main__":
+    main()
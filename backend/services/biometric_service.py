@@ -1,19 +1,92 @@
 import cv2
 import numpy as np
-import face_recognition
 import base64
 import os
-from typing import Optional, Tuple, Dict, Any
+import threading
+import time
+from typing import Optional, Tuple, Dict, Any, Union
 import logging
+from ai.preprocessing.quality import FaceQualityGate
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from .face_service import FaceService
 from .fingerprint_service import FingerprintService
+from .face_encoding_pool import FaceEncodingPool
+from utils.face_utils import FaceLocation, detect_largest_face, encode_face
+from utils.image_io import Buffer, decode_image_buffer
+from utils.result_cache import EmbeddingCache
+from utils.single_flight import SingleFlight
+
+def _calibrate(value: float, threshold: float, best: float, worst: float) -> float:
+    """Map a raw match value to [0, 1], with the decision threshold at 0.5"""
+    if (value - threshold) * (best - threshold) >= 0:
+        score = 0.5 + 0.5 * (value - threshold) / (best - threshold)
+    else:
+        score = 0.5 - 0.5 * (value - threshold) / (worst - threshold)
+    return float(min(1.0, max(0.0, score)))
+
+def _modality_failure(error: str, reason: Optional[str] = None, hard_failure: bool = True) -> Dict[str, Any]:
+    return {'hard_failure': hard_failure, 'match': False, 'score': 0.0, 'error': error, 'reason': reason}
+
+def _modality_timeout(error: str) -> Dict[str, Any]:
+    # No score at all: fusing it as a 0 would let the other modality decide alone
+    return {'hard_failure': False, 'timed_out': True, 'match': False, 'score': None, 'error': error, 'reason': 'timed_out'}
 
 class BiometricService:
-    def __init__(self):
+    def __init__(self,
+                 detection_scale: Optional[float] = None,
+                 detection_max_side: int = 480,
+                 encoding_pool: Optional[FaceEncodingPool] = None,
+                 encoding_timeout: float = 10.0,
+                 check_quality: bool = True,
+                 cache_size: int = 1024,
+                 cache_ttl: float = 300.0,
+                 verification_timeout: float = 15.0,
+                 fusion_weights: Optional[Dict[str, float]] = None,
+                 fusion_threshold: float = 0.5,
+                 min_modality_score: float = 0.4):
+        """
+        Args:
+            detection_scale: Fixed downscale factor for face detection,
+                or None to pick it from the frame size
+            detection_max_side: Longest side of the frame seen by the face
+                detector when detection_scale is None
+            encoding_pool: Started FaceEncodingPool to run detection and
+                encoding in, or None to run them in the calling thread
+            encoding_timeout: Seconds to wait for the pool to encode a frame
+            check_quality: Whether to reject blurry or badly exposed frames
+                before face detection
+            cache_size: Number of face embeddings cached by image digest, 0 disables the cache
+            cache_ttl: Seconds a cached face embedding stays valid
+            verification_timeout: Default seconds allowed for a combined
+                face and fingerprint verification
+            fusion_weights: Weight of the 'face' and 'fingerprint' scores in
+                the fused score, equal by default
+            fusion_threshold: Fused score needed to accept a voter
+            min_modality_score: Calibrated score every modality needs on its own,
+                so fusion only makes up for a borderline miss, never a mismatch
+        """
         self.face_tolerance = 0.6
         self.fingerprint_threshold = 0.8
+        self.detection_scale = detection_scale
+        self.detection_max_side = detection_max_side
+        self.encoding_pool = encoding_pool
+        self.encoding_timeout = encoding_timeout
+        self.quality_gate = FaceQualityGate() if check_quality else None
+        self.embedding_cache = EmbeddingCache(cache_size, cache_ttl) if cache_size > 0 else None
         self.face_service = FaceService()
         self.fingerprint_service = FingerprintService()
+        self.verification_timeout = verification_timeout
+        self.verification_workers = max(2, os.cpu_count() or 1)
+        self.fusion_weights = fusion_weights or {'face': 0.5, 'fingerprint': 0.5}
+        self.fusion_threshold = fusion_threshold
+        self.min_modality_score = min_modality_score
+        self._verify_executor = None
+        self._verify_executor_lock = threading.Lock()
+        # Smoothed detection + encoding time, to tell whether it fits the time left
+        self._encode_seconds = 0.0
+        # Concurrent retries of the same verification share one computation
+        self.verification_flight = SingleFlight()
         self.logger = logging.getLogger(__name__)
 
     def process_face_image(self, face_data: str) -> Optional[np.ndarray]:
@@ -24,45 +97,211 @@ class BiometricService:
         Returns:
             128D vector if successful, None otherwise
         """
+        result = self.analyze_face_image(face_data)
+        if not result['success']:
+            print(f"Error processing face image: {result['message']}")
+        return result['encoding']
+
+    def analyze_face_image(self, face_data: str,
+                           cancel: Optional[threading.Event] = None,
+                           deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Check capture quality, then extract the 128D face vector
+        Args:
+            face_data: Base64 encoded face image
+            cancel: Event set when the caller no longer needs the result
+            deadline: time.monotonic() by which the result is needed; face
+                detection is skipped when it would not finish in time
+        Returns:
+            Dict with 'success' and 'encoding' (128D vector or None). Failures
+            carry a 'reason' code and 'message'; 'recapture' is set when the
+            kiosk should take another picture, reason 'timed_out' when the
+            request was cancelled or ran out of time
+        """
+        return self._analyze_face(face_data, lambda: self.decode_image(face_data),
+                                  cancel=cancel, deadline=deadline)
+
+    def analyze_face_bytes(self, image_data: Buffer, reduce_factor: int = 1,
+                           cancel: Optional[threading.Event] = None,
+                           deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Check capture quality, then extract the 128D face vector from raw image bytes
+        Args:
+            image_data: Encoded image bytes, decoded in place without copying
+            reduce_factor: 2, 4 or 8 to decode JPEGs at reduced resolution
+            cancel: Event set when the caller no longer needs the result
+            deadline: time.monotonic() by which the result is needed
+        Returns:
+            Same as analyze_face_image
+        """
+        return self._analyze_face(
+            image_data,
+            lambda: decode_image_buffer(image_data, cv2.IMREAD_COLOR, reduce_factor),
+            cache_salt=bytes([reduce_factor]),
+            cancel=cancel,
+            deadline=deadline
+        )
+
+    def _analyze_face(self, raw_data, decode, cache_salt: bytes = b'',
+                      cancel: Optional[threading.Event] = None,
+                      deadline: Optional[float] = None) -> Dict[str, Any]:
+        # Stop between stages once the caller gave up or the deadline passed
+        def out_of_time(needed: float = 0.0) -> bool:
+            if cancel is not None and cancel.is_set():
+                return True
+            return deadline is not None and time.monotonic() + needed >= deadline
+        
         try:
-            # Remove data URL prefix if present
-            if ',' in face_data:
-                face_data = face_data.split(',')[1]
-            
-            # Decode base64 image
-            image_data = base64.b64decode(face_data)
-            nparr = np.frombuffer(image_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            # Resent frames skip decoding, detection and encoding entirely
+            cache_key = None
+            if self.embedding_cache is not None:
+                cache_key = self.embedding_cache.digest(raw_data) + cache_salt
+                cached = self.embedding_cache.get(cache_key)
+                if cached is not None:
+                    return {'success': True, 'encoding': cached, 'quality': None, 'cached': True}
             
+            if out_of_time():
+                return self._face_timeout()
+            image = decode()
             if image is None:
-                print("Failed to decode image")
-                return None
+                return self._face_failure('undecodable', 'Failed to decode image')
             
-            # Convert BGR to RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            # Cheap exposure and blur checks before the expensive detector
+            quality = self.quality_gate.check(image) if self.quality_gate is not None else None
+            if quality is not None and not quality['accepted']:
+                return self._face_failure(quality['reason'], quality['message'], quality['scores'])
             
-            # Detect face locations
-            face_locations = face_recognition.face_locations(rgb_image, model="hog")
-            if not face_locations:
-                print("No face detected in image")
-                return None
+            # Don't start detection when it can't finish in time
+            if out_of_time(self._encode_seconds):
+                return self._face_timeout()
             
-            # Get face encodings
-            face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-            if not face_encodings:
-                print("Could not encode face features")
-                return None
+            # Convert BGR to RGB
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             
-            # Get the first face encoding
-            face_encoding = face_encodings[0]
+            # Detect and encode the largest face
+            started = time.monotonic()
+            face_encoding = self.encode_face_frame(rgb_image)
+            elapsed = time.monotonic() - started
+            self._encode_seconds = 0.8 * self._encode_seconds + 0.2 * elapsed if self._encode_seconds else elapsed
+            if face_encoding is None:
+                return self._face_failure('no_face', 'No face detected, look straight at the camera',
+                                          quality['scores'] if quality is not None else None)
             
-            # Normalize the vector
-            face_encoding = face_encoding / np.linalg.norm(face_encoding)
+            if cache_key is not None:
+                self.embedding_cache.put(cache_key, face_encoding)
             
-            return face_encoding
+            return {
+                'success': True,
+                'encoding': face_encoding,
+                'quality': quality['scores'] if quality is not None else None,
+                'cached': False
+            }
         except Exception as e:
-            print(f"Error processing face image: {str(e)}")
+            return {
+                'success': False,
+                'encoding': None,
+                'reason': 'error',
+                'message': str(e),
+                'recapture': False
+            }
+
+    def decode_image(self, face_data: str) -> Optional[np.ndarray]:
+        """
+        Decode a base64 image, with or without a data URL prefix
+        Args:
+            face_data: Base64 encoded image
+        Returns:
+            BGR image, or None if the data is not a valid image
+        """
+        # Remove data URL prefix if present
+        if ',' in face_data:
+            face_data = face_data.split(',')[1]
+        try:
+            image_data = base64.b64decode(face_data)
+        except (ValueError, TypeError):
             return None
+        return decode_image_buffer(image_data)
+
+    def _face_failure(self, reason: str, message: str, scores: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'encoding': None,
+            'reason': reason,
+            'message': message,
+            'quality': scores,
+            'recapture': True
+        }
+
+    def _face_timeout(self) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'encoding': None,
+            'reason': 'timed_out',
+            'message': 'Verification timed out',
+            'recapture': False
+        }
+
+    def encode_face_frame(self, rgb_image: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Detect the largest face in a decoded frame and extract its 128D vector
+        Args:
+            rgb_image: Full resolution RGB image
+        Returns:
+            Normalized 128D vector if a face was found, None otherwise
+        """
+        return self.locate_and_encode_face(rgb_image)[1]
+
+    def locate_and_encode_face(self, rgb_image: np.ndarray,
+                               location: Optional[FaceLocation] = None
+                               ) -> Tuple[Optional[FaceLocation], Optional[np.ndarray]]:
+        """
+        Find the largest face in a decoded frame, unless its box is already known, and encode it
+        Args:
+            rgb_image: Full resolution RGB image
+            location: Face box (top, right, bottom, left), e.g. from a tracker, to skip detection
+        Returns:
+            Tuple of (location, normalized 128D vector); both None if no face was found
+        """
+        # Detect and encode in the worker pool when one is configured
+        if self.encoding_pool is not None:
+            return self.encoding_pool.encode(
+                rgb_image,
+                scale=self.detection_scale,
+                max_side=self.detection_max_side,
+                timeout=self.encoding_timeout,
+                location=location,
+                with_location=True
+            )
+        
+        # Detect the largest face on a downscaled copy of the frame
+        if location is None:
+            location = detect_largest_face(
+                rgb_image,
+                scale=self.detection_scale,
+                max_side=self.detection_max_side
+            )
+            if location is None:
+                return None, None
+        
+        # Encode the face at full resolution (normalized 128D vector)
+        return location, encode_face(rgb_image, location)
+
+    def submit_face_frame(self, rgb_image: np.ndarray) -> Future:
+        """
+        Submit a decoded RGB frame to the encoding pool
+        Args:
+            rgb_image: Full resolution RGB image
+        Returns:
+            Future resolving to the normalized 128D vector, or None if no face was found
+        """
+        if self.encoding_pool is None:
+            raise RuntimeError("No face encoding pool configured")
+        return self.encoding_pool.submit(
+            rgb_image,
+            scale=self.detection_scale,
+            max_side=self.detection_max_side,
+            timeout=self.encoding_timeout
+        )
 
     def process_fingerprint(self, fingerprint_data: bytes) -> Optional[np.ndarray]:
         """
@@ -145,41 +384,184 @@ class BiometricService:
             print(f"Error loading vector: {str(e)}")
             return None
 
-    def verify_biometrics(self, voter_id: str, face_data: bytes, fingerprint_data: bytes) -> Dict[str, Any]:
+    def verify_biometrics(self,
+                          voter_id: str,
+                          face_data: Union[str, bytes],
+                          fingerprint_data: bytes,
+                          parallel: bool = True,
+                          timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Verify a voter's face and fingerprint and fuse the two match scores
+        Args:
+            voter_id: Voter to verify
+            face_data: Base64 encoded face image, or raw image bytes
+            fingerprint_data: Raw fingerprint image data
+            parallel: Run the two modalities concurrently instead of one after the other
+            timeout: Seconds allowed for both modalities together, defaults to verification_timeout
+        Returns:
+            Dict with 'success', the fused 'score' and per-modality 'details';
+            'error' is set when a modality failed outright or the deadline passed,
+            'timed_out' when a modality gave no score in time
+        """
+        # Double submits and kiosk retries wait for the verification already running
+        timeout = self.verification_timeout if timeout is None else timeout
+        key = SingleFlight.key(voter_id, face_data, fingerprint_data)
         try:
-            # Verify face
-            face_result = self.face_service.verify_face(voter_id, face_data)
-            if not face_result['success']:
-                self.logger.error(f"Face verification failed for voter {voter_id}: {face_result['error']}")
-                return {
-                    'success': False,
-                    'error': f"Face verification failed: {face_result['error']}"
-                }
+            result, _ = self.verification_flight.do(key, self._verify_biometrics, voter_id, face_data,
+                                                    fingerprint_data, parallel, timeout, timeout=timeout)
+            return result
+        except FutureTimeoutError:
+            return {
+                'success': False,
+                'error': 'Biometric verification timed out waiting for an identical request'
+            }
 
-            # Verify fingerprint
-            fingerprint_result = self.fingerprint_service.verify_fingerprint(voter_id, fingerprint_data)
-            if not fingerprint_result['success']:
-                self.logger.error(f"Fingerprint verification failed for voter {voter_id}: {fingerprint_result['error']}")
+    def _verify_biometrics(self,
+                           voter_id: str,
+                           face_data: Union[str, bytes],
+                           fingerprint_data: bytes,
+                           parallel: bool,
+                           timeout: float) -> Dict[str, Any]:
+        start = time.monotonic()
+        deadline = start + timeout
+        # Set on return, so modalities still running for an answered or timed
+        # out request stop at their next stage
+        cancel = threading.Event()
+        modalities = {
+            'face': lambda: self._score_face(voter_id, face_data, cancel, deadline),
+            'fingerprint': lambda: self._score_fingerprint(voter_id, fingerprint_data, cancel, deadline)
+        }
+        details: Dict[str, Dict[str, Any]] = {}
+
+        try:
+            if parallel:
+                executor = self._get_verify_executor()
+                futures = {executor.submit(run): name for name, run in modalities.items()}
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                         return_when=FIRST_COMPLETED)
+                    if not done:
+                        break
+                    for future in done:
+                        details[futures[future]] = future.result()
+                    # A hard failure decides the outcome, stop waiting for the other modality
+                    if any(result['hard_failure'] for result in details.values()):
+                        break
+            else:
+                for name, run in modalities.items():
+                    if time.monotonic() >= deadline:
+                        break
+                    details[name] = run()
+                    if details[name]['hard_failure']:
+                        break
+        except Exception as e:
+            self.logger.error(f"Error in biometric verification: {str(e)}")
+            return {
+                'success': False,
+                'error': f"Biometric verification failed: {str(e)}"
+            }
+        finally:
+            cancel.set()
+
+        elapsed = time.monotonic() - start
+        for name, result in details.items():
+            if result['hard_failure']:
+                self.logger.error(f"{name.capitalize()} verification failed for voter {voter_id}: {result['error']}")
                 return {
                     'success': False,
-                    'error': f"Fingerprint verification failed: {fingerprint_result['error']}"
+                    'error': f"{name.capitalize()} verification failed: {result['error']}",
+                    'details': details,
+                    'elapsed': elapsed
                 }
-
+        # A modality that timed out or was cancelled has no score, it counts as missing
+        missing = [name for name in modalities if name not in details or details[name].get('timed_out')]
+        if missing:
+            self.logger.error(f"Biometric verification timed out for voter {voter_id} waiting for {', '.join(missing)}")
             return {
-                'success': True,
-                'message': 'Biometric verification successful',
-                'details': {
-                    'face': face_result,
-                    'fingerprint': fingerprint_result
-                }
+                'success': False,
+                'error': f"Biometric verification timed out waiting for {', '.join(missing)}",
+                'timed_out': True,
+                'details': details,
+                'elapsed': elapsed
             }
 
+        # Score level fusion: a strong match in one modality can make up for a
+        # borderline score in the other, but not for a mismatch
+        total_weight = sum(self.fusion_weights.values())
+        score = sum(self.fusion_weights[name] * details[name]['score'] for name in modalities) / total_weight
+        weak = [name for name in modalities if details[name]['score'] < self.min_modality_score]
+        success = score >= self.fusion_threshold and not weak
+        result = {
+            'success': success,
+            'message': 'Biometric verification successful' if success else 'Biometric verification failed',
+            'score': score,
+            'details': details,
+            'elapsed': elapsed
+        }
+        if weak:
+            result['rejected_modalities'] = weak
+        return result
+
+    def _get_verify_executor(self) -> ThreadPoolExecutor:
+        with self._verify_executor_lock:
+            if self._verify_executor is None:
+                self._verify_executor = ThreadPoolExecutor(max_workers=self.verification_workers,
+                                                           thread_name_prefix='biometric-verify')
+            return self._verify_executor
+
+    def _score_face(self, voter_id: str, face_data: Union[str, bytes], cancel: threading.Event,
+                    deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Match a face capture against the voter's enrolled face vector"""
+        try:
+            reference = self.load_vector(f'data/vectors/{voter_id}_face.npy')
+            if reference is None:
+                return _modality_failure('No enrolled face for this voter')
+            if cancel.is_set():
+                return _modality_timeout('Cancelled')
+
+            if isinstance(face_data, str):
+                analysis = self.analyze_face_image(face_data, cancel=cancel, deadline=deadline)
+            else:
+                analysis = self.analyze_face_bytes(face_data, cancel=cancel, deadline=deadline)
+            if analysis.get('reason') == 'timed_out':
+                return _modality_timeout(analysis['message'])
+            if not analysis['success']:
+                return _modality_failure(analysis['message'], reason=analysis.get('reason'))
+
+            distance = float(np.linalg.norm(analysis['encoding'] - reference / np.linalg.norm(reference)))
+            return {
+                'hard_failure': False,
+                'match': distance <= self.face_tolerance,
+                'score': _calibrate(distance, self.face_tolerance, best=0.0, worst=2 * self.face_tolerance),
+                'distance': distance
+            }
         except Exception as e:
-            self.logger.error(f"Error in biometric verification: {str(e)}")
+            return _modality_failure(str(e))
+
+    def _score_fingerprint(self, voter_id: str, fingerprint_data: bytes, cancel: threading.Event,
+                           deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Match a fingerprint capture against the voter's enrolled fingerprint vector"""
+        try:
+            reference = self.load_vector(f'data/vectors/{voter_id}_fingerprint.npy')
+            if reference is None:
+                return _modality_failure('No enrolled fingerprint for this voter')
+            if cancel.is_set() or (deadline is not None and time.monotonic() >= deadline):
+                return _modality_timeout('Cancelled')
+
+            vector = self.process_fingerprint(fingerprint_data)
+            if vector is None:
+                return _modality_failure('Could not process fingerprint')
+
+            similarity = float(np.dot(vector, reference) / (np.linalg.norm(vector) * np.linalg.norm(reference)))
             return {
-                'success': False,
-                'error': f"Biometric verification failed: {str(e)}"
+                'hard_failure': False,
+                'match': similarity >= self.fingerprint_threshold,
+                'score': _calibrate(similarity, self.fingerprint_threshold, best=1.0, worst=0.0),
+                'similarity': similarity
             }
+        except Exception as e:
+            return _modality_failure(str(e))
 
     def register_biometrics(self, voter_id: str, face_data: bytes, fingerprint_data: bytes) -> Dict[str, Any]:
         try:
@@ -0,0 +1,394 @@
+import csv
+import io
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from utils.dummy_dataset import is_valid_voter_id
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.csv"
+# Failures kept in the job status; the journal always has all of them
+MAX_STATUS_FAILURES = 1000
+
+class EnrollmentSource:
+    """
+    Read-only view of a directory, zip or tar archive of enrollment images.
+
+    A tar archive is read as a stream, once, in archive order: looking
+    members up by name in a compressed tar means seeking back through the
+    stream, which decompresses it again from the start. Images are kept in
+    memory only until every image of their manifest row has been read.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Directory, .zip or .tar[.gz] archive containing the images
+        """
+        self.path = Path(path)
+        self._zip = None
+        self._tar = False
+        self._lock = threading.Lock()
+
+        if self.path.is_dir():
+            pass
+        elif zipfile.is_zipfile(self.path):
+            self._zip = zipfile.ZipFile(self.path)
+        elif tarfile.is_tarfile(self.path):
+            self._tar = True
+        else:
+            raise ValueError(f"Unsupported enrollment source: {path}")
+
+    def read(self, name: str) -> bytes:
+        """
+        Read a file from the source
+        Args:
+            name: Path of the file relative to the source root
+        Returns:
+            Raw file contents
+        """
+        name = _member_name(name)
+        if self._zip is not None:
+            with self._lock:
+                return self._zip.read(name)
+        if self._tar:
+            # Only the manifest is looked up by name, images come from iter_items
+            for member_name, data in self._iter_tar({name}):
+                return data
+            raise KeyError(f"{name} not found in archive")
+
+        path = (self.path / name).resolve()
+        if self.path.resolve() not in path.parents:
+            raise ValueError(f"Path escapes enrollment source: {name}")
+        return path.read_bytes()
+
+    def iter_manifest(self, manifest_path: Optional[str] = None) -> Iterator[Dict[str, str]]:
+        """
+        Iterate over manifest rows
+        Args:
+            manifest_path: CSV manifest on disk, or None to use manifest.csv
+                inside the source
+        Returns:
+            Iterator of rows with at least a voter_id column
+        """
+        if manifest_path:
+            with open(manifest_path, newline="") as f:
+                yield from csv.DictReader(f)
+        else:
+            text = io.StringIO(self.read(MANIFEST_NAME).decode("utf-8"))
+            yield from csv.DictReader(text)
+
+    def iter_items(self, rows: Iterable[Dict[str, str]]) -> Iterator[Tuple[Dict[str, str], Dict[str, bytes]]]:
+        """
+        Pair manifest rows with the contents of their images
+        Args:
+            rows: Manifest rows to read the images of
+        Returns:
+            Iterator of (row, images by name); an image that could not be
+            read is missing from the dictionary
+        """
+        if not self._tar:
+            for row in rows:
+                yield row, self._read_row(row)
+            return
+
+        rows = list(rows)
+        needed: Dict[int, set] = {}
+        wanted: Dict[str, List[int]] = {}
+        for index, row in enumerate(rows):
+            names = set(_image_names(row))
+            if not names:
+                yield row, {}
+                continue
+            needed[index] = names
+            for name in names:
+                wanted.setdefault(name, []).append(index)
+
+        images: Dict[int, Dict[str, bytes]] = {}
+        for name, data in self._iter_tar(set(wanted)):
+            for index in wanted.pop(name):
+                images.setdefault(index, {})[name] = data
+                needed[index].discard(name)
+                if not needed[index]:
+                    del needed[index]
+                    yield rows[index], images.pop(index)
+
+        # Images missing from the archive: the rows fail with a clear error
+        for index in sorted(needed):
+            yield rows[index], images.pop(index, {})
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+
+    def _read_row(self, row: Dict[str, str]) -> Dict[str, bytes]:
+        images = {}
+        for name in _image_names(row):
+            try:
+                images[name] = self.read(name)
+            except (KeyError, OSError, ValueError):
+                pass
+        return images
+
+    def _iter_tar(self, names: set) -> Iterator[Tuple[str, bytes]]:
+        """Stream the archive once, yielding the contents of the members in names"""
+        remaining = set(names)
+        # Stream mode never seeks, so each member is decompressed once
+        with tarfile.open(self.path, "r|*") as tar:
+            for member in tar:
+                if not remaining:
+                    break
+                if not member.isfile():
+                    continue
+                name = _member_name(member.name)
+                if name not in remaining:
+                    continue
+                remaining.discard(name)
+                with tar.extractfile(member) as f:
+                    yield name, f.read()
+
+def _member_name(name: str) -> str:
+    """Normalise an image path from the manifest or the archive"""
+    return os.path.normpath(name.strip()).lstrip("/")
+
+def _image_names(row: Dict[str, str]) -> List[str]:
+    names = ((row.get('face') or '').strip(), (row.get('fingerprint') or '').strip())
+    return [_member_name(name) for name in names if name]
+
+class BulkEnrollmentService:
+    """
+    Enrolls voters in bulk from a directory or archive of images plus a CSV
+    manifest with voter_id, face and fingerprint columns.
+
+    Items are decoded and encoded in parallel, written to the template store
+    one batch at a time, and recorded in a per-job journal so an interrupted
+    job resumes where it stopped.
+    """
+
+    def __init__(self,
+                 verification_service,
+                 biometric_service,
+                 state_dir: str = "data/enrollment",
+                 vectors_dir: str = "data/vectors",
+                 workers: Optional[int] = None,
+                 batch_size: int = 256):
+        """
+        Args:
+            verification_service: VerificationService owning the fingerprint template store
+            biometric_service: BiometricService used to encode faces
+            state_dir: Directory holding per-job journals and status files
+            vectors_dir: Directory where face vectors are saved
+            workers: Number of items processed in parallel, defaults to the CPU count
+            batch_size: Number of items written to the store at once
+        """
+        self.verification_service = verification_service
+        self.biometric_service = biometric_service
+        self.state_dir = Path(state_dir)
+        self.vectors_dir = vectors_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+
+    def run(self,
+            source_path: str,
+            manifest_path: Optional[str] = None,
+            job_id: Optional[str] = None,
+            retry_failed: bool = False,
+            progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Run (or resume) a bulk enrollment job
+        Args:
+            source_path: Directory or archive containing the images
+            manifest_path: CSV manifest, or None to use manifest.csv in the source
+            job_id: ID of the job to resume, or None to start a new job
+            retry_failed: Whether to retry items that failed in a previous run
+            progress_callback: Called with the job status after every batch
+        Returns:
+            Job report with counts and per-item failures
+        """
+        job_id = job_id or uuid.uuid4().hex
+        job_dir = self.state_dir / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        journal_path = job_dir / "journal.jsonl"
+
+        completed = self._load_journal(journal_path, retry_failed)
+        status = {
+            'job_id': job_id,
+            'state': 'running',
+            'source': str(source_path),
+            # Items with a journaled outcome, including those of earlier runs
+            'processed': len(completed),
+            'enrolled': sum(1 for entry in completed.values() if entry['status'] == 'ok'),
+            'failed': sum(1 for entry in completed.values() if entry['status'] == 'failed'),
+            'skipped': 0,
+            'failures': list(islice((entry for entry in completed.values() if entry['status'] == 'failed'),
+                                    MAX_STATUS_FAILURES)),
+            'started_at': time.time()
+        }
+        self._write_status(job_dir, status)
+
+        source = EnrollmentSource(source_path)
+        try:
+            rows = (row for row in source.iter_manifest(manifest_path) if self._pending(row, completed, status))
+            items = source.iter_items(rows)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor, open(journal_path, "a") as journal:
+                while True:
+                    batch = list(islice(items, self.batch_size))
+                    if not batch:
+                        break
+
+                    results = list(executor.map(lambda item: self._process_item(*item), batch))
+                    entries = self._commit_batch(results)
+
+                    # Journal only after the batch is in the store
+                    for entry in entries:
+                        journal.write(json.dumps(entry) + "\n")
+                        completed[entry['voter_id']] = entry
+                    journal.flush()
+                    os.fsync(journal.fileno())
+
+                    status['processed'] += len(entries)
+                    for entry in entries:
+                        if entry['status'] == 'ok':
+                            status['enrolled'] += 1
+                        else:
+                            status['failed'] += 1
+                            if len(status['failures']) < MAX_STATUS_FAILURES:
+                                status['failures'].append(entry)
+                    self._write_status(job_dir, status)
+                    if progress_callback is not None:
+                        progress_callback(status)
+
+            status['state'] = 'completed'
+        except Exception as e:
+            logger.error(f"Bulk enrollment job {job_id} failed: {str(e)}")
+            status['state'] = 'failed'
+            status['error'] = str(e)
+        finally:
+            source.close()
+            status['elapsed'] = time.time() - status['started_at']
+            self._write_status(job_dir, status)
+
+        return status
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the last recorded status of a job
+        Args:
+            job_id: Job ID returned by run
+        Returns:
+            Job status, or None if the job is unknown
+        """
+        status_path = self.state_dir / job_id / "status.json"
+        if not status_path.exists():
+            return None
+        with open(status_path) as f:
+            return json.load(f)
+
+    def _pending(self, row: Dict[str, str], completed: Dict[str, Dict], status: Dict[str, Any]) -> bool:
+        voter_id = (row.get('voter_id') or '').strip()
+        if voter_id and voter_id in completed:
+            status['skipped'] += 1
+            return False
+        return True
+
+    def _process_item(self, row: Dict[str, str], images: Dict[str, bytes]) -> Dict[str, Any]:
+        """Decode and encode the images of one manifest row"""
+        voter_id = (row.get('voter_id') or '').strip()
+        result = {'voter_id': voter_id}
+        try:
+            if not voter_id:
+                raise ValueError("Missing voter_id")
+            # The voter ID names files and directories in the stores
+            if not is_valid_voter_id(voter_id):
+                raise ValueError("Invalid voter_id, expected 1-64 letters, digits, '-' or '_'")
+            face_name = (row.get('face') or '').strip()
+            fingerprint_name = (row.get('fingerprint') or '').strip()
+            if not face_name and not fingerprint_name:
+                raise ValueError("No face or fingerprint image in manifest")
+
+            def image_data(name: str) -> np.ndarray:
+                data = images.get(_member_name(name))
+                if data is None:
+                    raise ValueError(f"Image {name} not found in source")
+                return np.frombuffer(data, np.uint8)
+
+            if face_name:
+                image = cv2.imdecode(image_data(face_name), cv2.IMREAD_COLOR)
+                if image is None:
+                    raise ValueError(f"Could not decode face image {face_name}")
+                face_encoding = self.biometric_service.encode_face_frame(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+                if face_encoding is None:
+                    raise ValueError(f"No face detected in {face_name}")
+                result['face_encoding'] = face_encoding
+
+            if fingerprint_name:
+                image = cv2.imdecode(image_data(fingerprint_name), cv2.IMREAD_GRAYSCALE)
+                if image is None:
+                    raise ValueError(f"Could not decode fingerprint image {fingerprint_name}")
+                result['fingerprint_image'] = image
+                result['fingerprint_template'] = self.verification_service.fp_verifier.create_template(image)
+
+            result['metadata'] = {key: value for key, value in row.items()
+                                  if key not in ('voter_id', 'face', 'fingerprint')}
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    def _commit_batch(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write a processed batch to the stores and return its journal entries"""
+        entries = []
+        fingerprints = []
+        for result in results:
+            voter_id = result['voter_id']
+            if 'error' in result:
+                entries.append({'voter_id': voter_id, 'status': 'failed', 'error': result['error']})
+                continue
+            if 'face_encoding' in result:
+                path = os.path.join(self.vectors_dir, f"{voter_id}_face.npy")
+                if not self.biometric_service.save_vector(result['face_encoding'], path):
+                    entries.append({'voter_id': voter_id, 'status': 'failed', 'error': "Could not save face vector"})
+                    continue
+            if 'fingerprint_image' in result:
+                fingerprints.append((voter_id, result['fingerprint_image'], result['metadata'],
+                                     result['fingerprint_template']))
+            entries.append({'voter_id': voter_id, 'status': 'ok'})
+
+        self.verification_service.dataset_manager.add_fingerprints_batch(fingerprints)
+        return entries
+
+    def _load_journal(self, journal_path: Path, retry_failed: bool) -> Dict[str, Dict]:
+        """Read the outcome of items finished by earlier runs of the job"""
+        completed = {}
+        if not journal_path.exists():
+            return completed
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write from a crash, the item is simply redone
+                    continue
+                completed[entry['voter_id']] = entry
+        if retry_failed:
+            completed = {voter_id: entry for voter_id, entry in completed.items() if entry['status'] == 'ok'}
+        return completed
+
+    def _write_status(self, job_dir: Path, status: Dict[str, Any]) -> None:
+        tmp_path = job_dir / "status.tmp.json"
+        with open(tmp_path, "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, job_dir / "status.json")
@@ -0,0 +1,378 @@
+import atexit
+import gc
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.face_utils import FaceLocation, detect_largest_face, encode_face
+
+logger = logging.getLogger(__name__)
+
+# Largest frame that fits a shared memory slot (1080p RGB)
+DEFAULT_MAX_FRAME_BYTES = 1920 * 1080 * 3
+
+class FaceEncodingPool:
+    """
+    Pre-forked pool of processes that detect and encode faces.
+
+    The dlib models are loaded once in the parent and inherited copy-on-write
+    by the workers. Frames are passed through shared memory slots that are
+    also created before forking, so workers never attach or copy them.
+
+    The workers are forked by a supervisor process, itself forked when the
+    pool starts. It has a single thread, so replacing a crashed worker never
+    forks the server while one of its threads holds a lock. The supervisor
+    also hands the tasks out, one at a time to an idle worker, so it knows
+    which task a worker took when that worker dies.
+    """
+
+    def __init__(self,
+                 workers: Optional[int] = None,
+                 max_frame_bytes: int = DEFAULT_MAX_FRAME_BYTES,
+                 slots: Optional[int] = None):
+        """
+        Args:
+            workers: Number of worker processes, defaults to the CPU count
+            max_frame_bytes: Size of each shared memory slot
+            slots: Number of shared memory slots, defaults to twice the workers
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_frame_bytes = max_frame_bytes
+        self.slot_count = slots or 2 * self.workers
+        self.logger = logger
+
+        self._context = mp.get_context("fork")
+        self._slots: List[shared_memory.SharedMemory] = []
+        self._free_slots: "queue.Queue[int]" = queue.Queue()
+        self._task_reader: Optional[Connection] = None
+        self._task_writer: Optional[Connection] = None
+        self._send_lock = threading.Lock()
+        self._result_queue = None
+        self._supervisor: Optional[mp.Process] = None
+        self._workers: Set[int] = set()
+        self._pending: Dict[int, Future] = {}
+        self._pending_slots: Dict[int, Optional[int]] = {}
+        self._running: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._collector = None
+        self._started = False
+        self._closed = False
+
+    def start(self) -> "FaceEncodingPool":
+        """
+        Load the face models and fork the workers
+        Returns:
+            The pool itself
+        """
+        if self._started:
+            return self
+
+        # Importing face_recognition loads the dlib detector and encoder,
+        # do it before forking so every worker shares the same pages
+        import face_recognition  # noqa: F401
+
+        for _ in range(self.slot_count):
+            self._slots.append(shared_memory.SharedMemory(create=True, size=self.max_frame_bytes))
+        for index in range(self.slot_count):
+            self._free_slots.put(index)
+
+        # Read by the supervisor only
+        self._task_reader, self._task_writer = self._context.Pipe(duplex=False)
+        # Written by the supervisor only: a worker killed while holding the
+        # queue's write lock would block every other writer for good
+        self._result_queue = self._context.SimpleQueue()
+
+        # Keep the inherited heap out of the collector so workers don't
+        # dirty shared pages when it runs
+        gc.collect()
+        gc.freeze()
+        self._supervisor = self._context.Process(target=self._supervise, name="face-pool-supervisor", daemon=True)
+        self._supervisor.start()
+        gc.unfreeze()
+
+        self._collector = threading.Thread(target=self._collect_results, name="face-pool-collector", daemon=True)
+        self._collector.start()
+        self._started = True
+        atexit.register(self.close)
+        self.logger.info(f"Face encoding pool started with {self.workers} workers")
+        return self
+
+    def submit(self,
+               rgb_image: np.ndarray,
+               scale: Optional[float] = None,
+               max_side: int = 480,
+               timeout: Optional[float] = None,
+               location: Optional[FaceLocation] = None,
+               with_location: bool = False) -> Future:
+        """
+        Submit a decoded RGB frame for detection and encoding
+        Args:
+            rgb_image: Full resolution RGB image
+            scale: Fixed detection downscale factor, or None to pick it from max_side
+            max_side: Longest side of the detection image when scale is None
+            timeout: Seconds to wait for a free shared memory slot
+            location: Face box to encode, e.g. from a tracker, skipping detection
+            with_location: Resolve to (location, encoding) instead of the encoding alone
+        Returns:
+            Future resolving to the normalised 128D vector, or None if no face was found
+        """
+        if not self._started or self._closed:
+            raise RuntimeError("Face encoding pool is not running")
+
+        future: Future = Future()
+        task_id = next(self._task_ids)
+        frame = np.ascontiguousarray(rgb_image)
+
+        slot = None
+        if frame.nbytes <= self.max_frame_bytes:
+            try:
+                slot = self._free_slots.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError("No free face encoding slot")
+            buffer = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._slots[slot].buf)
+            buffer[...] = frame
+            payload = None
+        else:
+            # Oversized frames are rare, send them through the pipe instead
+            payload = frame
+
+        with self._lock:
+            self._pending[task_id] = future
+            self._pending_slots[task_id] = slot
+        with self._send_lock:
+            self._task_writer.send((task_id, slot, frame.shape, frame.dtype.str, payload, scale, max_side,
+                                    location, with_location))
+        return future
+
+    def encode(self,
+               rgb_image: np.ndarray,
+               scale: Optional[float] = None,
+               max_side: int = 480,
+               timeout: Optional[float] = None,
+               location: Optional[FaceLocation] = None,
+               with_location: bool = False) -> Any:
+        """
+        Detect and encode a face, blocking until the result is available
+        Args:
+            rgb_image: Full resolution RGB image
+            scale: Fixed detection downscale factor, or None to pick it from max_side
+            max_side: Longest side of the detection image when scale is None
+            timeout: Seconds to wait for a free slot and the result together
+            location: Face box to encode, skipping detection
+            with_location: Return (location, encoding) instead of the encoding alone
+        Returns:
+            Normalised 128D vector, or None if no face was found
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = self.submit(rgb_image, scale, max_side, timeout, location, with_location)
+        return future.result(None if deadline is None else max(deadline - time.monotonic(), 0.0))
+
+    def stats(self) -> Dict[str, int]:
+        """Current pool occupancy"""
+        with self._lock:
+            return {
+                'workers': len(self._workers),
+                'pending': len(self._pending),
+                'running': len(self._running),
+                'free_slots': self._free_slots.qsize()
+            }
+
+    def close(self) -> None:
+        """Stop the workers and release the shared memory slots"""
+        if not self._started or self._closed:
+            return
+        self._closed = True
+
+        # The supervisor passes the sentinel on to the workers and exits once they have
+        with self._send_lock:
+            self._task_writer.send(None)
+        self._supervisor.join(timeout=5)
+        if self._supervisor.is_alive():
+            self._supervisor.terminate()
+            self._supervisor.join(timeout=1)
+        self._result_queue.put(None)
+
+        with self._lock:
+            for future in self._pending.values():
+                future.set_exception(RuntimeError("Face encoding pool closed"))
+            self._pending.clear()
+
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+    def _supervise(self) -> None:
+        """Fork the workers, hand them the tasks and replace the ones that crash"""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        children: Dict[int, Connection] = {}
+        assigned: Dict[int, int] = {}  # pid -> task the worker is processing
+        idle: List[int] = []
+        closing = False
+
+        def stop(signum, frame):
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            os._exit(0)
+
+        def spawn():
+            pid, conn = self._fork_worker()
+            children[pid] = conn
+            idle.append(pid)
+
+        signal.signal(signal.SIGTERM, stop)
+        for _ in range(self.workers):
+            spawn()
+
+        while children:
+            # Tasks stay in the pipe until a worker is free to take one
+            sources = list(children.values())
+            if idle and not closing:
+                sources.append(self._task_reader)
+
+            for ready in wait(sources):
+                if ready is self._task_reader:
+                    task = ready.recv()
+                    if task is None:
+                        closing = True
+                        for conn in children.values():
+                            self._send_to_worker(conn, None)
+                        continue
+                    pid = idle.pop()
+                    # Recorded before the worker can see the task, so a crash always fails it
+                    assigned[pid] = task[0]
+                    self._result_queue.put(('started', task[0], pid))
+                    self._send_to_worker(children[pid], task)
+                    continue
+
+                pid = next(pid for pid, conn in children.items() if conn is ready)
+                try:
+                    # The worker's result, it is ready for the next task
+                    self._result_queue.put(ready.recv())
+                    assigned.pop(pid, None)
+                    idle.append(pid)
+                    continue
+                except (EOFError, OSError):
+                    pass
+
+                # The worker exited; any result it sent was read ahead of the end of its pipe
+                ready.close()
+                del children[pid]
+                if pid in idle:
+                    idle.remove(pid)
+                code = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+                lost = assigned.pop(pid, None)
+                if closing and code == 0:
+                    continue
+                self._result_queue.put(('died', lost, (pid, code)))
+                if not closing:
+                    spawn()
+
+    @staticmethod
+    def _send_to_worker(conn: Connection, task) -> None:
+        try:
+            conn.send(task)
+        except OSError:
+            # The worker is gone, its pipe reports that on the next wait
+            pass
+
+    def _fork_worker(self) -> Tuple[int, Connection]:
+        conn, worker_conn = self._context.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                conn.close()
+                self._worker_loop(worker_conn)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        # Only the worker holds its end, so the pipe reports its exit
+        worker_conn.close()
+        self._result_queue.put(('spawned', None, pid))
+        return pid, conn
+
+    def _worker_loop(self, conn: Connection) -> None:
+        # Let the parent handle Ctrl+C and shut the workers down
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+
+            task_id, slot, shape, dtype, payload, scale, max_side, location, with_location = task
+            try:
+                if payload is None:
+                    frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._slots[slot].buf)
+                else:
+                    frame = payload
+                if location is None:
+                    location = detect_largest_face(frame, scale=scale, max_side=max_side)
+                encoding = encode_face(frame, location) if location is not None else None
+                del frame
+                conn.send(('done', task_id, (location, encoding) if with_location else encoding))
+            except Exception as e:
+                conn.send(('failed', task_id, f"{type(e).__name__}: {str(e)}"))
+
+    def _collect_results(self) -> None:
+        while True:
+            message = self._result_queue.get()
+            if message is None:
+                break
+
+            status, task_id, value = message
+            if status == 'spawned':
+                with self._lock:
+                    self._workers.add(value)
+                continue
+            if status == 'died':
+                self._fail_lost_task(task_id, *value)
+                continue
+
+            with self._lock:
+                if status == 'started':
+                    self._running[task_id] = value
+                    continue
+                future = self._pending.pop(task_id, None)
+                slot = self._pending_slots.pop(task_id, None)
+                self._running.pop(task_id, None)
+
+            if slot is not None:
+                self._free_slots.put(slot)
+            if future is None:
+                continue
+            if status == 'done':
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(f"Face encoding failed: {value}"))
+
+    def _fail_lost_task(self, task_id: Optional[int], pid: int, exitcode: int) -> None:
+        """Fail the task a crashed worker had taken, the supervisor has already replaced it"""
+        self.logger.error(f"Face encoding worker {pid} exited with code {exitcode}")
+        with self._lock:
+            self._workers.discard(pid)
+            self._running.pop(task_id, None)
+            future = self._pending.pop(task_id, None)
+            slot = self._pending_slots.pop(task_id, None)
+        if slot is not None:
+            self._free_slots.put(slot)
+        if future is not None:
+            future.set_exception(RuntimeError("Face encoding worker died"))
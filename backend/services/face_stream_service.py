@@ -0,0 +1,483 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from utils.face_utils import FaceLocation, pick_detection_scale
+
+logger = logging.getLogger(__name__)
+
+class FaceTracker:
+    """
+    Follows a face box between consecutive frames with normalised template
+    matching on a downscaled grayscale image, which is far cheaper than
+    running the HOG detector again.
+    """
+
+    def __init__(self, max_side: int = 320, search_margin: float = 0.5, min_score: float = 0.6):
+        """
+        Args:
+            max_side: Longest side of the image the tracker works on
+            search_margin: Search window around the last box, as a fraction of the box size
+            min_score: Minimum normalised correlation to accept the new position
+        """
+        self.max_side = max_side
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self._template = None
+        self._box = None
+        self._scale = 1.0
+
+    @property
+    def tracking(self) -> bool:
+        return self._template is not None
+
+    def reset(self, gray: np.ndarray, location: FaceLocation) -> None:
+        """
+        Start tracking a face found by the detector
+        Args:
+            gray: Full resolution grayscale frame
+            location: Face box (top, right, bottom, left) in full resolution
+        """
+        self._scale = pick_detection_scale(gray.shape, self.max_side)
+        small = self._downscale(gray)
+        top, right, bottom, left = (int(round(v * self._scale)) for v in location)
+        if bottom - top < 8 or right - left < 8:
+            self._template = None
+            return
+        self._box = (top, right, bottom, left)
+        self._template = small[top:bottom, left:right].copy()
+
+    def update(self, gray: np.ndarray) -> Optional[FaceLocation]:
+        """
+        Find the tracked face in a new frame
+        Args:
+            gray: Full resolution grayscale frame
+        Returns:
+            Face box in full resolution, or None if tracking was lost
+        """
+        if self._template is None:
+            return None
+
+        small = self._downscale(gray)
+        top, right, bottom, left = self._box
+        height, width = bottom - top, right - left
+        margin_y, margin_x = int(height * self.search_margin), int(width * self.search_margin)
+        y0, x0 = max(0, top - margin_y), max(0, left - margin_x)
+        y1, x1 = min(small.shape[0], bottom + margin_y), min(small.shape[1], right + margin_x)
+        window = small[y0:y1, x0:x1]
+        if window.shape[0] < height or window.shape[1] < width:
+            self._template = None
+            return None
+
+        scores = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if best < self.min_score:
+            self._template = None
+            return None
+
+        top, left = y0 + dy, x0 + dx
+        self._box = (top, left + width, top + height, left)
+        self._template = small[top:top + height, left:left + width].copy()
+
+        scale = self._scale
+        return (
+            int(round(top / scale)),
+            min(gray.shape[1], int(round((left + width) / scale))),
+            min(gray.shape[0], int(round((top + height) / scale))),
+            int(round(left / scale))
+        )
+
+    def _downscale(self, gray: np.ndarray) -> np.ndarray:
+        if self._scale >= 1.0:
+            return gray
+        return cv2.resize(gray, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+
+class FaceVerificationSession:
+    """
+    Verifies a voter from a sequence of frames.
+
+    Per-frame match distances are fused as a sequential log-likelihood sum,
+    so a single bad frame cannot flip the decision, and the session stops as
+    soon as the fused confidence clears the accept or reject threshold.
+    """
+
+    def __init__(self,
+                 voter_id: str,
+                 reference_encoding: np.ndarray,
+                 biometric_service,
+                 accept_confidence: float = 0.97,
+                 min_frames: int = 2,
+                 max_frames: int = 10,
+                 evidence_scale: float = 0.1,
+                 redetect_interval: int = 5):
+        """
+        Args:
+            voter_id: Voter being verified
+            reference_encoding: Enrolled 128D face vector of the voter
+            biometric_service: BiometricService providing decoding, quality checks and detection settings
+            accept_confidence: Fused confidence needed to accept (its complement rejects)
+            min_frames: Frames that must contribute a score before deciding
+            max_frames: Frames after which the session gives up
+            evidence_scale: Distance difference from the match tolerance worth one unit of log-odds
+            redetect_interval: Run the full detector at least this often, even while tracking
+        """
+        self.session_id = uuid.uuid4().hex
+        self.voter_id = voter_id
+        self.reference_encoding = reference_encoding / np.linalg.norm(reference_encoding)
+        self.biometric_service = biometric_service
+        self.accept_confidence = accept_confidence
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.evidence_scale = evidence_scale
+        self.redetect_interval = redetect_interval
+
+        self.tracker = FaceTracker(max_side=biometric_service.detection_max_side)
+        self.frames = 0
+        self.duplicate_frames = 0
+        self.frame_digests = set()
+        self.scored_frames = 0
+        self.detections = 0
+        self.log_odds = 0.0
+        self.distances: List[float] = []
+        self.state = 'pending'
+        self.created_at = time.time()
+        self._frames_since_detection = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The service and the lock belong to the process holding the session
+        state = self.__dict__.copy()
+        state.pop('biometric_service', None)
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.biometric_service = None
+        self._lock = threading.Lock()
+
+    @property
+    def confidence(self) -> float:
+        return 1.0 / (1.0 + math.exp(-self.log_odds))
+
+    def claim_frame(self, digest: bytes) -> bool:
+        """
+        Record a frame before scoring it, so a resent frame is not counted twice
+        Args:
+            digest: Digest of the encoded frame
+        Returns:
+            False if the session has already seen this frame
+        """
+        with self._lock:
+            if digest in self.frame_digests:
+                self.duplicate_frames += 1
+                return False
+            self.frame_digests.add(digest)
+            return True
+
+    def add_frame(self, image: Optional[np.ndarray]) -> Dict[str, Any]:
+        """
+        Score one frame and update the fused decision
+        Args:
+            image: Decoded BGR frame, or None if it could not be decoded
+        Returns:
+            Session status including this frame's outcome
+        """
+        with self._lock:
+            if self.state != 'pending':
+                return self.status()
+
+            self.frames += 1
+            frame = self._score_frame(image)
+
+            if self.scored_frames >= self.min_frames:
+                if self.confidence >= self.accept_confidence:
+                    self.state = 'verified'
+                elif self.confidence <= 1.0 - self.accept_confidence:
+                    self.state = 'rejected'
+            if self.state == 'pending' and self.frames >= self.max_frames:
+                self.state = 'rejected' if self.scored_frames else 'failed'
+
+            status = self.status()
+            status['frame'] = frame
+            return status
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'sessionId': self.session_id,
+            'voterId': self.voter_id,
+            'state': self.state,
+            'frames': self.frames,
+            'duplicateFrames': self.duplicate_frames,
+            'scoredFrames': self.scored_frames,
+            'detections': self.detections,
+            'confidence': self.confidence,
+            'meanDistance': float(np.mean(self.distances)) if self.distances else None
+        }
+
+    def _score_frame(self, image: Optional[np.ndarray]) -> Dict[str, Any]:
+        if image is None:
+            return {'scored': False, 'reason': 'undecodable'}
+
+        quality_gate = self.biometric_service.quality_gate
+        if quality_gate is not None:
+            quality = quality_gate.check(image)
+            if not quality['accepted']:
+                return {'scored': False, 'reason': quality['reason'], 'message': quality['message']}
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        # Track from the previous frame, fall back to full detection when lost
+        location = None
+        if self._frames_since_detection < self.redetect_interval:
+            location = self.tracker.update(gray)
+        tracked = location is not None
+
+        # Detection and encoding run in the face encoding pool when one is configured
+        location, encoding = self.biometric_service.locate_and_encode_face(rgb_image, location)
+        if tracked:
+            self._frames_since_detection += 1
+        else:
+            self.detections += 1
+            self._frames_since_detection = 0
+            if location is None:
+                return {'scored': False, 'reason': 'no_face'}
+            self.tracker.reset(gray, location)
+
+        if encoding is None:
+            return {'scored': False, 'reason': 'no_face'}
+
+        distance = float(np.linalg.norm(encoding - self.reference_encoding))
+        self.distances.append(distance)
+        self.scored_frames += 1
+        self.log_odds += (self.biometric_service.face_tolerance - distance) / self.evidence_scale
+        return {'scored': True, 'tracked': tracked, 'distance': distance}
+
+class FaceStreamService:
+    """
+    Keeps the open streaming face verification sessions.
+
+    Sessions are kept in process memory by default, which only works when
+    every frame of a session reaches the same process. serve.py forks
+    workers that accept from one shared socket, so a follow-up frame can
+    land on any of them: multi-process servers must either route sessions
+    stickily or pass session_dir, where sessions are stored as files that
+    every worker on the host reads and updates under a per-session lock.
+    """
+
+    def __init__(self,
+                 biometric_service,
+                 vectors_dir: str = 'data/vectors',
+                 session_ttl: float = 120.0,
+                 session_dir: Optional[str] = None,
+                 sweep_interval: float = 10.0,
+                 **session_options):
+        """
+        Args:
+            biometric_service: BiometricService used by the sessions
+            vectors_dir: Directory holding the enrolled face vectors
+            session_ttl: Seconds an unfinished session is kept
+            session_dir: Directory shared by all server processes to store the sessions in,
+                or None to keep them in this process's memory
+            sweep_interval: Seconds between two sweeps for expired sessions
+            session_options: Extra FaceVerificationSession arguments
+        """
+        self.biometric_service = biometric_service
+        self.vectors_dir = vectors_dir
+        self.session_ttl = session_ttl
+        self.session_dir = session_dir
+        self.sweep_interval = sweep_interval
+        self.session_options = session_options
+        self._next_sweep = 0.0
+        self._sessions: Dict[str, FaceVerificationSession] = {}
+        self._lock = threading.Lock()
+        if session_dir is not None:
+            os.makedirs(session_dir, exist_ok=True)
+
+    def start_session(self, voter_id: str) -> Optional[FaceVerificationSession]:
+        """
+        Open a session for a voter
+        Args:
+            voter_id: Voter to verify
+        Returns:
+            The new session, or None if the voter has no enrolled face
+        """
+        reference = self.biometric_service.load_vector(f'{self.vectors_dir}/{voter_id}_face.npy')
+        if reference is None:
+            return None
+
+        session = FaceVerificationSession(voter_id, reference, self.biometric_service, **self.session_options)
+        with self._lock:
+            self._expire()
+            if self.session_dir is None:
+                self._sessions[session.session_id] = session
+        if self.session_dir is not None:
+            self._save(session)
+        return session
+
+    def add_frames(self, session_id: str, frames: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Feed base64 frames to a session until it reaches a decision
+        Args:
+            session_id: Session returned by start_session
+            frames: Base64 encoded frames, in capture order
+        Returns:
+            Session status, or None if the session is unknown or expired
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+        if self.session_dir is None:
+            return self._add_frames(session, frames)
+
+        if not self._valid_session_id(session_id):
+            return None
+        # Frames of one session are scored in order, whichever worker receives them
+        with self._session_lock(session_id):
+            session = self._load(session_id)
+            status = self._add_frames(session, frames)
+            if status is not None and status['state'] == 'pending':
+                self._save(session)
+            elif session is not None:
+                self._remove(session_id)
+        return status
+
+    def _add_frames(self, session: Optional[FaceVerificationSession], frames: List[str]) -> Optional[Dict[str, Any]]:
+        if session is None:
+            return None
+
+        status = session.status()
+        for face_data in frames:
+            # The same frame sent twice is not independent evidence
+            digest = hashlib.sha256(face_data.split(',')[-1].encode('utf-8')).digest()
+            if not session.claim_frame(digest):
+                status = session.status()
+                status['frame'] = {'scored': False, 'reason': 'duplicate'}
+                continue
+            status = session.add_frame(self.biometric_service.decode_image(face_data))
+            if status['state'] != 'pending':
+                break
+
+        if status['state'] != 'pending':
+            logger.info(f"Face stream session {session.session_id} for {session.voter_id}: "
+                        f"{status['state']} after {status['frames']} frames")
+            with self._lock:
+                self._sessions.pop(session.session_id, None)
+        return status
+
+    def _session_path(self, session_id: str, suffix: str = '.pkl') -> str:
+        return os.path.join(self.session_dir, session_id + suffix)
+
+    @staticmethod
+    def _valid_session_id(session_id: str) -> bool:
+        return len(session_id) == 32 and all(c in '0123456789abcdef' for c in session_id)
+
+    def _load(self, session_id: str) -> Optional[FaceVerificationSession]:
+        try:
+            with open(self._session_path(session_id), 'rb') as f:
+                session = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Could not load face stream session {session_id}: {str(e)}")
+            return None
+        if session.created_at < time.time() - self.session_ttl:
+            return None
+        session.biometric_service = self.biometric_service
+        return session
+
+    def _save(self, session: FaceVerificationSession) -> None:
+        path = self._session_path(session.session_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def _session_lock(self, session_id: str, blocking: bool = True):
+        """
+        Hold the file lock of a session
+        Args:
+            session_id: Session to lock
+            blocking: Wait for the lock, rather than give up if another worker holds it
+        Yields:
+            True once the lock is held, False if it is busy and blocking is False
+        """
+        path = self._session_path(session_id, '.lock')
+        while True:
+            lock_file = open(path, 'a')
+            try:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                # The holder may have removed the lock file, and another worker
+                # created a new one, while this one was waiting: lock that instead
+                try:
+                    current = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                locked = os.fstat(lock_file.fileno())
+                if (locked.st_dev, locked.st_ino) == (current.st_dev, current.st_ino):
+                    yield True
+                    return
+            finally:
+                lock_file.close()
+
+    def _remove(self, session_id: str) -> None:
+        # Only called with the session lock held
+        for suffix in ('.pkl', '.lock'):
+            try:
+                os.remove(self._session_path(session_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _expire(self) -> None:
+        # Sweeping is O(sessions), so it runs every sweep_interval rather than on every request
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+
+        deadline = time.time() - self.session_ttl
+        for session_id in [sid for sid, s in self._sessions.items() if s.created_at < deadline]:
+            del self._sessions[session_id]
+
+        if self.session_dir is not None:
+            # Sessions abandoned by clients, whichever worker created them
+            stale = set()
+            for entry in os.scandir(self.session_dir):
+                try:
+                    if entry.stat().st_mtime >= deadline:
+                        continue
+                    if entry.name.endswith('.tmp'):
+                        # Left behind by a worker that died while saving
+                        os.remove(entry.path)
+                    else:
+                        stale.add(os.path.splitext(entry.name)[0])
+                except FileNotFoundError:
+                    pass
+            for session_id in filter(self._valid_session_id, stale):
+                # A session whose lock is held is still being updated
+                with self._session_lock(session_id, blocking=False) as locked:
+                    if locked and self._expired_on_disk(session_id, deadline):
+                        self._remove(session_id)
+
+    def _expired_on_disk(self, session_id: str, deadline: float) -> bool:
+        try:
+            return os.stat(self._session_path(session_id)).st_mtime < deadline
+        except FileNotFoundError:
+            return True
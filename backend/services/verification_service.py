@@ -1,10 +1,15 @@
 from utils.dummy_dataset import DummyDatasetManager
+from utils.single_flight import SingleFlight
 from ai.preprocessing.fingerprint_processor import FingerprintProcessor
+from ai.config import AI_CONFIG
+from ai.models.fingerprint_model import FingerprintModel
 from ai.utils.verification import FingerprintVerifier
+from ai.utils.deadline import Deadline, DeadlineExceeded
 import numpy as np
 import cv2
 import logging
 import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 logger = logging.getLogger(__name__)
 
@@ -12,31 +17,54 @@ class VerificationService:
     def __init__(self):
         self.dataset_manager = DummyDatasetManager()
         self.fp_processor = FingerprintProcessor()
-        self.fp_verifier = FingerprintVerifier()
+        # The model is built on first use; checking stored templates doesn't need it
+        self.fp_verifier = FingerprintVerifier(
+            model_factory=lambda: FingerprintModel.from_config(AI_CONFIG),
+            weights_digest=FingerprintModel.config_weights_digest(AI_CONFIG)
+        )
+        self.verification_flight = SingleFlight()
     
-    def verify_fingerprint(self, fingerprint_image, voter_id, polling_station):
+    def verify_fingerprint(self, fingerprint_image, voter_id, polling_station, deadline=None):
         """Verify a fingerprint against the dummy dataset
         
+        Only the probe image is processed here; the stored side comes from
+        the template computed at registration.
+        
         Args:
             fingerprint_image: Numpy array containing the fingerprint image
             voter_id: Voter ID to verify against
             polling_station: Polling station ID
+            deadline: Optional Deadline of the request; the work stops at
+                the next stage once it passes
             
         Returns:
-            Dictionary with verification result
+            Dictionary with verification result; 'timed_out' is set in the
+            metadata when the deadline passed first
         """
+        deadline = deadline or Deadline()
+        # Identical concurrent requests (double clicks, kiosk retries) share one run
+        key = SingleFlight.key(voter_id, polling_station, fingerprint_image)
+        timeout = None if deadline.expires_at is None else deadline.remaining()
+        try:
+            result, _ = self.verification_flight.do(
+                key, self._verify_fingerprint, fingerprint_image, voter_id, polling_station, deadline,
+                timeout=timeout
+            )
+            return result
+        except FutureTimeoutError:
+            return self._timed_out(voter_id, "waiting for an identical request")
+    
+    def _verify_fingerprint(self, fingerprint_image, voter_id, polling_station, deadline):
         try:
             # Convert image to grayscale if needed
             if len(fingerprint_image.shape) == 3:
                 fingerprint_image = cv2.cvtColor(fingerprint_image, cv2.COLOR_BGR2GRAY)
             
-            # Preprocess the fingerprint
-            processed_fp = self.fp_processor.preprocess_image(fingerprint_image)
+            # Get stored template
+            deadline.check('template lookup')
+            template = self.get_template(voter_id)
             
-            # Get stored fingerprint
-            stored_fp, metadata = self.dataset_manager.get_fingerprint(voter_id)
-            
-            if stored_fp is None:
+            if template is None:
                 return {
                     "success": False,
                     "confidence": 0.0,
@@ -48,26 +76,29 @@ class VerificationService:
                     "transaction_hash": str(uuid.uuid4())
                 }
             
-            # Preprocess stored fingerprint
-            processed_stored_fp = self.fp_processor.preprocess_image(stored_fp)
-            
-            # Compare fingerprints
-            ai_similarity = self.fp_verifier.verify(processed_fp, processed_stored_fp)
-            
-            # Determine if verification was successful
-            success = ai_similarity >= 0.85  # Threshold can be adjusted
+            # Compare the probe against the stored template
+            success, confidence, fp_metadata = self.fp_verifier.verify_fingerprint(
+                fingerprint_image,
+                template["features"],
+                (template["minutiae"], template["minutiae_types"]),
+                deadline
+            )
             
             return {
-                "success": success,
-                "confidence": float(ai_similarity),
+                "success": bool(success),
+                "confidence": float(confidence),
                 "metadata": {
-                    "ai_similarity": float(ai_similarity),
+                    "ai_similarity": fp_metadata["ai_similarity"],
                     "verification_method": "dummy_dataset",
+                    "match_method": fp_metadata["verification_method"],
+                    "template_version": template["version"],
                     "polling_station": polling_station
                 },
                 "transaction_hash": str(uuid.uuid4())
             }
             
+        except DeadlineExceeded as e:
+            return self._timed_out(voter_id, str(e))
         except Exception as e:
             logger.error(f"Error during fingerprint verification: {str(e)}")
             return {
@@ -80,6 +111,45 @@ class VerificationService:
                 "transaction_hash": str(uuid.uuid4())
             }
     
+    def _timed_out(self, voter_id, reason):
+        logger.warning(f"Fingerprint verification for voter {voter_id} timed out: {reason}")
+        return {
+            "success": False,
+            "confidence": 0.0,
+            "metadata": {
+                "verification_method": "dummy_dataset",
+                "error": "Verification timed out",
+                "timed_out": True
+            },
+            "transaction_hash": str(uuid.uuid4())
+        }
+    
+    def get_template(self, voter_id):
+        """Get the fingerprint template for a voter
+        
+        Templates that are missing or were built with a different processing
+        configuration or model are rebuilt from the stored image and saved.
+        
+        Args:
+            voter_id: Voter ID to look up
+            
+        Returns:
+            Template dictionary, or None if the voter is not registered
+        """
+        version = self.fp_verifier.template_version
+        template = self.dataset_manager.get_template(voter_id, version)
+        if template is not None:
+            return template
+        
+        stored_fp, _ = self.dataset_manager.get_fingerprint(voter_id)
+        if stored_fp is None:
+            return None
+        
+        logger.info(f"Rebuilding fingerprint template for voter {voter_id}")
+        template = self.fp_verifier.create_template(stored_fp)
+        self.dataset_manager.save_template(voter_id, template)
+        return template
+    
     def register_fingerprint(self, fingerprint_image, voter_id, metadata=None):
         """Register a fingerprint in the dummy dataset
         
@@ -101,6 +171,10 @@ class VerificationService:
                 
             # Save to dataset
             self.dataset_manager.add_fingerprint(voter_id, fingerprint_image, metadata)
+            
+            # Precompute the template so verification only processes the probe
+            template = self.fp_verifier.create_template(fingerprint_image)
+            self.dataset_manager.save_template(voter_id, template)
             return True
         except Exception as e:
             logger.error(f"Error registering fingerprint: {str(e)}")
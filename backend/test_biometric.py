@@ -1,8 +1,29 @@
+import asyncio
 import cv2
 import numpy as np
 import base64
-from services.biometric_service import BiometricService
+import fcntl
+import io
 import os
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+# The capture quality gates live in the ai package at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.utils.deadline import Deadline
+from services.biometric_service import BiometricService, _calibrate
+from services.enrollment_service import BulkEnrollmentService
+from services.face_stream_service import FaceStreamService
+from utils import face_utils
+from utils.admission import AdmissionController, Overloaded, cores_per_worker
+from utils.dummy_dataset import DummyDatasetManager
+from utils.image_io import PayloadTooLarge, decode_image_buffer, read_stream
+from utils.result_cache import EmbeddingCache
+from utils.single_flight import SingleFlight
 import urllib.request
 
 def download_sample_face():
@@ -149,9 +170,733 @@ def test_vector_comparison():
     else:
         print("Failed to load vectors for comparison")
 
+def test_timed_out_modality_is_not_fused():
+    """A modality that timed out counts as missing instead of scoring 0"""
+    biometric_service = BiometricService()
+    perfect = {'hard_failure': False, 'match': True, 'score': 1.0}
+    biometric_service._score_fingerprint = lambda *args: perfect
+    
+    for reason in ('face timed out', 'face cancelled'):
+        biometric_service._score_face = lambda *args: {
+            'hard_failure': False, 'timed_out': True, 'match': False, 'score': None,
+            'error': reason, 'reason': 'timed_out'
+        }
+        for parallel in (True, False):
+            result = biometric_service.verify_biometrics('V001', b'face', b'fingerprint', parallel=parallel)
+            # Fused with a 0 this would be 0.5, enough to pass the default threshold
+            assert not result['success']
+            assert result['timed_out']
+            assert 'waiting for face' in result['error']
+    
+    # Both modalities answered: fused as before
+    biometric_service._score_face = lambda *args: perfect
+    result = biometric_service.verify_biometrics('V001', b'face', b'fingerprint')
+    assert result['success'] and result['score'] == 1.0
+
+def test_strong_modality_does_not_carry_a_mismatch():
+    """A perfect score in one modality cannot get a mismatch in the other accepted"""
+    biometric_service = BiometricService()
+    tolerance = biometric_service.face_tolerance
+    perfect = {'hard_failure': False, 'match': True, 'score': 1.0}
+    
+    def face_at(distance):
+        score = _calibrate(distance, tolerance, best=0.0, worst=2 * tolerance)
+        return lambda *args: {'hard_failure': False, 'match': distance <= tolerance, 'score': score}
+    
+    # Complete mismatch and an impostor face, each with a perfect fingerprint
+    for distance in (1.4, 0.9):
+        biometric_service._score_face = face_at(distance)
+        biometric_service._score_fingerprint = lambda *args: perfect
+        result = biometric_service.verify_biometrics('V001', b'face', b'fingerprint')
+        assert result['score'] >= biometric_service.fusion_threshold
+        assert not result['success']
+        assert result['rejected_modalities'] == ['face']
+    
+    # And the other way round
+    biometric_service._score_face = lambda *args: perfect
+    biometric_service._score_fingerprint = lambda *args: {'hard_failure': False, 'match': False, 'score': 0.0}
+    result = biometric_service.verify_biometrics('V001', b'face', b'fingerprint')
+    assert not result['success'] and result['rejected_modalities'] == ['fingerprint']
+    
+    # A borderline miss is still made up for by a strong match
+    biometric_service._score_face = face_at(tolerance + 0.05)
+    biometric_service._score_fingerprint = lambda *args: perfect
+    result = biometric_service.verify_biometrics('V001', b'face', b'fingerprint')
+    assert result['success'] and 'rejected_modalities' not in result
+
+def test_coalesced_call_outlives_cancelled_caller():
+    """A caller that gives up neither cancels the shared call nor hands its cancellation on"""
+    flight = SingleFlight()
+    calls = []
+    
+    async def verify(value, deadline):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+    
+    async def scenario():
+        first = asyncio.ensure_future(flight.do_async('V001', verify, 21))
+        await asyncio.sleep(0)
+        retry = asyncio.ensure_future(flight.do_async('V001', verify, 21))
+        await asyncio.sleep(0)
+        # The client that started the call disconnects
+        first.cancel()
+        assert await retry == (42, True)
+        
+        # Everybody gives up: the call is cancelled and the next one starts afresh
+        abandoned = asyncio.ensure_future(flight.do_async('V002', verify, 1))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await asyncio.sleep(0)
+        assert await flight.do_async('V002', verify, 2) == (4, False)
+    
+    asyncio.run(scenario())
+    assert calls == [21, 1, 2]
+    assert flight.stats() == {'in_flight': 0, 'leaders': 3, 'shared': 1}
+
+def test_joiner_with_longer_budget_outlives_leader_deadline():
+    """A shared call keeps running for a caller that joined it with a later deadline"""
+    flight = SingleFlight()
+    
+    async def verify(value, deadline):
+        # Like run_cpu_bound: executor work, waited for until the call's deadline
+        loop = asyncio.get_running_loop()
+        work = loop.run_in_executor(None, time.sleep, 0.3)
+        await deadline.wait(work)
+        return value
+    
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async('V001', verify, 7, deadline=Deadline.after(0.1)))
+        await asyncio.sleep(0)
+        joiner = asyncio.ensure_future(flight.do_async('V001', verify, 7, deadline=Deadline.after(2.0)))
+        # The leader gives up at its own deadline, the joiner gets the result
+        try:
+            await leader
+            assert False, "the leader's deadline should have passed"
+        except asyncio.TimeoutError:
+            pass
+        assert await joiner == (7, True)
+    
+    asyncio.run(scenario())
+
+class _StubStreamService(BiometricService):
+    """Every frame shows the enrolled face, without face detection"""
+    
+    def locate_and_encode_face(self, rgb_image, location=None):
+        return (0, 8, 8, 0), np.ones(128) / np.sqrt(128)
+
+def _stream_service(root, **options):
+    vectors = os.path.join(root, 'vectors')
+    os.makedirs(vectors, exist_ok=True)
+    np.save(os.path.join(vectors, 'V001_face.npy'), np.ones(128))
+    return FaceStreamService(_StubStreamService(check_quality=False, cache_size=0), vectors_dir=vectors, **options)
+
+def _encode_frame(image):
+    return base64.b64encode(cv2.imencode('.jpg', image)[1].tobytes()).decode('ascii')
+
+def test_face_stream_counts_each_frame_once():
+    """A frame sent twice, in one request or across requests, is scored once"""
+    with tempfile.TemporaryDirectory() as root:
+        stream = _stream_service(root)
+        session = stream.start_session('V001')
+        frame = _encode_frame(create_test_face())
+        
+        status = stream.add_frames(session.session_id, [frame, frame])
+        assert status['state'] == 'pending'
+        assert (status['frames'], status['scoredFrames'], status['duplicateFrames']) == (1, 1, 1)
+        status = stream.add_frames(session.session_id, ['data:image/jpeg;base64,' + frame])
+        assert (status['state'], status['duplicateFrames']) == ('pending', 2)
+        
+        status = stream.add_frames(session.session_id, [_encode_frame(cv2.flip(create_test_face(), 1))])
+        assert (status['state'], status['scoredFrames']) == ('verified', 2)
+
+def test_face_stream_sweep_skips_locked_sessions():
+    """Expired session files are swept periodically, never while another worker holds their lock"""
+    with tempfile.TemporaryDirectory() as root:
+        session_dir = os.path.join(root, 'sessions')
+        stream = _stream_service(root, session_dir=session_dir, session_ttl=60, sweep_interval=3600)
+        session = stream.start_session('V001')
+        stream.add_frames(session.session_id, [_encode_frame(create_test_face())])
+        paths = [os.path.join(session_dir, session.session_id + suffix) for suffix in ('.pkl', '.lock')]
+        expired = time.time() - 120
+        for path in paths:
+            os.utime(path, (expired, expired))
+        
+        # Not swept again before sweep_interval
+        stream.start_session('V001')
+        assert all(os.path.exists(path) for path in paths)
+        
+        # Another worker sweeps, but the session is locked
+        other = _stream_service(root, session_dir=session_dir, session_ttl=60, sweep_interval=0)
+        with open(paths[1], 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            other.start_session('V001')
+            assert all(os.path.exists(path) for path in paths)
+        
+        other.start_session('V001')
+        assert not any(os.path.exists(path) for path in paths)
+        assert len(os.listdir(session_dir)) == 3
+
+class _StubVerificationService:
+    """Fingerprint side of bulk enrollment, without the model"""
+    
+    def __init__(self, dataset_path):
+        template = {'version': 'stub', 'processed_image': np.zeros((8, 8)), 'features': np.ones(8),
+                    'minutiae': np.zeros((0, 2)), 'minutiae_types': np.zeros(0)}
+        self.fp_verifier = type('Verifier', (), {'create_template': staticmethod(lambda image: template)})()
+        self.dataset_manager = DummyDatasetManager(dataset_path)
+
+class _StubBiometricService(BiometricService):
+    """Face side of bulk enrollment, without face detection"""
+    
+    def encode_face_frame(self, rgb_image):
+        return np.ones(128) / np.sqrt(128)
+
+def _write_enrollment_tar(path, manifest_rows):
+    """Write a tar.gz of images with the manifest as its last member"""
+    _, face = cv2.imencode('.jpg', create_test_face())
+    _, fingerprint = cv2.imencode('.png', create_test_fingerprint())
+    members = [('V001/face.jpg', face.tobytes()), ('V001/fp.png', fingerprint.tobytes()),
+               ('V002/fp.png', fingerprint.tobytes())]
+    manifest = 'voter_id,face,fingerprint,district\n' + ''.join(','.join(row) + '\n' for row in manifest_rows)
+    members.append(('manifest.csv', manifest.encode('utf-8')))
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+def test_bulk_enrollment_from_tar():
+    """Tar sources are read as a stream, bad voter IDs are rejected and resumes keep their counts"""
+    with tempfile.TemporaryDirectory() as root:
+        archive = os.path.join(root, 'district.tar.gz')
+        _write_enrollment_tar(archive, [
+            ('V001', 'V001/face.jpg', 'V001/fp.png', 'north'),
+            ('V002', '', 'V002/fp.png', 'north'),
+            ('../../escape', '', 'V002/fp.png', 'north'),
+            ('V003', '', 'V003/missing.png', 'north'),
+        ])
+        dataset = os.path.join(root, 'dataset')
+        service = BulkEnrollmentService(
+            _StubVerificationService(dataset),
+            _StubBiometricService(check_quality=False, cache_size=0),
+            state_dir=os.path.join(root, 'state'),
+            vectors_dir=os.path.join(root, 'vectors'),
+            workers=2,
+            batch_size=2
+        )
+        
+        report = service.run(archive, job_id='job1')
+        assert report['state'] == 'completed'
+        assert (report['processed'], report['enrolled'], report['failed']) == (4, 2, 2)
+        errors = {failure['voter_id']: failure['error'] for failure in report['failures']}
+        assert 'Invalid voter_id' in errors['../../escape']
+        assert 'not found' in errors['V003']
+        # Nothing written outside the stores, nothing unpacked next to the journal
+        assert sorted(os.listdir(root)) == ['dataset', 'district.tar.gz', 'state', 'vectors']
+        assert sorted(os.listdir(os.path.join(root, 'state', 'job1'))) == ['journal.jsonl', 'status.json']
+        assert os.path.exists(os.path.join(root, 'vectors', 'V001_face.npy'))
+        assert os.path.exists(os.path.join(dataset, 'V002', 'fingerprint.jpg'))
+        
+        # Resuming skips everything and keeps the counts of the first run
+        report = service.run(archive, job_id='job1')
+        assert (report['processed'], report['skipped'], report['enrolled'], report['failed']) == (4, 4, 2, 2)
+        
+        # The store refuses unsafe IDs on its own as well
+        try:
+            service.verification_service.dataset_manager.add_fingerprints_batch(
+                [('../escape', create_test_fingerprint(), {}, None)])
+            assert False, 'unsafe voter ID accepted'
+        except ValueError:
+            pass
+
+def _auth_headers(flask_app):
+    import jwt
+    
+    token = jwt.encode({'voter_id': 'admin', 'exp': time.time() + 60}, flask_app.JWT_SECRET,
+                       algorithm=flask_app.JWT_ALGORITHM)
+    return {'Authorization': f'Bearer {token}'}
+
+def test_bulk_enrollment_endpoint():
+    """/enroll/bulk starts a job from an uploaded archive and reports its status"""
+    import app as flask_app
+    
+    with tempfile.TemporaryDirectory() as root:
+        archive = os.path.join(root, 'district.tar.gz')
+        _write_enrollment_tar(archive, [('V001', 'V001/face.jpg', 'V001/fp.png', 'north'),
+                                        ('../x', '', 'V002/fp.png', 'north')])
+        service = BulkEnrollmentService(
+            _StubVerificationService(os.path.join(root, 'dataset')),
+            _StubBiometricService(check_quality=False, cache_size=0),
+            state_dir=os.path.join(root, 'state'),
+            vectors_dir=os.path.join(root, 'vectors')
+        )
+        saved = flask_app.enrollment_service, flask_app.ENROLLMENT_STATE_DIR
+        flask_app.enrollment_service, flask_app.ENROLLMENT_STATE_DIR = service, os.path.join(root, 'state')
+        try:
+            client = flask_app.app.test_client()
+            headers = _auth_headers(flask_app)
+            
+            response = client.post('/enroll/bulk', json={'jobId': '../x'}, headers=headers)
+            assert response.status_code == 400
+            response = client.post('/enroll/bulk', json={'source': '../../etc'}, headers=headers)
+            assert response.status_code == 400
+            
+            with open(archive, 'rb') as f:
+                response = client.post('/enroll/bulk', headers=headers, content_type='multipart/form-data',
+                                       data={'jobId': 'upload1', 'archive': (f, 'district.tar.gz')})
+            assert response.status_code == 202
+            assert response.get_json()['jobId'] == 'upload1'
+            flask_app.enrollment_jobs['upload1'].join(30)
+            
+            status = client.get('/enroll/bulk/upload1', headers=headers).get_json()
+            assert status['state'] == 'completed'
+            assert (status['enrolled'], status['failed']) == (1, 1)
+            assert client.get('/enroll/bulk/unknown', headers=headers).status_code == 404
+        finally:
+            flask_app.enrollment_service, flask_app.ENROLLMENT_STATE_DIR = saved
+
+def test_admission_rejects_with_retry_after():
+    """Requests past the slots and the queue get a 429 with Retry-After, failed requests free their slot"""
+    import app as flask_app
+    
+    admission = AdmissionController(concurrency=1, max_queue=0, max_wait=0.1)
+    try:
+        with admission.slot():
+            raise ValueError('verification failed')
+    except ValueError:
+        pass
+    assert (admission.stats()['running'], admission.stats()['queued']) == (0, 0)
+    
+    saved = flask_app.biometric_admission
+    flask_app.biometric_admission = admission
+    try:
+        client = flask_app.app.test_client()
+        headers = _auth_headers(flask_app)
+        with admission.slot():
+            try:
+                admission.enter()
+                assert False, 'admitted past the queue'
+            except Overloaded as e:
+                assert e.retry_after >= 1
+            response = client.post('/verify/face', json={'voterId': 'V001'}, headers=headers)
+            assert response.status_code == 429
+            assert int(response.headers['Retry-After']) == response.get_json()['retryAfter'] >= 1
+        # Admitted again once the slot is free; rejected by the route itself
+        response = client.post('/verify/face', json={'voterId': 'V001'}, headers=headers)
+        assert response.status_code == 400
+    finally:
+        flask_app.biometric_admission = saved
+    assert admission.stats()['rejected_queue_full'] == 2
+
+def test_admission_is_sized_per_server_worker():
+    """Under serve.py each worker admits its share of the cores, not all of them"""
+    saved = os.environ.get('SERVER_WORKERS')
+    try:
+        os.environ['SERVER_WORKERS'] = str(2 * (os.cpu_count() or 1))
+        assert cores_per_worker() == 1
+        assert AdmissionController().concurrency == 1
+        os.environ['SERVER_WORKERS'] = '1'
+        assert AdmissionController().concurrency == (os.cpu_count() or 1)
+    finally:
+        if saved is None:
+            os.environ.pop('SERVER_WORKERS', None)
+        else:
+            os.environ['SERVER_WORKERS'] = saved
+
+def test_cpu_bound_calls_are_bounded_and_time_out():
+    """FastAPI runs CPU-bound calls on at most verification_workers threads and answers 504 at the deadline"""
+    import main
+    from fastapi import HTTPException
+    
+    running = []
+    peak = []
+    lock = threading.Lock()
+    
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+    
+    async def scenario():
+        await asyncio.gather(*(main.run_cpu_bound(work) for _ in range(2 * main.verification_workers)))
+        assert max(peak) <= main.verification_workers
+        
+        started = time.monotonic()
+        try:
+            await main.run_cpu_bound(time.sleep, 1.0, deadline=Deadline.after(0.1))
+            assert False, 'call outlived its deadline'
+        except HTTPException as e:
+            assert e.status_code == 504
+        assert time.monotonic() - started < 0.5
+    
+    asyncio.run(scenario())
+
+class _CountingStream(io.RawIOBase):
+    """Endless upload body that counts the bytes read from it"""
+    
+    def __init__(self):
+        self.read_bytes = 0
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        self.read_bytes += len(buffer)
+        return len(buffer)
+
+def test_upload_limit_is_enforced_while_streaming():
+    """Oversized bodies are refused without reading them whole, declared or chunked"""
+    stream = _CountingStream()
+    for content_length in (1025, None):
+        try:
+            read_stream(stream, 1024, content_length, chunk_size=256)
+            assert False, 'oversized body accepted'
+        except PayloadTooLarge as e:
+            assert e.max_bytes == 1024
+    assert stream.read_bytes <= 1024 + 256
+    
+    _, encoded = cv2.imencode('.jpg', create_test_face())
+    body = read_stream(io.BytesIO(encoded.tobytes()), encoded.size, encoded.size)
+    assert isinstance(body, memoryview) and body.nbytes == encoded.size
+    assert decode_image_buffer(body).shape == create_test_face().shape
+    assert decode_image_buffer(body, reduce_factor=2).shape[:2] == (create_test_face().shape[0] // 2,
+                                                                   create_test_face().shape[1] // 2)
+    assert decode_image_buffer(memoryview(b'')) is None
+
+def test_binary_face_upload_limit():
+    """/verify/face/binary answers 413 past the face limit for raw, chunked and multipart bodies"""
+    import app as flask_app
+    
+    _, encoded = cv2.imencode('.jpg', create_test_face())
+    image = encoded.tobytes()
+    saved = flask_app.FACE_UPLOAD_MAX_BYTES
+    client = flask_app.app.test_client()
+    headers = _auth_headers(flask_app)
+    url = '/verify/face/binary?voterId=V001'
+    
+    def post_raw(chunked=False):
+        if chunked:
+            return client.post(url, input_stream=io.BytesIO(image), content_type='image/jpeg',
+                               headers={**headers, 'Transfer-Encoding': 'chunked'},
+                               environ_overrides={'wsgi.input_terminated': True})
+        return client.post(url, data=image, content_type='image/jpeg', headers=headers)
+    
+    def post_form():
+        return client.post(url, headers=headers, content_type='multipart/form-data',
+                           data={'face': (io.BytesIO(image), 'face.jpg')})
+    
+    try:
+        flask_app.FACE_UPLOAD_MAX_BYTES = len(image) - 1
+        for response in (post_raw(), post_raw(chunked=True), post_form()):
+            assert response.status_code == 413
+        
+        # Within the limit the image reaches face analysis
+        flask_app.FACE_UPLOAD_MAX_BYTES = len(image) + 4096
+        for response in (post_raw(), post_raw(chunked=True), post_form()):
+            assert response.status_code != 413
+            assert 'message' in response.get_json()
+    finally:
+        flask_app.FACE_UPLOAD_MAX_BYTES = saved
+
+def test_embedding_cache_hits_and_evicts():
+    """Embeddings are found by image digest, evicted least recently used first and expire"""
+    cache = EmbeddingCache(max_entries=2, ttl=60)
+    keys = [EmbeddingCache.digest(data) for data in (b'a', b'b', b'c')]
+    assert EmbeddingCache.digest('a') == keys[0]
+    assert cache.get(keys[0]) is None
+    
+    cache.put(keys[0], np.zeros(128))
+    cache.put(keys[1], np.ones(128))
+    cached = cache.get(keys[0])
+    assert np.array_equal(cached, np.zeros(128))
+    # Callers get copies, the cached embedding can't be changed through them
+    cached[0] = 1
+    assert cache.get(keys[0])[0] == 0
+    
+    # keys[0] was used last, so keys[1] makes room for keys[2]
+    cache.put(keys[2], np.ones(128))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats() == {'entries': 2, 'hits': 4, 'misses': 2}
+    
+    expiring = EmbeddingCache(ttl=0.05)
+    expiring.put(keys[0], np.zeros(128))
+    time.sleep(0.1)
+    assert expiring.get(keys[0]) is None and expiring.stats()['entries'] == 0
+    
+    try:
+        cache.put(keys[0], np.zeros((2, 64)))
+        assert False, 'non 1-D embedding cached'
+    except ValueError:
+        pass
+
+def test_resent_face_skips_encoding():
+    """The same face upload is encoded once, a different decode size is encoded again"""
+    class CountingService(_StubBiometricService):
+        encoded = 0
+        
+        def encode_face_frame(self, rgb_image):
+            CountingService.encoded += 1
+            return super().encode_face_frame(rgb_image)
+    
+    service = CountingService(check_quality=False, cache_size=16)
+    _, encoded = cv2.imencode('.jpg', create_test_face())
+    image = encoded.tobytes()
+    
+    first = service.analyze_face_bytes(image)
+    again = service.analyze_face_bytes(memoryview(image))
+    assert (first['cached'], again['cached']) == (False, True)
+    assert np.array_equal(first['encoding'], again['encoding'])
+    assert service.analyze_face_bytes(image, reduce_factor=2)['cached'] is False
+    assert CountingService.encoded == 2
+
+def _crash_on_white_corner(detect):
+    """Detector that kills the worker process on frames with a white top-left pixel"""
+    def detect_or_crash(frame, **kwargs):
+        if frame[0, 0].min() == 255:
+            os._exit(3)
+        return detect(frame, **kwargs)
+    return detect_or_crash
+
+def test_face_pool_survives_worker_crashes():
+    """A crash fails only the task the worker had taken, and the pool carries on with a new worker"""
+    import signal
+    from services import face_encoding_pool
+    
+    detect = face_encoding_pool.detect_largest_face
+    # Patched before start, so the forked workers inherit it
+    face_encoding_pool.detect_largest_face = _crash_on_white_corner(detect)
+    pool = face_encoding_pool.FaceEncodingPool(workers=1, slots=2)
+    try:
+        pool.start()
+        frame = cv2.cvtColor(create_test_face(), cv2.COLOR_BGR2RGB)
+        frame[0, 0] = 0
+        poison = frame.copy()
+        poison[0, 0] = 255
+        
+        crashed = pool.submit(poison)
+        queued = pool.submit(frame)
+        try:
+            crashed.result(30)
+            assert False, 'crashed task succeeded'
+        except RuntimeError as e:
+            assert 'died' in str(e)
+        # The task behind it runs on the replacement worker
+        queued.result(30)
+        
+        # A worker killed while idle is replaced too, and no slot is lost
+        killed = set(pool._workers)
+        os.kill(next(iter(killed)), signal.SIGKILL)
+        deadline = time.monotonic() + 30
+        while (pool._workers & killed or not pool._workers) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        pool.encode(frame, timeout=30)
+        stats = pool.stats()
+        assert (stats['workers'], stats['pending'], stats['running'], stats['free_slots']) == (1, 0, 0, 2)
+    finally:
+        pool.close()
+        face_encoding_pool.detect_largest_face = detect
+
+def test_detection_runs_on_a_downscaled_frame():
+    """Faces are found on a copy no longer than max_side and mapped back to full resolution"""
+    seen = []
+    
+    def face_locations(image, number_of_times_to_upsample=1, model='hog'):
+        seen.append(image.shape)
+        # A small face in the background and the voter, in detection image coordinates
+        return [(10, 60, 40, 30), (100, 300, 300, 100)]
+    
+    frame = np.zeros((960, 1280, 3), dtype=np.uint8)
+    detect = face_utils.face_recognition.face_locations
+    face_utils.face_recognition.face_locations = face_locations
+    try:
+        assert face_utils.detect_largest_face(frame, max_side=480) == (267, 800, 800, 267)
+        assert seen[-1] == (360, 480, 3)
+        assert face_utils.detect_largest_face(frame, scale=0.5) == (200, 600, 600, 200)
+        assert seen[-1] == (480, 640, 3)
+        # Small frames are not upscaled
+        assert face_utils.detect_largest_face(frame[:300, :400], max_side=480) == (100, 300, 300, 100)
+        assert seen[-1] == (300, 400, 3)
+        for scale in (0.0, 1.5):
+            try:
+                face_utils.detect_largest_face(frame, scale=scale)
+                assert False, f'scale {scale} accepted'
+            except ValueError:
+                pass
+    finally:
+        face_utils.face_recognition.face_locations = detect
+
+def test_detection_and_encoding_overlap():
+    """Each dlib model is used by one thread at a time, but detection and encoding run side by side"""
+    active = {'detect': 0, 'encode': 0}
+    peaks = []
+    lock = threading.Lock()
+    
+    def track(kind, result):
+        def call(*args, **kwargs):
+            with lock:
+                active[kind] += 1
+                peaks.append(dict(active))
+            time.sleep(0.1)
+            with lock:
+                active[kind] -= 1
+            return result
+        return call
+    
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    saved = face_utils.face_recognition.face_locations, face_utils.face_recognition.face_encodings
+    face_utils.face_recognition.face_locations = track('detect', [(10, 50, 50, 10)])
+    face_utils.face_recognition.face_encodings = track('encode', [np.ones(128)])
+    try:
+        threads = [threading.Thread(target=face_utils.detect_largest_face, args=(frame,)) for _ in range(2)]
+        threads += [threading.Thread(target=face_utils.encode_face, args=(frame, (10, 50, 50, 10))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        face_utils.face_recognition.face_locations, face_utils.face_recognition.face_encodings = saved
+    
+    assert max(peak['detect'] for peak in peaks) == 1
+    assert max(peak['encode'] for peak in peaks) == 1
+    assert any(peak['detect'] and peak['encode'] for peak in peaks)
+
+_TINY_APP = """
+import os
+import time
+from flask import Flask
+
+# Take a while to come up, like the real app loading its models
+time.sleep(float(os.environ.get('TINY_APP_STARTUP', 0)))
+app = Flask(__name__)
+
+@app.route('/pid')
+def pid():
+    return str(os.getpid())
+"""
+
+def _child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return {int(child) for child in f.read().split()}
+
+def _is_reaped(pid):
+    # A dead child that was not waited for stays in /proc as a zombie
+    return not os.path.exists(f'/proc/{pid}')
+
+def _served_by(url):
+    try:
+        return int(urllib.request.urlopen(url, timeout=2).read())
+    except OSError:
+        return None
+
+def _wait_until(condition, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+def test_serve_records_every_ready_worker():
+    """Ready reports are all recorded, even when several arrive, or one is split, in a read"""
+    import serve
+    
+    launcher = serve.Launcher('flask', None, 3)
+    try:
+        launcher.children = {101: 0, 102: 1, 103: 2}
+        launcher.forked_at = dict.fromkeys(launcher.children, time.perf_counter())
+        os.write(launcher._ready_write, b'101\n102\n10')
+        launcher._read_ready(1.0)
+        assert launcher.ready == {101, 102}
+        os.write(launcher._ready_write, b'3\n')
+        launcher._read_ready(1.0)
+        assert launcher.ready == {101, 102, 103}
+        assert launcher._replaced(0, 0) and not launcher._replaced(101, 0)
+    finally:
+        os.close(launcher._ready_read)
+        os.close(launcher._ready_write)
+
+def test_serve_replaces_and_restarts_workers():
+    """serve.py replaces crashed workers, and on SIGHUP restarts them one at a time while reaping the others"""
+    import multiprocessing
+    import signal
+    import socket
+    import serve
+    
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, 'tiny_app.py'), 'w') as f:
+            f.write(_TINY_APP)
+        sys.path.insert(0, root)
+        saved = serve.APP_MODULES['flask']
+        serve.APP_MODULES['flask'] = 'tiny_app'
+        os.environ['TINY_APP_STARTUP'] = '1.0'
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(64)
+        url = f'http://127.0.0.1:{sock.getsockname()[1]}/pid'
+        # Without preloading every worker takes TINY_APP_STARTUP to come up
+        launcher = multiprocessing.get_context('fork').Process(
+            target=serve.Launcher('flask', sock, 2, preload=False).run)
+        try:
+            launcher.start()
+            _wait_until(lambda: len(_child_pids(launcher.pid)) == 2)
+            workers = _child_pids(launcher.pid)
+            _wait_until(lambda: _served_by(url) in workers)
+            
+            crashed = min(workers)
+            os.kill(crashed, signal.SIGKILL)
+            _wait_until(lambda: crashed not in _child_pids(launcher.pid) and len(_child_pids(launcher.pid)) == 2)
+            workers = _child_pids(launcher.pid)
+            
+            # Workers are replaced in the order they were forked; while the
+            # first replacement starts, its sibling dies and is reaped at once
+            os.kill(launcher.pid, signal.SIGHUP)
+            _wait_until(lambda: len(_child_pids(launcher.pid)) == 3)
+            sibling = max(workers)
+            os.kill(sibling, signal.SIGKILL)
+            _wait_until(lambda: _is_reaped(sibling), timeout=0.5)
+            
+            _wait_until(lambda: len(_child_pids(launcher.pid)) == 2 and not _child_pids(launcher.pid) & workers)
+            _wait_until(lambda: _served_by(url) in _child_pids(launcher.pid))
+            
+            os.kill(launcher.pid, signal.SIGTERM)
+            launcher.join(30)
+            assert launcher.exitcode == 0
+        finally:
+            if launcher.is_alive():
+                for pid in _child_pids(launcher.pid):
+                    os.kill(pid, signal.SIGKILL)
+                launcher.kill()
+            sock.close()
+            serve.APP_MODULES['flask'] = saved
+            os.environ.pop('TINY_APP_STARTUP', None)
+            sys.path.remove(root)
+
 if __name__ == '__main__':
     print("Starting biometric tests...")
     test_face_processing()
     test_fingerprint_processing()
     test_vector_comparison()
+    test_timed_out_modality_is_not_fused()
+    test_strong_modality_does_not_carry_a_mismatch()
+    test_coalesced_call_outlives_cancelled_caller()
+    test_joiner_with_longer_budget_outlives_leader_deadline()
+    test_bulk_enrollment_from_tar()
+    test_bulk_enrollment_endpoint()
+    test_face_stream_counts_each_frame_once()
+    test_face_stream_sweep_skips_locked_sessions()
+    test_admission_rejects_with_retry_after()
+    test_admission_is_sized_per_server_worker()
+    test_cpu_bound_calls_are_bounded_and_time_out()
+    test_upload_limit_is_enforced_while_streaming()
+    test_binary_face_upload_limit()
+    test_embedding_cache_hits_and_evicts()
+    test_resent_face_skips_encoding()
+    test_face_pool_survives_worker_crashes()
+    test_detection_runs_on_a_downscaled_frame()
+    test_detection_and_encoding_overlap()
+    test_serve_records_every_ready_worker()
+    test_serve_replaces_and_restarts_workers()
     print("\nBiometric tests completed.") 
\ No newline at end of file
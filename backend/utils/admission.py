@@ -0,0 +1,177 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Optional
+
+def cores_per_worker() -> int:
+    """
+    CPU cores this process can count on
+    Returns:
+        The CPU count divided by the SERVER_WORKERS processes serve.py runs
+        on the box, at least 1
+    """
+    workers = max(int(os.environ.get('SERVER_WORKERS', 1)), 1)
+    return max((os.cpu_count() or 1) // workers, 1)
+
+class Overloaded(Exception):
+    """Raised when a request is turned away instead of queued"""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(f"Server overloaded ({reason}), retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+class AdmissionController:
+    """
+    Bounded work queue in front of CPU-heavy endpoints.
+
+    At most `concurrency` requests run at once and at most `max_queue` more
+    wait for a slot, in arrival order. Anything beyond that is rejected
+    straight away with a Retry-After estimate, so a rush costs the late
+    clients a quick retry instead of making every client time out together.
+    """
+
+    def __init__(self,
+                 concurrency: Optional[int] = None,
+                 max_queue: Optional[int] = None,
+                 max_wait: float = 10.0):
+        """
+        Args:
+            concurrency: Requests processed at once, defaults to this worker's
+                share of the CPU cores
+            max_queue: Requests allowed to wait for a slot, defaults to twice the concurrency
+            max_wait: Seconds a queued request waits for a slot before it is rejected
+        """
+        self.concurrency = concurrency or cores_per_worker()
+        self.max_queue = self.concurrency * 2 if max_queue is None else max_queue
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._running = 0
+        self._waiters: Deque[object] = deque()
+        # Smoothed service time, seeds the Retry-After estimate
+        self._service_time = 1.0
+        self._stats = {
+            'admitted': 0,
+            'rejected_full': 0,
+            'rejected_timeout': 0,
+            'started': 0,
+            'completed': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+
+    def enter(self) -> float:
+        """
+        Reserve a place in the system without waiting
+        Returns:
+            Monotonic admission time, to pass to start()
+        Raises:
+            Overloaded: When every slot and queue place is taken
+        """
+        with self._condition:
+            if self._in_flight >= self.concurrency + self.max_queue:
+                self._stats['rejected_full'] += 1
+                raise Overloaded(self._retry_after(), "queue full")
+            self._in_flight += 1
+            self._stats['admitted'] += 1
+            return time.monotonic()
+
+    def start(self, entered: float, wait: bool = True) -> None:
+        """
+        Move an admitted request from the queue to a processing slot
+        Args:
+            entered: Time returned by enter()
+            wait: Whether to wait for a free slot; callers whose own
+                worker pool already caps concurrency pass False
+        Raises:
+            Overloaded: When no slot frees up within max_wait; the
+                reservation is then released
+        """
+        with self._condition:
+            if wait:
+                deadline = entered + self.max_wait
+                ticket = object()
+                self._waiters.append(ticket)
+                try:
+                    # Slots go out in arrival order, newcomers can't overtake the queue
+                    while self._running >= self.concurrency or self._waiters[0] is not ticket:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._in_flight -= 1
+                            self._stats['rejected_timeout'] += 1
+                            raise Overloaded(self._retry_after(), "queue wait timed out")
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiters.remove(ticket)
+                    self._condition.notify_all()
+            self._running += 1
+            self._stats['started'] += 1
+            waited = time.monotonic() - entered
+            self._stats['total_wait'] += waited
+            self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+
+    def finish(self, started: float) -> None:
+        """
+        Free a processing slot
+        Args:
+            started: Monotonic time processing began
+        """
+        with self._condition:
+            self._running -= 1
+            self._stats['completed'] += 1
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._condition.notify_all()
+
+    def leave(self) -> None:
+        """Release the reservation taken by enter()"""
+        with self._condition:
+            self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a processing slot for the duration of the block
+        Raises:
+            Overloaded: When the request is rejected
+        """
+        self.start(self.enter())
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.finish(started)
+            self.leave()
+
+    def _retry_after(self) -> int:
+        # Time for the current queue to drain, whole seconds between 1 and 60
+        queued = max(self._in_flight - self._running, 0)
+        return min(max(math.ceil(self._service_time * (queued + 1) / self.concurrency), 1), 60)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the queue metrics
+        Returns:
+            Dictionary with the limits, the current running and queued
+            requests, admission and rejection counts, and the mean and
+            maximum time admitted requests waited for a slot
+        """
+        with self._condition:
+            return {
+                'concurrency': self.concurrency,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queued': max(self._in_flight - self._running, 0),
+                'admitted': self._stats['admitted'],
+                'rejected': self._stats['rejected_full'] + self._stats['rejected_timeout'],
+                'rejected_queue_full': self._stats['rejected_full'],
+                'rejected_wait_timeout': self._stats['rejected_timeout'],
+                'completed': self._stats['completed'],
+                'mean_wait_ms': 1000 * self._stats['total_wait'] / max(self._stats['started'], 1),
+                'max_wait_ms': 1000 * self._stats['max_wait'],
+                'mean_service_ms': 1000 * self._service_time,
+                'retry_after': self._retry_after(),
+            }
@@ -1,13 +1,22 @@
 import os
+import re
 import json
 import numpy as np
 import cv2
 from pathlib import Path
 import shutil
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Voter IDs name files and directories, so they never contain path separators or dots
+VOTER_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def is_valid_voter_id(voter_id):
+    """Check that a voter ID is safe to use in a file or directory name"""
+    return isinstance(voter_id, str) and VOTER_ID_PATTERN.fullmatch(voter_id) is not None
+
 class DummyDatasetManager:
     """Manages the dummy fingerprint dataset for testing and development purposes"""
     
@@ -18,6 +27,8 @@ class DummyDatasetManager:
             dataset_path: Path to the dummy dataset directory
         """
         self.dataset_path = Path(dataset_path)
+        # metadata.json is read, modified and rewritten as a whole
+        self._metadata_lock = threading.Lock()
         self.ensure_dataset_exists()
         
     def ensure_dataset_exists(self):
@@ -57,6 +68,47 @@ class DummyDatasetManager:
         
         return fp_path
     
+    def add_fingerprints_batch(self, entries):
+        """Add a batch of fingerprints and their templates to the dummy dataset
+        
+        The metadata file is rewritten once for the whole batch instead of
+        once per fingerprint.
+        
+        Args:
+            entries: Iterable of (voter_id, fingerprint_image, metadata, template)
+                tuples; template may be None
+            
+        Returns:
+            List of voter IDs that were added
+            
+        Raises:
+            ValueError: If a voter ID is not safe to use as a directory name
+        """
+        entries = list(entries)
+        invalid = [voter_id for voter_id, _, _, _ in entries if not is_valid_voter_id(voter_id)]
+        if invalid:
+            raise ValueError(f"Invalid voter IDs: {', '.join(map(repr, invalid[:5]))}")
+        
+        added = {}
+        for voter_id, fingerprint_image, metadata, template in entries:
+            voter_dir = self.dataset_path / voter_id
+            voter_dir.mkdir(exist_ok=True)
+            cv2.imwrite(str(voter_dir / "fingerprint.jpg"), fingerprint_image)
+            if template is not None:
+                self.save_template(voter_id, template)
+            added[voter_id] = metadata or {}
+        
+        if added:
+            metadata_path = self.dataset_path / "metadata.json"
+            with self._metadata_lock:
+                with open(metadata_path, "r") as f:
+                    data = json.load(f)
+                data["fingerprints"].update(added)
+                with open(metadata_path, "w") as f:
+                    json.dump(data, f, indent=2)
+        
+        return list(added)
+    
     def get_fingerprint(self, voter_id):
         """Get a fingerprint from the dummy dataset
         
@@ -79,6 +131,60 @@ class DummyDatasetManager:
         
         return fingerprint, metadata
     
+    def save_template(self, voter_id, template):
+        """Save a precomputed fingerprint template for a voter
+        
+        Args:
+            voter_id: Unique ID for the voter
+            template: Template dictionary from FingerprintVerifier.create_template
+            
+        Returns:
+            Path to the saved template
+        """
+        voter_dir = self.dataset_path / voter_id
+        voter_dir.mkdir(exist_ok=True)
+        
+        # Write to a temporary file first so readers never see a partial template
+        template_path = voter_dir / "template.npz"
+        tmp_path = voter_dir / "template.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.array(template["version"]),
+            processed_image=template["processed_image"],
+            features=template["features"],
+            minutiae=template["minutiae"],
+            minutiae_types=template["minutiae_types"]
+        )
+        os.replace(tmp_path, template_path)
+        
+        return template_path
+    
+    def get_template(self, voter_id, version=None):
+        """Get the precomputed fingerprint template for a voter
+        
+        Args:
+            voter_id: Unique ID for the voter
+            version: Expected template version, or None to accept any version
+            
+        Returns:
+            Template dictionary, or None if missing or stale
+        """
+        template_path = self.dataset_path / voter_id / "template.npz"
+        
+        if not template_path.exists():
+            return None
+            
+        with np.load(template_path, allow_pickle=False) as data:
+            template = {key: data[key] for key in data.files}
+        template["version"] = str(template["version"])
+        
+        if version is not None and template["version"] != version:
+            logger.info(f"Stale fingerprint template for {voter_id}: "
+                        f"{template['version']} != {version}")
+            return None
+            
+        return template
+    
     def delete_fingerprint(self, voter_id):
         """Delete a fingerprint from the dummy dataset
         
@@ -105,13 +211,14 @@ class DummyDatasetManager:
         """Update the metadata for a voter"""
         metadata_path = self.dataset_path / "metadata.json"
         
-        with open(metadata_path, "r") as f:
-            data = json.load(f)
+        with self._metadata_lock:
+            with open(metadata_path, "r") as f:
+                data = json.load(f)
+                
+            data["fingerprints"][voter_id] = metadata
             
-        data["fingerprints"][voter_id] = metadata
-        
-        with open(metadata_path, "w") as f:
-            json.dump(data, f, indent=2)
+            with open(metadata_path, "w") as f:
+                json.dump(data, f, indent=2)
     
     def _get_metadata(self, voter_id):
         """Get metadata for a voter"""
@@ -126,14 +233,15 @@ class DummyDatasetManager:
         """Delete metadata for a voter"""
         metadata_path = self.dataset_path / "metadata.json"
         
-        with open(metadata_path, "r") as f:
-            data = json.load(f)
-            
-        if voter_id in data["fingerprints"]:
-            del data["fingerprints"][voter_id]
-            
-        with open(metadata_path, "w") as f:
-            json.dump(data, f, indent=2)
+        with self._metadata_lock:
+            with open(metadata_path, "r") as f:
+                data = json.load(f)
+                
+            if voter_id in data["fingerprints"]:
+                del data["fingerprints"][voter_id]
+                
+            with open(metadata_path, "w") as f:
+                json.dump(data, f, indent=2)
     
     def list_fingerprints(self):
         """List all fingerprints in the dataset
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import face_recognition
+import threading
+from typing import Optional, Tuple
+
+# (top, right, bottom, left) as used by face_recognition
+FaceLocation = Tuple[int, int, int, int]
+
+# The dlib models are shared module globals and crash when one model is used
+# from several threads at once. Each model has its own lock, so one request
+# can detect while another encodes; use FaceEncodingPool to run more in parallel
+_detector_locks = {"hog": threading.Lock(), "cnn": threading.Lock()}
+# face_encodings runs the landmark predictor, then the encoder
+_encoder_lock = threading.Lock()
+
+def pick_detection_scale(image_shape: Tuple[int, ...], max_side: int) -> float:
+    """
+    Pick the downscale factor for face detection from the input size
+    Args:
+        image_shape: Shape of the image (height, width[, channels])
+        max_side: Longest side the detector should see
+    Returns:
+        Scale factor in (0, 1]
+    """
+    longest = max(image_shape[0], image_shape[1])
+    if max_side <= 0 or longest <= max_side:
+        return 1.0
+    return max_side / float(longest)
+
+def face_area(location: FaceLocation) -> int:
+    """Area of a face box in pixels"""
+    top, right, bottom, left = location
+    return max(0, bottom - top) * max(0, right - left)
+
+def detect_largest_face(rgb_image: np.ndarray,
+                        scale: Optional[float] = None,
+                        max_side: int = 480,
+                        upsample: int = 1,
+                        model: str = "hog") -> Optional[FaceLocation]:
+    """
+    Detect faces on a downscaled copy of the image and return the largest one
+    Args:
+        rgb_image: Full resolution RGB image
+        scale: Fixed downscale factor, or None to pick it from max_side
+        max_side: Longest side of the detection image when scale is None
+        upsample: Number of times the detector upsamples the detection image
+        model: face_recognition detection model ("hog" or "cnn")
+    Returns:
+        Face box in full resolution coordinates, or None if no face was found
+    """
+    if scale is None:
+        scale = pick_detection_scale(rgb_image.shape, max_side)
+    if not 0.0 < scale <= 1.0:
+        raise ValueError(f"Detection scale must be in (0, 1], got {scale}")
+
+    if scale < 1.0:
+        small = cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        small = rgb_image
+
+    # face_recognition runs the HOG detector for any model but "cnn"
+    with _detector_locks["cnn" if model == "cnn" else "hog"]:
+        locations = face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model=model)
+    if not locations:
+        return None
+
+    # Several faces in frame: the voter is the one closest to the camera
+    top, right, bottom, left = max(locations, key=face_area)
+
+    # Scale the box back to full resolution
+    height, width = rgb_image.shape[:2]
+    return (
+        max(0, int(round(top / scale))),
+        min(width, int(round(right / scale))),
+        min(height, int(round(bottom / scale))),
+        max(0, int(round(left / scale)))
+    )
+
+def encode_face(rgb_image: np.ndarray, location: FaceLocation) -> Optional[np.ndarray]:
+    """
+    Compute the normalised 128D encoding of a face at a known location
+    Args:
+        rgb_image: Full resolution RGB image
+        location: Face box in full resolution coordinates
+    Returns:
+        Normalised 128D vector, or None if encoding failed
+    """
+    with _encoder_lock:
+        encodings = face_recognition.face_encodings(rgb_image, [location])
+    if not encodings:
+        return None
+    encoding = encodings[0]
+    return encoding / np.linalg.norm(encoding)
@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+from typing import BinaryIO, Optional, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# cv2.imdecode flags that decode JPEGs directly at a fraction of full size
+REDUCED_FLAGS = {
+    cv2.IMREAD_COLOR: {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8},
+    cv2.IMREAD_GRAYSCALE: {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                           8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
+class PayloadTooLarge(ValueError):
+    """Raised when an upload exceeds the allowed size"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Payload exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+def read_stream(stream: BinaryIO,
+                max_bytes: int,
+                content_length: Optional[int] = None,
+                chunk_size: int = 65536) -> memoryview:
+    """
+    Read an upload body into a single buffer, enforcing the size limit while streaming
+    Args:
+        stream: Request body stream
+        max_bytes: Maximum accepted body size
+        content_length: Declared body size, if known
+        chunk_size: Read size when the body size is not declared
+    Returns:
+        View of the body bytes
+    Raises:
+        PayloadTooLarge: If the body is larger than max_bytes
+    """
+    if content_length is not None:
+        if content_length > max_bytes:
+            raise PayloadTooLarge(max_bytes)
+        # Known size: read straight into one preallocated buffer
+        buffer = bytearray(content_length)
+        view = memoryview(buffer)
+        filled = 0
+        readinto = getattr(stream, 'readinto', None)
+        while filled < content_length:
+            if readinto is not None:
+                count = readinto(view[filled:])
+            else:
+                chunk = stream.read(min(chunk_size, content_length - filled))
+                count = len(chunk)
+                view[filled:filled + count] = chunk
+            if not count:
+                break
+            filled += count
+        return view[:filled]
+
+    # Chunked upload: grow the buffer, stop as soon as the limit is crossed
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise PayloadTooLarge(max_bytes)
+    return memoryview(buffer)
+
+def decode_image_buffer(buffer: Buffer,
+                        flags: int = cv2.IMREAD_COLOR,
+                        reduce_factor: int = 1) -> Optional[np.ndarray]:
+    """
+    Decode an encoded image without copying the input buffer
+    Args:
+        buffer: Encoded image bytes (JPEG, PNG, ...)
+        flags: cv2.IMREAD_COLOR or cv2.IMREAD_GRAYSCALE
+        reduce_factor: 1 for full resolution, or 2, 4 or 8 to decode at a
+            reduced size (much cheaper for JPEGs)
+    Returns:
+        Decoded image, or None if the buffer is not a valid image
+    """
+    if reduce_factor != 1:
+        try:
+            flags = REDUCED_FLAGS[flags][reduce_factor]
+        except KeyError:
+            raise ValueError(f"Unsupported reduce factor {reduce_factor}")
+
+    data = np.frombuffer(buffer, np.uint8)
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, flags)
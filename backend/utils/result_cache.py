@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+# Anything bigger than this is not an embedding
+MAX_EMBEDDING_SIZE = 4096
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of embeddings keyed by a digest of the raw image bytes.
+
+    Only the digest and the embedding are kept, never the image itself.
+    Entries expire after ttl seconds.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        """
+        Args:
+            max_entries: Maximum number of cached embeddings
+            ttl: Seconds an entry stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(data: Union[bytes, bytearray, memoryview, str]) -> bytes:
+        """
+        Compute the cache key of raw image data
+        Args:
+            data: Raw image bytes, or a base64 string
+        Returns:
+            128-bit digest
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        # SHA-256 is hardware accelerated on current CPUs, faster than blake2b
+        return hashlib.sha256(data).digest()[:16]
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """
+        Look up an embedding
+        Args:
+            key: Digest from EmbeddingCache.digest
+        Returns:
+            Copy of the cached embedding, or None on a miss
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1].copy()
+
+    def put(self, key: bytes, embedding: np.ndarray) -> None:
+        """
+        Store an embedding
+        Args:
+            key: Digest from EmbeddingCache.digest
+            embedding: 1-D embedding vector
+        """
+        embedding = np.asarray(embedding)
+        if embedding.ndim != 1 or embedding.size > MAX_EMBEDDING_SIZE:
+            raise ValueError("Only 1-D embeddings can be cached")
+        embedding = embedding.copy()
+        embedding.setflags(write=False)
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+class _Flight:
+    """A coalesced async call and the callers waiting for it"""
+
+    def __init__(self, task: asyncio.Future, deadline):
+        self.task = task
+        self.deadline = deadline
+        self.waiters = 0
+
+    def extend(self, deadline) -> None:
+        # The call may run until the last waiter gives up
+        if self.deadline is None or self.deadline.expires_at is None:
+            return
+        if deadline is None or deadline.expires_at is None:
+            self.deadline.expires_at = None
+        else:
+            self.deadline.expires_at = max(self.deadline.expires_at, deadline.expires_at)
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one.
+
+    The first call for a key runs the function; calls for the same key that
+    arrive while it is running wait for it and get the same result (or
+    exception) instead of repeating the work. An async call is never
+    cancelled on behalf of the callers still waiting for it. Nothing is kept once the call
+    returns, so this is de-duplication of in-flight work, not a cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {'leaders': 0, 'shared': 0}
+
+    @staticmethod
+    def key(*parts: Any) -> bytes:
+        """
+        Build a key from identifiers and raw payloads
+        Args:
+            *parts: Identifiers, bytes-like payloads or numpy arrays; None is allowed
+        Returns:
+            128-bit digest of all parts
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            if part is None:
+                data = b''
+            elif isinstance(part, (bytes, bytearray, memoryview)):
+                data = part
+            elif isinstance(part, np.ndarray):
+                # Same bytes in a different shape is a different image
+                digest.update(f'{part.dtype}{part.shape}'.encode())
+                data = np.ascontiguousarray(part).data
+            else:
+                data = str(part).encode('utf-8')
+            data = memoryview(data)
+            # Length prefix, so ('ab', 'c') and ('a', 'bc') differ
+            digest.update(data.nbytes.to_bytes(8, 'little'))
+            digest.update(data)
+        return digest.digest()[:16]
+
+    def do(self, key: Hashable, func: Callable, *args, timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Run func(*args) unless an identical call is already running
+        Args:
+            key: Identity of the call, see SingleFlight.key
+            func: Function to call
+            *args: Its arguments
+            timeout: Seconds to wait for a running call, None to wait until it finishes
+        Returns:
+            Tuple of (result, shared); shared is True when another call computed it
+        Raises:
+            Whatever func raised, or concurrent.futures.TimeoutError when the
+            running call did not finish within timeout
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(timeout), True
+        return self._run(key, future, func, *args), False
+
+    async def do_async(self, key: Hashable, func: Callable[..., Awaitable], *args, deadline=None) -> Tuple[Any, bool]:
+        """
+        Await func(*args, deadline) unless an identical call is already running
+        The call runs as a task of its own, so a caller that gives up or is
+        cancelled doesn't take it down for the others, and each caller waits
+        only until its own deadline. The call gets a copy of the first
+        caller's deadline, pushed back to the latest deadline of the callers
+        that join it, and is cancelled once none of them is waiting.
+        Args:
+            key: Identity of the call, see SingleFlight.key
+            func: Coroutine function to await, called with *args and the deadline
+            *args: Its arguments
+            deadline: This caller's Deadline (ai.utils.deadline), None to wait until the call finishes
+        Returns:
+            Tuple of (result, shared); shared is True when another caller started the call
+        Raises:
+            Whatever func raised, or asyncio.TimeoutError when the caller's
+            deadline passed first
+        """
+        timeout = None if deadline is None or deadline.expires_at is None else deadline.remaining()
+        with self._lock:
+            flight = self._flights.get(key)
+            shared = flight is not None
+            if shared:
+                self._stats['shared'] += 1
+                flight.extend(deadline)
+            else:
+                self._stats['leaders'] += 1
+                own = None if deadline is None else type(deadline)(deadline.expires_at)
+                flight = _Flight(asyncio.ensure_future(func(*args, own)), own)
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda task: self._land(key, flight))
+            flight.waiters += 1
+        try:
+            # Shielded: this caller timing out or being cancelled leaves the call running
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout), shared
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0 and not flight.task.done()
+                if abandoned and self._flights.get(key) is flight:
+                    # Nobody wants the result any more; a new caller starts afresh
+                    del self._flights[key]
+            if abandoned:
+                if flight.deadline is not None:
+                    flight.deadline.cancel()
+                flight.task.cancel()
+
+    def _land(self, key: Hashable, flight: "_Flight") -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        # Nobody may be left to see the outcome of an abandoned call
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats['shared'] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self._stats['leaders'] += 1
+            return future, True
+
+    def _run(self, key: Hashable, future: Future, func: Callable, *args) -> Any:
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(key, future)
+
+    def _leave(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'in_flight': len(self._calls) + len(self._flights), **self._stats}
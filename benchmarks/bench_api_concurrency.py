@@ -0,0 +1,103 @@
+"""
+Load test the FastAPI verify endpoint and check the event loop stays responsive.
+
+Client threads post synthetic fingerprints to /verify as fast as they can,
+backing off for Retry-After when turned away with a 429, while a probe
+polls /health. Latency percentiles cover the admitted (200) requests. A
+blocked event loop shows up as /health latency climbing to the duration of
+a verification; with the work offloaded it stays in the millisecond range.
+
+Start the API first, e.g.
+    cd backend && PYTHONPATH=.. uvicorn main:app --port 8000
+
+Usage:
+    python benchmarks/bench_api_concurrency.py --url http://localhost:8000 --clients 1 4 16
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import cv2
+import numpy as np
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+from ai.models.quantization import synthetic_fingerprints
+
+def run_load(url, api_key, images, clients, duration):
+    stop = threading.Event()
+    statuses = Counter()
+    verify_latencies, health_latencies = [], []
+    lock = threading.Lock()
+
+    def client(index):
+        session = requests.Session()
+        count = 0
+        while not stop.is_set():
+            image = images[(index + count) % len(images)]
+            count += 1
+            start = time.perf_counter()
+            response = session.post(f"{url}/verify", headers={"X-API-Key": api_key},
+                                    files={"fingerprint": ("fingerprint.png", image, "image/png")})
+            with lock:
+                if response.status_code == 200:
+                    verify_latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] += 1
+            if response.status_code == 429:
+                # Back off as told instead of hammering a saturated server
+                stop.wait(float(response.headers.get("Retry-After", 1)))
+
+    def probe():
+        session = requests.Session()
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.get(f"{url}/health")
+            health_latencies.append(time.perf_counter() - start)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    threads.append(threading.Thread(target=probe))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    verify_ms = np.array(verify_latencies) * 1000
+    health_ms = np.array(health_latencies) * 1000
+    return {
+        "verify_per_s": len(verify_ms) / duration,
+        "verify_p50_ms": np.percentile(verify_ms, 50) if len(verify_ms) else float("nan"),
+        "verify_p99_ms": np.percentile(verify_ms, 99) if len(verify_ms) else float("nan"),
+        "health_p50_ms": np.percentile(health_ms, 50),
+        "health_p99_ms": np.percentile(health_ms, 99),
+        "health_max_ms": health_ms.max(),
+        "statuses": dict(statuses),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--api-key", default="your-secret-api-key", help="X-API-Key header value")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16], help="Concurrent verify clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    args = parser.parse_args()
+
+    images = [cv2.imencode(".png", image)[1].tobytes() for image in synthetic_fingerprints(8)]
+
+    print(f"{'clients':>7} {'ok/s':>6} {'ok p50':>8} {'ok p99':>8} {'health p50':>11} {'health p99':>11} {'health max':>11}  statuses")
+    for clients in args.clients:
+        report = run_load(args.url, args.api_key, images, clients, args.duration)
+        print(f"{clients:>7} {report['verify_per_s']:>6.1f} {report['verify_p50_ms']:>6.0f}ms {report['verify_p99_ms']:>6.0f}ms "
+              f"{report['health_p50_ms']:>9.1f}ms {report['health_p99_ms']:>9.1f}ms {report['health_max_ms']:>9.1f}ms  "
+              f"{report['statuses']}")
+
+if __name__ == "__main__":
+    main()
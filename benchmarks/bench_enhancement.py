@@ -0,0 +1,70 @@
+"""
+Benchmark Fourier domain ridge enhancement against plain preprocessing.
+
+Renders synthetic fingerprints (curved ridges with a known ground truth),
+degrades them with noise, blur and a smudge, and reports the per-image cost
+and how many ridge pixels the binarisation gets right with and without
+enhancement. Minutiae counts on the degraded image are reported too, since
+spurious minutiae are what make noisy captures fail to match.
+
+Usage:
+    python benchmarks/bench_enhancement.py --noise 30 60 90
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+from ai.preprocessing.fingerprint_processor import FingerprintProcessor
+
+def synthetic_fingerprint(rng, size=224):
+    """Elliptic ridge pattern with a random centre and period, plus its ridge mask"""
+    yy, xx = np.mgrid[:size, :size]
+    cy, cx = rng.uniform(0.35, 0.65, 2) * size
+    period = rng.uniform(7.0, 11.0)
+    radius = np.hypot(yy - cy, (xx - cx) * rng.uniform(1.1, 1.5))
+    ridges = np.sin(2 * np.pi * radius / period) > 0
+    return np.where(ridges, 60, 200).astype(np.float32), ridges
+
+def degrade(image, rng, noise):
+    image = cv2.GaussianBlur(image, (5, 5), 0) + rng.normal(0, noise, image.shape)
+    top, left = rng.integers(20, 150, 2)
+    image[top:top + 40, left:left + 50] = image[top:top + 40, left:left + 50] * 0.4 + 120
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--noise", type=float, nargs="+", default=[30, 60, 90], help="Noise standard deviations")
+    parser.add_argument("--count", type=int, default=20, help="Fingerprints per noise level")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    processors = {"plain": FingerprintProcessor(), "enhanced": FingerprintProcessor(enhance=True)}
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'noise':>6} {'mode':>9} {'ms/image':>9} {'ridge acc':>10} {'minutiae':>9}")
+    for noise in args.noise:
+        samples = [synthetic_fingerprint(rng) for _ in range(args.count)]
+        degraded = [degrade(image, rng, noise) for image, _ in samples]
+        clean_minutiae = np.mean([len(processors["plain"].extract_minutiae(
+            processors["plain"].preprocess_image(image.astype(np.uint8)))[0]) for image, _ in samples])
+
+        for mode, processor in processors.items():
+            start = time.perf_counter()
+            processed = processor.preprocess_batch(degraded, workers=1)
+            elapsed = (time.perf_counter() - start) / len(degraded)
+
+            accuracy = np.mean([np.mean((image > 0) == ridges) for image, (_, ridges) in zip(processed, samples)])
+            minutiae = np.mean([len(processor.extract_minutiae(image)[0]) for image in processed])
+            print(f"{noise:>6.0f} {mode:>9} {elapsed * 1000:>9.2f} {accuracy:>10.3f} "
+                  f"{minutiae:>9.1f}  (clean: {clean_minutiae:.1f})")
+
+if __name__ == "__main__":
+    main()
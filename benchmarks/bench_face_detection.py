@@ -0,0 +1,94 @@
+"""
+Benchmark coarse-to-fine face detection against full resolution detection.
+
+Reports per-frame latency and detection recall for each detection size,
+using full resolution HOG detection on the same images as the reference.
+
+Usage:
+    python benchmarks/bench_face_detection.py --images backend/test_data
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "backend")]
+
+import face_recognition
+from utils.face_utils import detect_largest_face, face_area
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+def iou(box1, box2):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(box1[0], box2[0]), min(box1[1], box2[1])
+    bottom, left = min(box1[2], box2[2]), max(box1[3], box2[3])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    union = face_area(box1) + face_area(box2) - intersection
+    return intersection / union if union else 0.0
+
+def load_images(directory):
+    images = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append((path.name, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+    return images
+
+def time_call(fn, repeats):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, float(np.median(timings))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=str(ROOT / "backend" / "test_data"), help="Directory of test images")
+    parser.add_argument("--max-sides", type=int, nargs="+", default=[640, 480, 320, 240], help="Detection sizes to compare")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per image")
+    parser.add_argument("--min-iou", type=float, default=0.5, help="IoU needed to count a detection as recalled")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+
+    # Reference: full resolution detection, largest face
+    reference = {}
+    full_latency = []
+    for name, image in images:
+        locations, latency = time_call(lambda: face_recognition.face_locations(image, model="hog"), args.repeats)
+        reference[name] = max(locations, key=face_area) if locations else None
+        full_latency.append(latency)
+
+    with_face = [name for name, box in reference.items() if box is not None]
+    print(f"{len(images)} images, {len(with_face)} with a face at full resolution")
+    print(f"{'max side':>10} {'median ms':>10} {'p90 ms':>8} {'speedup':>8} {'recall':>8}")
+    full_median = np.median(full_latency) * 1000
+    print(f"{'full':>10} {full_median:>10.1f} {np.percentile(full_latency, 90) * 1000:>8.1f} {1.0:>8.2f} {1.0:>8.2f}")
+
+    for max_side in args.max_sides:
+        latency = []
+        recalled = 0
+        for name, image in images:
+            box, elapsed = time_call(lambda: detect_largest_face(image, max_side=max_side), args.repeats)
+            latency.append(elapsed)
+            if reference[name] is not None and box is not None and iou(box, reference[name]) >= args.min_iou:
+                recalled += 1
+        median = np.median(latency) * 1000
+        recall = recalled / len(with_face) if with_face else float("nan")
+        print(f"{max_side:>10} {median:>10.1f} {np.percentile(latency, 90) * 1000:>8.1f} "
+              f"{full_median / median:>8.2f} {recall:>8.2f}")
+
+if __name__ == "__main__":
+    main()
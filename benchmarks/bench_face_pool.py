@@ -0,0 +1,74 @@
+"""
+Benchmark face encoding throughput of FaceEncodingPool against worker count.
+
+Usage:
+    python benchmarks/bench_face_pool.py --images backend/test_data --workers 1 2 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "backend")]
+
+from services.face_encoding_pool import FaceEncodingPool
+from utils.face_utils import detect_largest_face, encode_face
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+def load_frames(directory):
+    frames = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+            if image is not None:
+                frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return frames
+
+def run_inline(frames):
+    for frame in frames:
+        location = detect_largest_face(frame)
+        if location is not None:
+            encode_face(frame, location)
+
+def run_pool(pool, frames):
+    futures = [pool.submit(frame) for frame in frames]
+    for future in futures:
+        future.result()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=str(ROOT / "backend" / "test_data"), help="Directory of test images")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()], help="Pool sizes to compare")
+    parser.add_argument("--frames", type=int, default=64, help="Frames submitted per run")
+    args = parser.parse_args()
+
+    images = load_frames(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+    frames = [images[i % len(images)] for i in range(args.frames)]
+
+    start = time.perf_counter()
+    run_inline(frames)
+    inline_fps = len(frames) / (time.perf_counter() - start)
+    print(f"{'workers':>8} {'frames/s':>10} {'speedup':>8}")
+    print(f"{'inline':>8} {inline_fps:>10.1f} {1.0:>8.2f}")
+
+    for workers in sorted(set(args.workers)):
+        pool = FaceEncodingPool(workers=workers).start()
+        try:
+            run_pool(pool, frames[:workers])  # warm every worker
+            start = time.perf_counter()
+            run_pool(pool, frames)
+            fps = len(frames) / (time.perf_counter() - start)
+        finally:
+            pool.close()
+        print(f"{workers:>8} {fps:>10.1f} {fps / inline_fps:>8.2f}")
+
+if __name__ == "__main__":
+    main()
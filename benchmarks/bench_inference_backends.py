@@ -0,0 +1,90 @@
+"""
+Benchmark the fingerprint model inference backends.
+
+Each backend runs in its own process so load time and memory are not
+skewed by the others. Reports load time, resident memory after warmup,
+whether TensorFlow got imported, single-image p50/p99 latency and batch
+throughput. Export the models first with python -m ai.models.export_model.
+
+Usage:
+    python benchmarks/bench_inference_backends.py --backends keras tflite onnx
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+def run_worker(backend, args):
+    from ai.config import AI_CONFIG
+    from ai.models.fingerprint_model import FingerprintModel
+
+    start = time.perf_counter()
+    config = dict(AI_CONFIG, inference_backend=backend, inference_threads=args.threads)
+    model = FingerprintModel.from_config(config)
+    rng = np.random.default_rng(0)
+    image = (rng.random((224, 224)) > 0.5).astype(np.float32)
+    model.extract_features(image)
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        model.extract_features(image)
+        latencies.append(time.perf_counter() - start)
+
+    batch = (rng.random((args.batch_size, 224, 224)) > 0.5).astype(np.float32)
+    model.extract_features_batch(batch)
+    start = time.perf_counter()
+    for _ in range(3):
+        model.extract_features_batch(batch)
+    throughput = 3 * args.batch_size / (time.perf_counter() - start)
+
+    print(json.dumps({
+        "backend": backend,
+        "load_s": load_time,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "tensorflow_imported": "tensorflow" in sys.modules,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "batch_images_per_s": throughput,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite", "onnx"], help="Backends to compare")
+    parser.add_argument("--repeats", type=int, default=100, help="Single-image timed runs")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per batched call")
+    parser.add_argument("--threads", type=int, default=None, help="Runtime threads for tflite and onnx")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args)
+        return
+
+    print(f"{'backend':>8} {'load s':>8} {'rss MB':>8} {'tf':>5} {'p50 ms':>8} {'p99 ms':>8} {'batch img/s':>12}")
+    for backend in args.backends:
+        command = [sys.executable, __file__, "--worker", backend, "--repeats", str(args.repeats),
+                   "--batch-size", str(args.batch_size)]
+        if args.threads:
+            command += ["--threads", str(args.threads)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+        if result.returncode or not lines:
+            print(f"{backend:>8} failed: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'no output'}")
+            continue
+        report = json.loads(lines[-1])
+        print(f"{backend:>8} {report['load_s']:>8.2f} {report['max_rss_mb']:>8.0f} {str(report['tensorflow_imported']):>5} "
+              f"{report['p50_ms']:>8.2f} {report['p99_ms']:>8.2f} {report['batch_images_per_s']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
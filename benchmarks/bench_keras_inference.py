@@ -0,0 +1,57 @@
+"""
+Benchmark the traced Keras inference path against model.predict.
+
+Both paths run the same fingerprint model. Reports the warmup cost, the
+first request after warmup, single-image p50/p99 latency, and the largest
+embedding difference between the two paths.
+
+Usage:
+    python benchmarks/bench_keras_inference.py --repeats 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+from ai.config import AI_CONFIG
+from ai.models.fingerprint_model import FingerprintModel
+from ai.models.inference_backends import KerasBackend
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=200, help="Single-image timed runs")
+    args = parser.parse_args()
+
+    model = FingerprintModel.from_config(dict(AI_CONFIG, inference_backend="keras"))
+    image = (np.random.default_rng(0).random((224, 224)) > 0.5).astype(np.float32)
+    features = {}
+
+    print(f"{'path':>9} {'warmup ms':>10} {'first ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for path, compiled in (("predict", False), ("compiled", True)):
+        model.backend = KerasBackend(model.model, compiled)
+        start = time.perf_counter()
+        model.warmup()
+        warmup = time.perf_counter() - start
+
+        start = time.perf_counter()
+        features[path] = model.extract_features(image)
+        first = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            model.extract_features(image)
+            latencies.append(time.perf_counter() - start)
+        print(f"{path:>9} {warmup * 1000:>10.1f} {first * 1000:>9.1f} "
+              f"{np.percentile(latencies, 50) * 1000:>8.2f} {np.percentile(latencies, 99) * 1000:>8.2f}")
+
+    print(f"max embedding difference: {np.abs(features['predict'] - features['compiled']).max():.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark micro-batched fingerprint feature extraction under concurrency.
+
+Client threads call FingerprintModel.extract_features concurrently, first
+with one forward pass per request and then through the batching queue.
+Reports throughput, per-request p50/p99 latency and the batcher metrics.
+
+Usage:
+    python benchmarks/bench_micro_batching.py --clients 1 8 32 --backend onnx
+"""
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+from ai.config import AI_CONFIG
+from ai.models.fingerprint_model import FingerprintModel
+
+def run_clients(model, image, clients, requests_per_client):
+    latencies = [[] for _ in range(clients)]
+    barrier = threading.Barrier(clients + 1)
+
+    def client(index):
+        barrier.wait()
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            model.extract_features(image)
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.concatenate(latencies)
+    return len(latencies) / elapsed, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="Concurrent client threads")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    parser.add_argument("--backend", default=AI_CONFIG["inference_backend"], help="Inference backend")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Largest batch per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="How long a request waits for a batch")
+    args = parser.parse_args()
+
+    model = FingerprintModel.from_config(dict(AI_CONFIG, inference_backend=args.backend, batching={}))
+    image = (np.random.default_rng(0).random((224, 224)) > 0.5).astype(np.float32)
+    model.extract_features_batch(np.stack([image] * args.max_batch_size))
+
+    print(f"{'clients':>7} {'mode':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11} {'max queue':>10}")
+    for clients in args.clients:
+        for mode in ("single", "batched"):
+            if mode == "batched":
+                model.enable_batching(args.max_batch_size, args.max_wait_ms)
+            throughput, p50, p99 = run_clients(model, image, clients, args.requests)
+            stats = model.batching_stats()
+            model.disable_batching()
+            batch = f"{stats['mean_batch_size']:>11.1f} {stats['max_queue_depth']:>10}" if stats else f"{'-':>11} {'-':>10}"
+            print(f"{clients:>7} {mode:>8} {throughput:>8.1f} {p50:>8.1f} {p99:>8.1f} {batch}")
+
+if __name__ == "__main__":
+    main()
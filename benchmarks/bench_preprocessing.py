@@ -0,0 +1,71 @@
+"""
+Benchmark batched fingerprint preprocessing against the per-image path.
+
+Reports images per second for preprocess_image in a loop and for
+preprocess_batch with each thread count, on a stack of fingerprint images
+(or random noise when no directory is given).
+
+Usage:
+    python benchmarks/bench_preprocessing.py --images data/fingerprints --workers 1 2 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+from ai.preprocessing.fingerprint_processor import FingerprintProcessor
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif"}
+
+def load_images(directory, count, size):
+    if directory is None:
+        rng = np.random.default_rng(0)
+        return list((rng.random((count, size, size)) * 255).astype(np.uint8))
+    images = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                images.append(image)
+    if not images:
+        raise SystemExit(f"No images found in {directory}")
+    # Repeat the directory contents up to the requested count
+    return [images[i % len(images)] for i in range(count)]
+
+def best_rate(fn, count, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return count / min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=None, help="Directory of fingerprint images, random noise if omitted")
+    parser.add_argument("--count", type=int, default=512, help="Images per batch")
+    parser.add_argument("--size", type=int, default=300, help="Side of the random images")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="Thread counts to compare")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per configuration")
+    args = parser.parse_args()
+
+    processor = FingerprintProcessor()
+    images = load_images(args.images, args.count, args.size)
+    out = np.empty((len(images),) + processor.preprocess_image(images[0]).shape, dtype=np.uint8)
+
+    rate = best_rate(lambda: [processor.preprocess_image(image) for image in images], len(images), args.repeats)
+    print(f"{'preprocess_image loop':<28} {rate:>10.0f} images/s")
+    for workers in args.workers:
+        rate = best_rate(lambda: processor.preprocess_batch(images, out=out, workers=workers), len(images), args.repeats)
+        print(f"{f'preprocess_batch x{workers}':<28} {rate:>10.0f} images/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measure request coalescing on the FastAPI verify endpoint under a retry storm.
+
+Each round sends a burst of identical uploads for every voter at once, as
+double clicks and kiosk retries do, and reads how many verifications the
+server actually ran from /stats. Without coalescing every copy runs the
+full pipeline; with it each burst costs one verification.
+
+Start the API first, e.g.
+    cd backend && PYTHONPATH=.. uvicorn main:app --port 8000
+
+Usage:
+    python benchmarks/bench_request_coalescing.py --url http://localhost:8000 --voters 4 --copies 1 4 8
+"""
+
+import argparse
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT)]
+
+from ai.models.quantization import synthetic_fingerprints
+
+def verifications(url):
+    return requests.get(f"{url}/stats").json()["stages"]["verifications"]
+
+def run_bursts(url, api_key, images, copies, rounds):
+    statuses = Counter()
+    latencies = []
+
+    def post(voter, image):
+        start = time.perf_counter()
+        response = requests.post(f"{url}/verify", params={"voter_id": voter}, headers={"X-API-Key": api_key},
+                                 files={"fingerprint": ("fingerprint.png", image, "image/png")})
+        return response.status_code, time.perf_counter() - start
+
+    before = verifications(url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(images) * copies) as executor:
+        for _ in range(rounds):
+            burst = [(f"V{voter:03d}", image) for voter, image in enumerate(images) for _ in range(copies)]
+            for status, latency in executor.map(lambda job: post(*job), burst):
+                statuses[status] += 1
+                latencies.append(latency)
+    elapsed = time.perf_counter() - start
+    requests_sent = sum(statuses.values())
+
+    latency_ms = np.array(latencies) * 1000
+    return {
+        "requests": requests_sent,
+        "verifications": verifications(url) - before,
+        "elapsed_s": elapsed,
+        "p50_ms": np.percentile(latency_ms, 50),
+        "p99_ms": np.percentile(latency_ms, 99),
+        "statuses": dict(statuses),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--api-key", default="your-secret-api-key", help="X-API-Key header value")
+    parser.add_argument("--voters", type=int, default=4, help="Distinct voters per burst")
+    parser.add_argument("--copies", type=int, nargs="+", default=[1, 4, 8], help="Identical requests per voter and burst")
+    parser.add_argument("--rounds", type=int, default=10, help="Bursts per run")
+    args = parser.parse_args()
+
+    images = [cv2.imencode(".png", image)[1].tobytes()
+              for image in synthetic_fingerprints(args.voters, impressions=1)]
+
+    print(f"{'copies':>6} {'requests':>8} {'verifications':>13} {'time':>7} {'p50':>8} {'p99':>8}  statuses")
+    for copies in args.copies:
+        report = run_bursts(args.url, args.api_key, images, copies, args.rounds)
+        print(f"{copies:>6} {report['requests']:>8} {report['verifications']:>13} {report['elapsed_s']:>6.1f}s "
+              f"{report['p50_ms']:>6.0f}ms {report['p99_ms']:>6.0f}ms  {report['statuses']}")
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,17 @@ from pathlib import Path
 import os
 
 from ai.preprocessing.fingerprint_processor import FingerprintProcessor
+from ai.config import AI_CONFIG, VERIFICATION_CONFIG
 from ai.models.fingerprint_model import FingerprintModel
-from ai.utils.verification import FingerprintVerifier
+from ai.models.batching import MicroBatcher
+from ai.models.inference_backends import (InferenceBackend, Int8Backend, KerasBackend, TFLiteBackend, check_parity,
+                                         export_tflite, load_backend)
+from ai.models.quantization import compare_models, quantize_int8, synthetic_fingerprints
+from ai.utils.deadline import Deadline, DeadlineExceeded
+from ai.utils.verification import FingerprintVerifier, cascade_limits
+from ai.preprocessing.quality import FingerprintQualityGate
+from ai.utils.minutiae_matching import match_minutiae
+from ai.utils.minutiae_descriptors import MinutiaeDescriptorExtractor, MinutiaeIndex
 
 # Test data directory
 TEST_DATA_DIR = Path(__file__).parent / "test_data"
@@ -60,6 +69,61 @@ def test_minutiae_extraction(fingerprint_processor):
         assert minutiae.shape[1] == 2  # x, y coordinates
         assert len(types) == len(minutiae)
 
+def test_minutiae_extraction_synthetic(fingerprint_processor):
+    """Test that cut ridges give endings and a joining ridge gives a bifurcation."""
+    yy, xx = np.mgrid[:224, :224]
+    radius = np.hypot(yy - 112, xx - 112)
+    image = ((np.sin(radius / 3.0) > 0.3) & (radius < 95)).astype(np.float64)
+    image[100:124, 150:180] = 0  # cut two rings on the right
+    image[15:75, 108:112] = 1    # ridge joining the rings from the top
+    
+    minutiae, types = fingerprint_processor.extract_minutiae(image)
+    
+    endings = minutiae[types == 0]
+    assert len(endings) == 4
+    assert np.all(endings[:, 0] > 140)
+    assert np.sum(types == 1) >= 1
+
+def test_ridge_enhancement():
+    """Test that ridge enhancement cleans up the binarisation of a noisy print."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:224, :224]
+    ridges = np.sin(2 * np.pi * np.hypot(yy - 100, (xx - 120) * 1.3) / 9.0) > 0
+    image = np.where(ridges, 60, 200) + rng.normal(0, 70, ridges.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    
+    plain = FingerprintProcessor().preprocess_image(image)
+    enhancer = FingerprintProcessor(enhance=True)
+    enhanced = enhancer.preprocess_image(image)
+    
+    assert enhanced.shape == (224, 224)
+    assert np.mean((enhanced > 0) == ridges) > np.mean((plain > 0) == ridges)
+    assert 'enhancement' in enhancer.get_config()
+
+@pytest.mark.parametrize('enhance', [False, True])
+def test_preprocess_batch_matches_preprocess_image(enhance):
+    """Test batch preprocessing gives exactly the per-image results."""
+    processor = FingerprintProcessor(enhance=enhance)
+    rng = np.random.default_rng(0)
+    # Mixed sizes and dtypes, as a list
+    images = synthetic_fingerprints(3) + [rng.random((180, 240)), (rng.random((300, 260)) * 255).astype(np.uint8)]
+    expected = np.stack([processor.preprocess_image(image) for image in images])
+    
+    for workers in (1, 3):
+        np.testing.assert_array_equal(processor.preprocess_batch(images, workers=workers), expected)
+    
+    # A reused output buffer, and a stack as input
+    out = np.full_like(expected, 7)
+    stack = np.stack(images[:6])
+    processor.preprocess_batch(stack, out=out[:6], workers=2)
+    np.testing.assert_array_equal(out[:6], expected[:6])
+    
+    # The per-thread scratch buffers left behind don't change later results
+    np.testing.assert_array_equal(processor.preprocess_image(images[-1]), expected[-1])
+    
+    with pytest.raises(ValueError):
+        processor.preprocess_batch(images, out=np.empty((len(images), 10, 10), dtype=np.uint8))
+
 def test_feature_extraction(fingerprint_model):
     """Test feature extraction."""
     # Create a dummy fingerprint image
@@ -86,8 +150,9 @@ def test_similarity_computation(fingerprint_model):
 
 def test_verification(fingerprint_verifier):
     """Test fingerprint verification."""
-    # Create dummy input and stored data
-    input_image = np.random.rand(224, 224)
+    # Synthetic ridge pattern, random noise would be rejected by the quality gate
+    y, x = np.mgrid[0:224, 0:224]
+    input_image = (127 + 100 * np.sin(x / 3.0 + y / 7.0)).astype(np.uint8)
     stored_features = np.random.rand(512)
     stored_minutiae = (np.random.rand(10, 2), np.random.randint(0, 2, 10))
     
@@ -140,6 +205,58 @@ def test_minutiae_similarity(fingerprint_verifier):
     # Check output range
     assert 0 <= similarity <= 1
 
+def test_vectorised_minutiae_matching():
+    """Test the vectorised matcher against the closest-unused-pair scan."""
+    rng = np.random.default_rng(0)
+    minutiae1 = rng.random((60, 2))
+    minutiae2 = minutiae1 + rng.normal(0, 0.02, minutiae1.shape)
+    same_type = np.zeros(60, dtype=int)
+    
+    # Reference: repeatedly take the closest pair of unused minutiae
+    distances = np.linalg.norm(minutiae1[:, None] - minutiae2[None], axis=2)
+    expected = []
+    while np.isfinite(distances).any():
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        expected.append(distances[i, j])
+        distances[i, :] = np.inf
+        distances[:, j] = np.inf
+    
+    matches = match_minutiae(minutiae1, same_type, minutiae2, same_type)
+    assert np.allclose(np.sort(matches), np.sort(expected))
+    
+    # Minutiae of different types are never paired
+    types1 = rng.integers(0, 2, 60)
+    types2 = rng.integers(0, 2, 60)
+    for method in ('greedy', 'hungarian'):
+        matches = match_minutiae(minutiae1, types1, minutiae2, types2, method)
+        assert len(matches) == min(np.sum(types1 == 0), np.sum(types2 == 0)) + \
+            min(np.sum(types1 == 1), np.sum(types2 == 1))
+
+def test_minutiae_descriptors_invariance():
+    """Test that descriptors survive rotation and translation of the finger."""
+    rng = np.random.default_rng(0)
+    extractor = MinutiaeDescriptorExtractor()
+    minutiae = rng.random((40, 2)) * 0.6 + 0.2
+    types = rng.integers(0, 2, 40)
+    
+    angle = 0.4
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    moved = (minutiae - 0.5) @ rotation.T + 0.5 + 0.05
+    
+    reference = extractor.compute(minutiae, types)
+    assert reference['bits'].dtype == np.uint8
+    assert extractor.match(reference, extractor.compute(moved, types)) > 0.95
+    
+    other = extractor.compute(rng.random((40, 2)), rng.integers(0, 2, 40))
+    assert extractor.match(reference, other) < 0.8
+    
+    # 1:N search finds the moved finger among others
+    index = MinutiaeIndex(extractor)
+    index.add('genuine', reference)
+    for i in range(20):
+        index.add(i, extractor.compute(rng.random((40, 2)), rng.integers(0, 2, 40)))
+    assert index.search(extractor.compute(moved, types))[0][0] == 'genuine'
+
 def test_model_save_load(fingerprint_model, tmp_path):
     """Test model saving and loading."""
     # Create a temporary path for the model
@@ -158,4 +275,356 @@ def test_model_save_load(fingerprint_model, tmp_path):
     # Verify the loaded model works
     test_image = np.random.rand(224, 224, 1)
     features = new_model.extract_features(test_image)
-    assert features.shape == (512,) 
\ No newline at end of file
+    assert features.shape == (512,) 
+
+class _LinearBackend(InferenceBackend):
+    """Stand-in backend computing a fixed linear projection."""
+    
+    def __init__(self, weights):
+        self.weights = weights
+    
+    def predict(self, batch):
+        return batch.reshape(len(batch), -1) @ self.weights
+
+def test_backend_parity():
+    """Test the embedding parity check between inference backends."""
+    rng = np.random.default_rng(0)
+    weights = rng.normal(size=(64, 16))
+    batch = rng.random((8, 8, 8, 1)).astype(np.float32)
+    
+    report = check_parity(_LinearBackend(weights), _LinearBackend(weights + 1e-6), batch)
+    assert report['passed']
+    
+    report = check_parity(_LinearBackend(weights), _LinearBackend(rng.normal(size=(64, 16))), batch)
+    assert not report['passed']
+    
+    with pytest.raises(ValueError):
+        load_backend('pytorch')
+
+def test_compiled_keras_backend():
+    """Test the traced keras path runs in inference mode and matches predict."""
+    import tensorflow as tf
+    
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input((8, 8, 1)),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(16),
+        tf.keras.layers.BatchNormalization(),
+        tf.keras.layers.Dropout(0.5),
+    ])
+    batch = np.random.default_rng(0).random((4, 8, 8, 1)).astype(np.float32)
+    
+    compiled = KerasBackend(model)
+    # Dropout is off, so repeated calls agree
+    np.testing.assert_array_equal(compiled.predict(batch), compiled.predict(batch))
+    np.testing.assert_allclose(compiled.predict(batch), KerasBackend(model, compiled=False).predict(batch), atol=1e-5)
+    # One trace serves every batch size
+    assert compiled.predict(batch[:1]).shape == (1, 16)
+    # load_backend honours the compiled flag
+    assert load_backend('keras', model)._infer is not None
+    assert load_backend('keras', model, compiled=False)._infer is None
+
+def test_tflite_backend_is_thread_safe(tmp_path):
+    """Test that concurrent callers of one interpreter each get their own embeddings."""
+    import tensorflow as tf
+    from concurrent.futures import ThreadPoolExecutor
+    
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input((16, 16, 1)),
+        tf.keras.layers.Conv2D(4, 3, activation='relu'),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(8),
+    ])
+    backend = TFLiteBackend(export_tflite(model, str(tmp_path / 'model.tflite')), num_threads=1)
+    images = np.random.default_rng(0).random((64, 16, 16, 1)).astype(np.float32)
+    expected = np.concatenate([backend.predict(images[i:i + 1]) for i in range(len(images))])
+    
+    # Mixed batch sizes make callers resize the shared input tensor under each other
+    def run(i):
+        size = 1 + i % 3
+        rows = np.arange(i, i + size) % len(images)
+        return rows, backend.predict(images[rows])
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for rows, result in pool.map(run, range(400)):
+            np.testing.assert_allclose(result, expected[rows], rtol=1e-4, atol=1e-5)
+
+def test_int8_quantization(fingerprint_processor, tmp_path):
+    """Test INT8 quantisation keeps embeddings close and reports decision flips."""
+    import tensorflow as tf
+    
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input((224, 224, 1)),
+        tf.keras.layers.Conv2D(8, 5, strides=4, activation='relu'),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation='relu'),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(32),
+    ])
+    images = synthetic_fingerprints(12)
+    assert len(images) == 24
+    batch = fingerprint_processor.preprocess_batch(images).astype(np.float32)[..., np.newaxis]
+    
+    path = quantize_int8(model, batch[:16], str(tmp_path / 'model_int8.tflite'))
+    report = compare_models(KerasBackend(model), Int8Backend(path), batch[16:], [0.75, 0.85, 0.95], repeats=5)
+    
+    assert report['pairs'] == 28
+    assert report['min_cosine'] > 0.95
+    assert 0 <= report['flip_rate'] <= 1
+    
+    # The written model is what INFERENCE_BACKEND=int8 serves
+    config = {**AI_CONFIG, 'inference_backend': 'int8', 'int8_path': path, 'batching': {}}
+    served = FingerprintModel.from_config(config)
+    assert served.backend.name == 'int8' and served.model is None
+    np.testing.assert_allclose(served.backend.predict(batch[16:]), Int8Backend(path).predict(batch[16:]))
+    assert FingerprintModel.config_weights_digest(config) == served.weights_digest()
+
+def test_micro_batching():
+    """Test that concurrent requests are batched and get their own results."""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    rng = np.random.default_rng(0)
+    backend = _LinearBackend(rng.normal(size=(64, 16)))
+    images = rng.random((32, 8, 8, 1)).astype(np.float32)
+    
+    batcher = MicroBatcher(backend.predict, max_batch_size=8, max_wait_ms=50)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda image: batcher.infer(image, timeout=5), images))
+        np.testing.assert_allclose(np.stack(results), backend.predict(images), rtol=1e-5)
+        
+        stats = batcher.stats()
+        assert stats['requests'] == 32
+        assert stats['batches'] < 32
+        assert max(stats['batch_size_histogram']) <= 8
+        
+        # A failing forward pass fails every request in its batch
+        with pytest.raises(ValueError):
+            batcher.infer(np.zeros((3, 3, 1), dtype=np.float32), timeout=5)
+        assert batcher.stats()['errors'] == 1
+    finally:
+        batcher.close()
+    
+    with pytest.raises(RuntimeError):
+        batcher.submit(images[0])
+
+def test_micro_batching_after_fork():
+    """Test that a batcher used before fork serves requests in the forked child."""
+    rng = np.random.default_rng(0)
+    backend = _LinearBackend(rng.normal(size=(64, 16)))
+    image = rng.random((8, 8, 1)).astype(np.float32)
+    
+    batcher = MicroBatcher(backend.predict, max_batch_size=8, max_wait_ms=5)
+    try:
+        # Warmed up in the parent, like serve.py's master before it forks
+        expected = batcher.infer(image, timeout=5)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                result = batcher.infer(image, timeout=5)
+                code = 0 if np.allclose(result, expected) else 2
+            finally:
+                os.write(write_fd, bytes([code]))
+                os._exit(0)
+        os.close(write_fd)
+        code = os.read(read_fd, 1)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        assert code == bytes([0])
+        # The parent's worker is unaffected
+        np.testing.assert_allclose(batcher.infer(image, timeout=5), expected)
+    finally:
+        batcher.close()
+
+def test_config_digest(fingerprint_processor):
+    """Test that the processing config digest tracks parameter changes."""
+    same = FingerprintProcessor()
+    different = FingerprintProcessor(threshold_c=3)
+    
+    assert fingerprint_processor.config_digest() == same.config_digest()
+    assert fingerprint_processor.config_digest() != different.config_digest()
+
+class _StubModel:
+    """Stand-in feature extractor, so template tests don't need the MobileNetV2 weights."""
+    
+    startup_timings = {'build': 0.0}
+    
+    def extract_features(self, image):
+        return np.resize(image.astype(np.float32).ravel(), 512)
+    
+    def weights_digest(self):
+        return 'stub'
+
+def test_create_template():
+    """Test enrollment template creation."""
+    verifier = FingerprintVerifier(model=_StubModel())
+    image = (np.random.rand(300, 300) * 255).astype(np.uint8)
+    
+    template = verifier.create_template(image)
+    
+    # Check template contents
+    assert template['version'] == verifier.template_version
+    assert template['version'].endswith('-stub')
+    assert template['processed_image'].shape == (224, 224)
+    assert template['features'].shape == (512,)
+    assert len(template['minutiae']) == len(template['minutiae_types'])
+
+def test_template_version_is_lazy():
+    """Test that a known weights digest versions templates without building the model."""
+    built = []
+    verifier = FingerprintVerifier(model_factory=lambda: built.append(1) or _StubModel(),
+                                   weights_digest='stub')
+    
+    assert verifier.template_version.endswith('-stub')
+    assert not built and not verifier.model_loaded
+
+def test_template_version_is_stable(tmp_path):
+    """Test that every build of a saved keras model gives templates the same version."""
+    import tensorflow as tf
+    
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input((16, 16, 1)),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(8),
+    ])
+    path = str(tmp_path / 'fingerprint_model.h5')
+    model.save(path)
+    config = {**AI_CONFIG, 'input_shape': (16, 16, 1), 'feature_dim': 8, 'inference_backend': 'keras',
+              'model_path': path, 'batching': {}}
+    
+    # Two builds, e.g. after a restart or in two forked workers
+    first = FingerprintVerifier(model_factory=lambda: FingerprintModel.from_config(config))
+    second = FingerprintVerifier(model_factory=lambda: FingerprintModel.from_config(config))
+    assert first.template_version == second.template_version
+    # And without building the model at all
+    lazy = FingerprintVerifier(model_factory=lambda: FingerprintModel.from_config(config),
+                               weights_digest=FingerprintModel.config_weights_digest(config))
+    assert lazy.template_version == first.template_version and not lazy.model_loaded
+
+def test_lazy_model():
+    """Test the verifier builds its model on first use only."""
+    built = []
+    
+    class _Model:
+        startup_timings = {'build': 0.0}
+    
+    verifier = FingerprintVerifier(model_factory=lambda: built.append(1) or _Model())
+    assert not built and not verifier.model_loaded
+    
+    assert isinstance(verifier.model, _Model)
+    assert verifier.model is verifier.model
+    assert built == [1] and verifier.model_loaded
+    assert {'processing', 'model', 'model_build'} <= set(verifier.startup_timings)
+
+def test_deadline():
+    """Test deadline checks between stages and minutiae skipping."""
+    assert Deadline().remaining() == float('inf')
+    deadline = Deadline.after(10)
+    assert not deadline.expired and deadline.allows(1) and not deadline.allows(60)
+    with pytest.raises(DeadlineExceeded):
+        deadline.check('test', needed=60)
+    deadline.cancel()
+    assert deadline.expired
+    with pytest.raises(DeadlineExceeded):
+        deadline.check('test')
+    
+    class _Model:
+        startup_timings = {}
+        def extract_features(self, image):
+            return np.ones(8)
+        def compute_similarity(self, a, b):
+            return 0.85
+    
+    verifier = FingerprintVerifier(check_quality=False, model=_Model())
+    image = (np.random.rand(300, 300) * 255).astype(np.uint8)
+    stored = (np.random.rand(10, 2), np.zeros(10))
+    
+    # Out of time before the first stage: no work is done
+    with pytest.raises(DeadlineExceeded):
+        verifier.verify_fingerprint(image, np.ones(8), stored, Deadline.after(0))
+    assert verifier.get_stage_stats()['deadline_exceeded'] == 1
+    assert verifier.get_stage_stats()['ai'] == 0
+    
+    # Gray-zone score but no time for minutiae matching: decided on the AI score
+    verifier._stage_seconds['minutiae'] = 60.0
+    result, confidence, metadata = verifier.verify_fingerprint(image, np.ones(8), stored, Deadline.after(5))
+    assert metadata['verification_method'] == 'ai_deadline'
+    assert confidence == 0.85 and result
+    assert verifier.get_stage_stats()['minutiae_skipped'] == 1
+
+def test_cascade_stage(fingerprint_verifier):
+    """Test that only gray-zone AI scores reach minutiae matching."""
+    fingerprint_verifier.cascade_reject_below = 0.75
+    fingerprint_verifier.cascade_accept_above = 0.95
+    
+    assert fingerprint_verifier._cascade_stage(0.5) == 'ai_rejected'
+    assert fingerprint_verifier._cascade_stage(0.85) is None
+    assert fingerprint_verifier._cascade_stage(0.99) == 'ai_accepted'
+    
+    # Disabled bands always run the full match
+    fingerprint_verifier.cascade_reject_below = None
+    fingerprint_verifier.cascade_accept_above = None
+    assert fingerprint_verifier._cascade_stage(0.0) is None
+    assert fingerprint_verifier._cascade_stage(1.0) is None
+
+@pytest.mark.parametrize('bands', [
+    (VERIFICATION_CONFIG['cascade_reject_below'], VERIFICATION_CONFIG['cascade_accept_above']),
+    (0.8, 0.95),  # too aggressive, narrowed
+    (None, None),
+])
+def test_cascade_keeps_hybrid_decisions(bands):
+    """Test that the cascade bands never change the decision of the full hybrid match."""
+    threshold, ai_weight, minutiae_weight = (VERIFICATION_CONFIG[key] for key in
+                                             ('similarity_threshold', 'ai_weight', 'minutiae_weight'))
+    verifier = FingerprintVerifier(similarity_threshold=threshold, ai_weight=ai_weight, minutiae_weight=minutiae_weight,
+                                   cascade_reject_below=bands[0], cascade_accept_above=bands[1],
+                                   model_factory=_StubModel)
+    
+    for ai in np.linspace(0, 1, 201):
+        # A cascade decision stands in for the hybrid score as the AI score alone
+        stage = verifier._cascade_stage(ai)
+        for minutiae in np.linspace(0, 1, 21):
+            hybrid = ai_weight * ai + minutiae_weight * minutiae >= threshold
+            assert (hybrid if stage is None else ai >= threshold) == hybrid, (ai, minutiae)
+    
+    # ai=0.96 with minutiae=0.2 scores 0.732: rejected, not accepted by the AI score alone
+    assert verifier._cascade_stage(0.96) is None
+    reject_below, accept_above = cascade_limits(threshold, ai_weight, minutiae_weight)
+    assert reject_below == pytest.approx((threshold - minutiae_weight) / ai_weight)
+    assert accept_above is None
+
+def test_quality_gate_accepts_textured_image():
+    """Test that a capture with ridge texture passes the quality gate."""
+    gate = FingerprintQualityGate()
+    
+    # Synthetic ridge pattern
+    y, x = np.mgrid[0:224, 0:224]
+    image = (127 + 100 * np.sin(x / 3.0 + y / 7.0)).astype(np.uint8)
+    
+    result = gate.check(image)
+    assert result['accepted']
+    assert 'reason' not in result
+
+@pytest.mark.parametrize("image,reason", [
+    (np.zeros((224, 224), np.uint8), 'too_dark'),
+    (np.full((224, 224), 255, np.uint8), 'too_bright'),
+    (np.full((224, 224), 128, np.uint8), 'no_ridges'),
+])
+def test_quality_gate_rejections(image, reason):
+    """Test that unusable captures are rejected with a reason."""
+    result = FingerprintQualityGate().check(image)
+    
+    assert not result['accepted']
+    assert result['reason'] == reason
+    assert result['message']
+
+def test_quality_gate_rejects_blur():
+    """Test that a heavily blurred capture is rejected as blurry."""
+    y, x = np.mgrid[0:224, 0:224]
+    image = (127 + 100 * np.sin(x / 3.0 + y / 7.0)).astype(np.uint8)
+    blurred = cv2.GaussianBlur(image, (0, 0), 4)
+    
+    result = FingerprintQualityGate().check(blurred)
+    assert not result['accepted']
+    assert result['reason'] == 'too_blurry'